@@ -113,6 +113,7 @@ const schema = a.schema({
       groups: a.string().array(), // Dynamic authorization groups
       filename: a.string().required(),
       pageCount: a.integer().default(0),
+      skippedPages: a.integer().array(), // Blank pages left out by upload_pages.py --blank-pages skip
       pagesReviewed: a.integer().default(0),
     })
     .secondaryIndexes((index) => [
@@ -135,11 +136,17 @@ const schema = a.schema({
       pageNumber: a.integer().required(),
       filename: a.string().required(),
       s3Key: a.string().required(),
+      thumbnailKey: a.string(), // Small JPEG preview of the page image
       reviewStatus: a.enum(["pending", "shred", "unsure", "retain"]),
       reviewedBy: a.string(),
       reviewedAt: a.datetime(),
       lockedBy: a.string(),
       lockedAt: a.datetime(),
+      // Ingest-time detections (scripts/upload_pages.py)
+      isBlank: a.boolean(),
+      inkCoverage: a.float(), // Fraction of the page area that is ink
+      pageHash: a.string(), // 64-bit perceptual hash, hex
+      duplicateOf: a.integer(), // Page number of a near-identical earlier page in the set
     })
     .secondaryIndexes((index) => [
       index("boxId").sortKeys(["pageNumber"]).name("byBox"),
@@ -172,6 +179,36 @@ const schema = a.schema({
       allow.groups(["admin"]),
       allow.groupsDefinedIn("groups"),
     ]),
+
+  // TenantProgress entity - one summary per tenant (id = tenantId), kept by
+  // scripts/progress_rollup.py from the Box table's stream
+  Box2CloudTenantProgress: a
+    .model({
+      tenantId: a.string().required(),
+      groups: a.string().array(), // Dynamic authorization groups
+      // Box id -> counters, status and recommendation, plus the stream
+      // sequence number the entry was built from
+      boxes: a.json(),
+      // Epoch seconds of the last rebuild; older stream records are stale
+      rebuiltAt: a.integer(),
+    })
+    .authorization((allow) => [
+      allow.groups(["admin"]),
+      allow.groupsDefinedIn("groups"),
+    ]),
+
+  // IngestLease entity - claims a PDF for one ingester in
+  // `upload_pages.py --distributed` (id = "{tenantId}#{setId}")
+  Box2CloudIngestLease: a
+    .model({
+      tenantId: a.string().required(),
+      setId: a.string().required(),
+      leaseOwner: a.string().required(), // host:pid:nonce of the ingester
+      leaseStatus: a.enum(["held", "done"]),
+      expiresAt: a.integer(), // Epoch seconds; a held lease past this may be taken over
+      heartbeatAt: a.integer(),
+    })
+    .authorization((allow) => [allow.groups(["admin"])]),
 });
 
 export type Schema = ClientSchema<typeof schema>;
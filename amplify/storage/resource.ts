@@ -6,6 +6,7 @@ import { defineStorage } from "@aws-amplify/backend";
  * S3 bucket for storing page images extracted from scanned PDFs.
  * Structure: {tenant}/{box}/{set}/page_{pageNumber}.png
  * Example: wth/001/box_001_20251110_173850/page_0001.png
+ * Thumbnails: {tenant}/{box}/{set}/thumbs/page_{pageNumber}.jpg
  *
  * Access: Each tenant's files are restricted to their Cognito groups.
  * When adding a new tenant, add a new path rule below.
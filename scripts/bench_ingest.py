@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Ingest Benchmark
+
+Generates synthetic scanner PDFs, runs upload_pages.py end to end against a
+local moto server standing in for S3 and DynamoDB, and reports pages/s,
+peak RSS and per-stage time. Results can be saved as a named baseline and
+later runs compared against it, so a slower change is caught before it
+reaches a real box of scans.
+
+Usage:
+    # Benchmark the default settings
+    python bench_ingest.py
+
+    # 20 PDFs of 30 pages, best of 3 runs, comparing against the saved baseline
+    python bench_ingest.py --pdfs 20 --pages 30 --repeat 3 --compare
+
+    # Benchmark other settings; everything after -- goes to upload_pages.py
+    python bench_ingest.py --name pymupdf-auto --save-baseline -- --renderer pymupdf --format auto
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import boto3
+from moto.server import ThreadedMotoServer
+from PIL import Image, ImageDraw
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+BASELINE_FILE = SCRIPT_DIR / "bench_baselines.json"
+
+BENCH_ENV = "bench"
+BENCH_TENANT = "bench"
+BENCH_BUCKET = "box2cloud-pages-bench"
+BENCH_REGION = "us-east-1"
+
+# Letter size at 150 DPI, the resolution upload_pages renders at
+PAGE_SIZE = (1275, 1650)
+
+# Share of generated pages that are blank separator sheets and color photos;
+# the rest are black-and-white text
+BLANK_PAGE_SHARE = 0.1
+COLOR_PAGE_SHARE = 0.1
+
+# A run fails --compare if pages/s drops, or peak RSS grows, by more than this
+DEFAULT_TOLERANCE = 0.10
+
+
+def text_page(rng: random.Random) -> Image.Image:
+    """A grayscale page of ruled 'text' lines, like a typed letter."""
+    image = Image.new("L", PAGE_SIZE, 250)
+    draw = ImageDraw.Draw(image)
+    y = 120
+    while y < PAGE_SIZE[1] - 140:
+        x = 110
+        line_end = rng.randint(700, PAGE_SIZE[0] - 110)
+        while x < line_end:
+            word = rng.randint(20, 90)
+            draw.rectangle((x, y, x + word, y + 14), fill=rng.randint(10, 60))
+            x += word + rng.randint(10, 18)
+        y += rng.choice((28, 28, 28, 56))
+    return image
+
+
+def photo_page(rng: random.Random) -> Image.Image:
+    """A color page of soft gradients and blobs, like a photo or letterhead."""
+    image = Image.new("RGB", PAGE_SIZE, (245, 242, 235))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(PAGE_SIZE[0]), rng.randrange(PAGE_SIZE[1])
+        radius = rng.randint(40, 260)
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    return image
+
+
+def blank_page(rng: random.Random) -> Image.Image:
+    """An almost-white sheet with a little scanner dust."""
+    image = Image.new("L", PAGE_SIZE, 252)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(0, 12)):
+        x, y = rng.randrange(PAGE_SIZE[0]), rng.randrange(PAGE_SIZE[1])
+        draw.point((x, y), fill=rng.randint(100, 200))
+    return image
+
+
+def generate_pdfs(folder: Path, pdf_count: int, pages: int, seed: int) -> int:
+    """Write pdf_count box_NNN_YYYYMMDD_HHMMSS.pdf files; returns the page total."""
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1, 9, 0, 0)
+    for index in range(pdf_count):
+        images = []
+        for _ in range(pages):
+            roll = rng.random()
+            if roll < BLANK_PAGE_SHARE:
+                images.append(blank_page(rng))
+            elif roll < BLANK_PAGE_SHARE + COLOR_PAGE_SHARE:
+                images.append(photo_page(rng))
+            else:
+                images.append(text_page(rng))
+        scanned = started + timedelta(minutes=7 * index)
+        name = f"box_{index // 5 + 1:03d}_{scanned:%Y%m%d_%H%M%S}.pdf"
+        images[0].save(folder / name, "PDF", resolution=150,
+                       save_all=True, append_images=images[1:])
+        for image in images:
+            image.close()
+    return pdf_count * pages
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bench_session():
+    """boto3 session with moto's dummy credentials, whatever the user has configured."""
+    return boto3.Session(
+        aws_access_key_id="testing", aws_secret_access_key="testing", region_name=BENCH_REGION,
+    )
+
+
+def create_backend(endpoint: str) -> None:
+    """Create the Amplify tables (with their GSIs) and the page bucket in moto."""
+    session = bench_session()
+    dynamodb = session.client("dynamodb", endpoint_url=endpoint)
+    s3 = session.client("s3", endpoint_url=endpoint)
+
+    def index(name: str, hash_key: str, range_key: str | None = None) -> dict:
+        key_schema = [{"AttributeName": hash_key, "KeyType": "HASH"}]
+        if range_key:
+            key_schema.append({"AttributeName": range_key, "KeyType": "RANGE"})
+        return {"IndexName": name, "KeySchema": key_schema, "Projection": {"ProjectionType": "ALL"}}
+
+    definitions = {
+        "Box": ({"tenantId": "S", "boxNumber": "S"},
+                [index("byTenant", "tenantId", "boxNumber")]),
+        "Set": ({"boxId": "S", "setId": "S", "tenantId": "S"},
+                [index("byBox", "boxId", "setId"), index("byTenant", "tenantId")]),
+        "Page": ({"boxId": "S", "pageNumber": "N", "tenantId": "S", "reviewStatus": "S"},
+                 [index("byBox", "boxId", "pageNumber"),
+                  index("byTenantAndStatus", "tenantId", "reviewStatus")]),
+        "UserReview": ({"userId": "S", "tenantId": "S"},
+                       [index("byUser", "userId"), index("byTenant", "tenantId")]),
+        "IngestLease": ({}, []),
+        "TenantProgress": ({}, []),
+    }
+    for model, (attributes, indexes) in definitions.items():
+        attributes = dict(attributes, id="S")
+        table_args = {"GlobalSecondaryIndexes": indexes} if indexes else {}
+        dynamodb.create_table(
+            TableName=f"Box2Cloud{model}-{BENCH_ENV}-NONE",
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": name, "AttributeType": kind} for name, kind in attributes.items()
+            ],
+            **table_args,
+        )
+    s3.create_bucket(Bucket=BENCH_BUCKET)
+
+
+def reset_backend(endpoint: str) -> None:
+    """Drop everything moto holds, so each run starts from an empty account."""
+    request = urllib.request.Request(f"{endpoint}/moto-api/reset", method="POST")
+    urllib.request.urlopen(request).close()
+    create_backend(endpoint)
+
+
+def ingest_env(endpoint: str) -> dict:
+    """Environment that points upload_pages.py at the moto server."""
+    return dict(
+        os.environ,
+        AWS_ENDPOINT_URL=endpoint,
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWS_REGION=BENCH_REGION,
+        AWS_DEFAULT_REGION=BENCH_REGION,
+        S3_BUCKET=BENCH_BUCKET,
+        # Keep moto's tables out of the user's cached environments
+        XDG_CACHE_HOME=str(Path(tempfile.gettempdir()) / "box2cloud-bench-cache"),
+    )
+
+
+def ingest_command(pdf_folder: Path, manifest_path: Path, extra_args: list) -> list:
+    """upload_pages.py command line for the bench environment and tenant."""
+    return [
+        sys.executable, str(SCRIPT_DIR / "upload_pages.py"), str(pdf_folder),
+        "--env", BENCH_ENV, "--tenant", BENCH_TENANT,
+        "--manifest", str(manifest_path), *extra_args,
+    ]
+
+
+def run_ingest(endpoint: str, pdf_folder: Path, work_folder: Path, extra_args: list) -> dict:
+    """Run upload_pages.py once in a subprocess and return its measurements."""
+    stats_path = work_folder / "stats.json"
+    manifest_path = work_folder / "manifest.sqlite"
+    for path in (stats_path, manifest_path):
+        path.unlink(missing_ok=True)
+
+    env = ingest_env(endpoint)
+    command = ingest_command(pdf_folder, manifest_path,
+                             ["--stats-json", str(stats_path), *extra_args])
+
+    started = time.perf_counter()
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - started
+    if process.returncode != 0 or not stats_path.exists():
+        print(process.stdout[-4000:])
+        print(process.stderr[-4000:], file=sys.stderr)
+        raise RuntimeError(f"upload_pages.py exited with {process.returncode}")
+
+    # ru_maxrss is the largest single descendant so far, across all runs
+    # (KB on Linux, bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_rss_mb = max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    with open(stats_path) as f:
+        summary = json.load(f)
+    pages = summary["sets"]["pages"]
+    if summary["sets"]["errors"]:
+        raise RuntimeError(f"upload_pages.py reported {summary['sets']['errors']} failed sets")
+    return {
+        "pages": pages,
+        "wall_seconds": wall_seconds,
+        "pages_per_second": pages / wall_seconds if wall_seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb,
+        "stage_seconds": {name: stage["busy"] for name, stage in summary["stages"].items()},
+        "stage_utilization": {
+            name: stage["utilization"] for name, stage in summary["stages"].items()
+        },
+        "upload_mb": summary["stages"]["upload"]["bytes"] / 1e6,
+    }
+
+
+def print_result(name: str, result: dict) -> None:
+    print(f"\n{name}: {result['pages']} pages in {result['wall_seconds']:.1f}s")
+    print(f"  Throughput: {result['pages_per_second']:.2f} pages/s, "
+          f"{result['upload_mb'] / result['wall_seconds']:.2f} MB/s uploaded")
+    print(f"  Peak RSS:   {result['peak_rss_mb']:.0f} MB (largest process)")
+    print("  Stage busy time:")
+    for stage, seconds in result["stage_seconds"].items():
+        print(f"    {stage:<7} {seconds:8.2f}s  ({result['stage_utilization'][stage]:.0%} utilized)")
+
+
+def load_baselines() -> dict:
+    if BASELINE_FILE.exists():
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def compare(name: str, result: dict, baseline: dict, tolerance: float) -> bool:
+    """Print the change against a baseline; returns False on a regression."""
+    ok = True
+    speed = result["pages_per_second"] / baseline["pages_per_second"] - 1
+    memory = result["peak_rss_mb"] / baseline["peak_rss_mb"] - 1
+    print(f"\nCompared with baseline '{name}' ({baseline['recorded_at']}):")
+    print(f"  pages/s:  {baseline['pages_per_second']:.2f} -> {result['pages_per_second']:.2f} ({speed:+.1%})")
+    print(f"  peak RSS: {baseline['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB ({memory:+.1%})")
+    if speed < -tolerance:
+        print(f"  REGRESSION: throughput dropped by more than {tolerance:.0%}")
+        ok = False
+    if memory > tolerance:
+        print(f"  REGRESSION: peak RSS grew by more than {tolerance:.0%}")
+        ok = False
+    return ok
+
+
+def main():
+    args = sys.argv[1:]
+    extra_args = []
+    if "--" in args:
+        split = args.index("--")
+        args, extra_args = args[:split], args[split + 1:]
+
+    pdf_count = 6
+    pages = 20
+    repeat = 1
+    seed = 1
+    name = "default"
+    save_baseline = False
+    check_baseline = False
+    tolerance = DEFAULT_TOLERANCE
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--pdfs", "--pages", "--repeat", "--seed"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                value = int(args[i + 1])
+                if args[i] == "--pdfs":
+                    pdf_count = value
+                elif args[i] == "--pages":
+                    pages = value
+                elif args[i] == "--repeat":
+                    repeat = value
+                else:
+                    seed = value
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a positive integer")
+                sys.exit(1)
+        elif args[i] == "--name":
+            if i + 1 < len(args):
+                name = args[i + 1]
+                i += 2
+            else:
+                print("Error: --name requires an argument")
+                sys.exit(1)
+        elif args[i] == "--tolerance":
+            try:
+                tolerance = float(args[i + 1])
+                i += 2
+            except (IndexError, ValueError):
+                print("Error: --tolerance requires a fraction, e.g. 0.1")
+                sys.exit(1)
+        elif args[i] == "--save-baseline":
+            save_baseline = True
+            i += 1
+        elif args[i] == "--compare":
+            check_baseline = True
+            i += 1
+        else:
+            print(f"Unknown option: {args[i]}")
+            print("Usage: python bench_ingest.py [--pdfs N] [--pages N] [--repeat N] [--seed N]")
+            print("                              [--name NAME] [--save-baseline] [--compare]")
+            print("                              [--tolerance F] [-- upload_pages.py options]")
+            sys.exit(1)
+
+    work_folder = Path(tempfile.mkdtemp(prefix="box2cloud-bench-"))
+    pdf_folder = work_folder / "pdfs"
+    pdf_folder.mkdir()
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto's per-request log lines
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    try:
+        print(f"Generating {pdf_count} PDFs of {pages} pages in {pdf_folder}...")
+        total_pages = generate_pdfs(pdf_folder, pdf_count, pages, seed)
+
+        results = []
+        for run in range(1, repeat + 1):
+            reset_backend(endpoint)
+            print(f"Run {run}/{repeat}: upload_pages.py {' '.join(extra_args)}".rstrip())
+            result = run_ingest(endpoint, pdf_folder, work_folder, extra_args)
+            if result["pages"] != total_pages:
+                # e.g. --blank-pages skip leaves blank pages out
+                print(f"  Note: {total_pages} pages generated, {result['pages']} ingested")
+            results.append(result)
+    finally:
+        server.stop()
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    best = max(results, key=lambda result: result["pages_per_second"])
+    print_result(name, best)
+
+    baselines = load_baselines()
+    ok = True
+    if check_baseline:
+        if name in baselines:
+            baseline = baselines[name]
+            if (baseline["pdfs"], baseline["pages_per_pdf"]) != (pdf_count, pages):
+                print(f"\nWarning: baseline '{name}' used {baseline['pdfs']} PDFs of "
+                      f"{baseline['pages_per_pdf']} pages")
+            ok = compare(name, best, baseline, tolerance)
+        else:
+            print(f"\nNo baseline named '{name}' in {BASELINE_FILE.name}; run with --save-baseline")
+
+    if save_baseline:
+        baselines[name] = dict(
+            best,
+            recorded_at=datetime.now().isoformat(timespec="seconds"),
+            pdfs=pdf_count,
+            pages_per_pdf=pages,
+            upload_args=extra_args,
+        )
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline '{name}' to {BASELINE_FILE}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Renderer Benchmark
+
+Renders the same PDF pages with each available page renderer in
+upload_pages.py and compares their throughput. Nothing is uploaded.
+
+Usage:
+    python bench_renderers.py /path/to/file.pdf
+    python bench_renderers.py /path/to/file.pdf --pages 20 --dpi 150 --repeat 3
+
+Requirements:
+    pip install boto3 pdf2image pillow numpy pymupdf
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import upload_pages
+
+
+def available_renderers() -> list:
+    """Renderer names whose dependencies are installed."""
+    names = []
+    for name in upload_pages.RENDERERS:
+        if name == "pymupdf" and upload_pages.import_pymupdf() is None:
+            print("Skipping pymupdf: PyMuPDF is not installed (pip install pymupdf)")
+            continue
+        names.append(name)
+    return names
+
+
+def bench_renderer(name: str, pdf_path: Path, pages: int, dpi: int) -> dict:
+    """Render `pages` pages once with one renderer; return timing and output size."""
+    upload_pages.RENDERER = name
+    started = time.perf_counter()
+    first_page_seconds = None
+    pixels = 0
+    for _, image in upload_pages.iter_pdf_images(pdf_path, dpi=dpi, first_page=1, last_page=pages):
+        if first_page_seconds is None:
+            first_page_seconds = time.perf_counter() - started
+        pixels += image.width * image.height
+        image.close()
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "first_page": first_page_seconds or 0.0, "pixels": pixels}
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python bench_renderers.py /path/to/file.pdf [--pages N] [--dpi N] [--repeat N]")
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    pdf_path = None
+    pages = None
+    dpi = 150
+    repeat = 3
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--pages", "--dpi", "--repeat"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                value = int(args[i + 1])
+                if args[i] == "--pages":
+                    pages = value
+                elif args[i] == "--dpi":
+                    dpi = value
+                else:
+                    repeat = value
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a positive integer")
+                sys.exit(1)
+        else:
+            pdf_path = Path(args[i])
+            i += 1
+
+    if pdf_path is None or not pdf_path.is_file():
+        print(f"Error: PDF not found: {pdf_path}")
+        sys.exit(1)
+
+    page_count = upload_pages.get_pdf_page_count(pdf_path)
+    pages = min(pages or page_count, page_count)
+    renderers = available_renderers()
+
+    print(f"Rendering {pages} of {page_count} pages of {pdf_path.name} at {dpi} DPI, "
+          f"best of {repeat} runs")
+    print()
+
+    results = {}
+    for name in renderers:
+        runs = [bench_renderer(name, pdf_path, pages, dpi) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        results[name] = {
+            "best": best,
+            "median": statistics.median(run["seconds"] for run in runs),
+        }
+
+    print(f"{'Renderer':<12} {'pages/s':>9} {'ms/page':>9} {'median s':>9} {'first page':>11}")
+    for name, result in results.items():
+        best = result["best"]
+        print(f"{name:<12} {pages / best['seconds']:>9.1f} "
+              f"{best['seconds'] / pages * 1000:>9.1f} {result['median']:>9.2f} "
+              f"{best['first_page'] * 1000:>9.0f}ms")
+
+    if len(results) == 2:
+        baseline = results["pdf2image"]["best"]["seconds"]
+        candidate = results["pymupdf"]["best"]["seconds"]
+        print(f"\npymupdf is {baseline / candidate:.2f}x the throughput of pdf2image")
+        pixels = {name: result["best"]["pixels"] for name, result in results.items()}
+        if pixels["pdf2image"] != pixels["pymupdf"]:
+            print(f"Note: output sizes differ ({pixels['pdf2image']} vs {pixels['pymupdf']} pixels)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Review Queue Contention Benchmark
+
+Seeds a local moto server with pending pages, then has several simulated
+reviewers claim and review pages at once with each queue strategy:
+
+    sharded  review_queue.ReviewQueue: random shard, conditional lock
+    head     the spec's flow: read the head of the queue (Limit 1), lock
+             it conditionally, move on when the lock is lost
+    scan     what the web client does today: list 1000 pages, take the
+             first pending unlocked one and lock it unconditionally
+
+For each it reports claims per second, claim latency, DynamoDB requests
+and lost lock races per claim, and pages handed to two reviewers at once.
+moto answers one request at a time and its queries get slower as the
+table grows, unlike DynamoDB's, so requests and lost locks per claim are
+the figures that carry over to AWS; the defaults are kept small for that
+reason.
+
+Usage:
+    python bench_review_queue.py
+    python bench_review_queue.py --pages 50000 --reviewers 10 --claims 1000
+    python bench_review_queue.py --strategies sharded,head --think-ms 50
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from bench_ingest import BENCH_ENV, BENCH_TENANT, bench_session, create_backend, free_port
+import review_queue
+from review_queue import ReviewError, ReviewQueue, utc_timestamp
+
+STRATEGIES = ("sharded", "head", "scan")
+BOX_PAGES = 500
+PAGES_PER_SET = 20
+
+
+def start_moto(port: int) -> subprocess.Popen:
+    """moto in its own process, so its CPU time doesn't compete with the reviewer threads."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/moto-api/").close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("moto server did not start")
+
+
+def bench_tables() -> dict:
+    return {
+        name: f"Box2Cloud{model}-{BENCH_ENV}-NONE"
+        for name, model in (("box", "Box"), ("page", "Page"), ("review", "UserReview"))
+    }
+
+
+def seed_pages(endpoint: str, page_count: int) -> None:
+    """Fresh tables holding `page_count` pending pages in boxes of BOX_PAGES."""
+    request = urllib.request.Request(f"{endpoint}/moto-api/reset", method="POST")
+    urllib.request.urlopen(request).close()
+    create_backend(endpoint)
+
+    dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+    tables = bench_tables()
+    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    box_count = (page_count + BOX_PAGES - 1) // BOX_PAGES
+    with dynamodb.Table(tables["box"]).batch_writer() as writer:
+        for box in range(1, box_count + 1):
+            writer.put_item(Item={
+                "id": f"box-{box:03d}", "tenantId": BENCH_TENANT, "boxNumber": f"{box:03d}",
+                "totalPages": min(BOX_PAGES, page_count - (box - 1) * BOX_PAGES),
+                "totalSets": 0, "pagesReviewed": 0, "pagesShred": 0, "pagesUnsure": 0,
+                "pagesRetain": 0, "status": "pending", "createdAt": now, "updatedAt": now,
+            })
+    with dynamodb.Table(tables["page"]).batch_writer() as writer:
+        for n in range(page_count):
+            box = n // BOX_PAGES + 1
+            set_number = n % BOX_PAGES // PAGES_PER_SET
+            set_id = f"box_{box:03d}_20250101_{set_number:06d}"
+            page_number = n % PAGES_PER_SET + 1
+            writer.put_item(Item={
+                "id": f"page-{n:06d}", "pageId": f"{set_id}_page_{page_number:04d}",
+                "setId": set_id, "boxId": f"box-{box:03d}", "tenantId": BENCH_TENANT,
+                "pageNumber": page_number, "filename": f"page_{page_number:04d}.png",
+                "s3Key": f"{BENCH_TENANT}/{box:03d}/{set_id}/page_{page_number:04d}.png",
+                "reviewStatus": "pending", "createdAt": now, "updatedAt": now,
+            })
+
+
+def scan_claim(queue: ReviewQueue, user_id: str) -> tuple[dict, str] | None:
+    """
+    ReviewPage.tsx's claim: list up to 1000 pages and lock the first free
+    one without a condition. Like the client, it never looks past the
+    first 1000 pages of the table.
+    """
+    table = queue.tables["page"]
+    pages = queue.client.scan(TableName=table, Limit=1000)["Items"]
+
+    now = datetime.now(timezone.utc)
+    expiry = utc_timestamp(now - timedelta(seconds=review_queue.LOCK_SECONDS))
+    free = sorted(
+        (page for page in pages if page.get("reviewStatus") == "pending" and (
+            not page.get("lockedBy") or page["lockedBy"] == user_id
+            or page.get("lockedAt", "") < expiry)),
+        key=lambda page: (page["setId"], int(page["pageNumber"])),
+    )
+    if not free:
+        return None
+    locked_at = utc_timestamp(now)
+    queue.client.update_item(
+        TableName=table, Key={"id": free[0]["id"]},
+        UpdateExpression="SET lockedBy = :user, lockedAt = :now",
+        ExpressionAttributeValues={":user": user_id, ":now": locked_at},
+    )
+    return free[0], locked_at
+
+
+def run_strategy(endpoint: str, strategy: str, reviewers: int, claim_target: int,
+                 think_seconds: float) -> dict:
+    """Run `reviewers` threads until claim_target pages have been claimed; return measurements."""
+    tables = bench_tables()
+    holders: dict[str, str] = {}
+    holders_lock = threading.Lock()
+    results = {"claims": [], "requests": 0, "conflicts": 0, "double_claims": 0,
+               "lost_reviews": 0, "reviews": 0, "busy": 0}
+    results_lock = threading.Lock()
+
+    # boto3 sessions aren't thread-safe to create, so every reviewer's
+    # client is made here; each reviewer is like its own Lambda container
+    queues = []
+    request_counts = []
+    for _ in range(reviewers):
+        dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+        if strategy == "head":
+            queue = ReviewQueue(dynamodb, tables, BENCH_TENANT, shard_count=1, shard_size=1)
+        else:
+            queue = ReviewQueue(dynamodb, tables, BENCH_TENANT)
+        count = Counter()
+        queue.client.meta.events.register(
+            "before-call.dynamodb", lambda count=count, **_: count.update(requests=1),
+        )
+        queues.append(queue)
+        request_counts.append(count)
+
+    def reviewer(index: int) -> None:
+        queue, count = queues[index], request_counts[index]
+        user_id = f"reviewer-{index}"
+        while True:
+            with results_lock:
+                if len(results["claims"]) >= claim_target:
+                    return
+            before = count["requests"]
+            started = time.perf_counter()
+            try:
+                claimed = scan_claim(queue, user_id) if strategy == "scan" else queue.claim_next_page(user_id)
+            except ReviewError:
+                with results_lock:
+                    results["busy"] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if not claimed:
+                return
+            page, _ = claimed
+            with holders_lock:
+                double = holders.get(page["id"]) not in (None, user_id)
+                holders[page["id"]] = user_id
+            with results_lock:
+                results["claims"].append(elapsed)
+                results["requests"] += count["requests"] - before
+                results["double_claims"] += double
+
+            time.sleep(think_seconds)
+            try:
+                queue.submit_review(page["id"], user_id, "shred")
+                reviewed = True
+            except ReviewError:
+                reviewed = False  # another reviewer took the lock over
+            with holders_lock:
+                if holders.get(page["id"]) == user_id:
+                    del holders[page["id"]]
+            with results_lock:
+                results["reviews"] += reviewed
+                results["lost_reviews"] += not reviewed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=reviewer, args=(n,)) for n in range(reviewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    results["conflicts"] = sum(queue.conflicts for queue in queues)
+    claims = sorted(results["claims"])
+    return {
+        "reviews": results["reviews"],
+        "claims": len(claims),
+        "claims_per_second": len(claims) / wall if wall else 0.0,
+        "p50_ms": statistics.median(claims) * 1000 if claims else 0.0,
+        "p95_ms": claims[int(len(claims) * 0.95) - 1] * 1000 if claims else 0.0,
+        "requests_per_claim": results["requests"] / max(len(claims), 1),
+        "conflicts_per_claim": results["conflicts"] / max(len(claims), 1),
+        "double_claims": results["double_claims"],
+        "lost_reviews": results["lost_reviews"],
+        "all_locked": results["busy"],
+    }
+
+
+def check_reviews(endpoint: str) -> list:
+    """Every page is reviewed at most once and box counters agree with the audit trail."""
+    dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+    tables = bench_tables()
+    problems = []
+    reviews = []
+    scan_args = {}
+    while True:
+        response = dynamodb.Table(tables["review"]).scan(**scan_args)
+        reviews.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    twice = [page for page, count in Counter(r["pageId"] for r in reviews).items() if count > 1]
+    if twice:
+        problems.append(f"{len(twice)} pages reviewed more than once")
+    # Seeded set IDs start with their box: box_NNN_...
+    wrong_box = [r for r in reviews if r.get("boxNumber") != r["setId"].split("_")[1]]
+    if wrong_box:
+        problems.append(f"{len(wrong_box)} reviews with the wrong boxNumber, "
+                        f"e.g. {wrong_box[0].get('boxNumber')!r} for {wrong_box[0]['setId']}")
+    boxes = dynamodb.Table(tables["box"]).scan()["Items"]
+    counted = sum(int(box.get("pagesReviewed", 0)) for box in boxes)
+    if counted != len(reviews):
+        problems.append(f"box counters say {counted} reviews, audit trail has {len(reviews)}")
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    page_count = 2000
+    reviewers = 10
+    claim_target = 100
+    think_ms = 0
+    strategies = list(STRATEGIES)
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--pages", "--reviewers", "--claims", "--think-ms"):
+            if i + 1 < len(args) and args[i + 1].isdigit():
+                value = int(args[i + 1])
+                if args[i] == "--pages":
+                    page_count = value
+                elif args[i] == "--reviewers":
+                    reviewers = value
+                elif args[i] == "--claims":
+                    claim_target = value
+                else:
+                    think_ms = value
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a non-negative integer")
+                sys.exit(1)
+        elif args[i] == "--strategies":
+            strategies = args[i + 1].split(",") if i + 1 < len(args) else []
+            if not strategies or any(name not in STRATEGIES for name in strategies):
+                print(f"Error: --strategies takes a comma-separated list of: {', '.join(STRATEGIES)}")
+                sys.exit(1)
+            i += 2
+        else:
+            print("Usage: python bench_review_queue.py [--pages N] [--reviewers N] [--claims N]")
+            print("                                    [--think-ms N] [--strategies sharded,head,scan]")
+            sys.exit(1)
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    server = start_moto(port)
+    results = {}
+    problems = {}
+    try:
+        for strategy in strategies:
+            print(f"Seeding {page_count} pending pages...")
+            seed_pages(endpoint, page_count)
+            print(f"Running {strategy}: {reviewers} reviewers, {claim_target} claims")
+            started = time.perf_counter()
+            results[strategy] = run_strategy(endpoint, strategy, reviewers, claim_target,
+                                             think_ms / 1000)
+            print(f"  done in {time.perf_counter() - started:.0f}s")
+            problems[strategy] = check_reviews(endpoint)
+    finally:
+        server.kill()
+
+    print(f"\n{page_count} pages, {reviewers} reviewers, {claim_target} claims, "
+          f"{think_ms}ms think time")
+    print(f"{'Strategy':<9} {'claims/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'req/claim':>10} "
+          f"{'lost locks':>11} {'double':>7} {'lost reviews':>13}")
+    for strategy, result in results.items():
+        print(f"{strategy:<9} {result['claims_per_second']:>9.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['requests_per_claim']:>10.2f} "
+              f"{result['conflicts_per_claim']:>11.2f} {result['double_claims']:>7} "
+              f"{result['lost_reviews']:>13}")
+    print("\n  lost locks: conditional lock writes that lost a race, per claim")
+    print("  double: pages handed to a second reviewer while the first still held them")
+
+    failed = False
+    for strategy, found in problems.items():
+        for problem in found:
+            print(f"  {strategy}: {problem}")
+        failed = failed or (strategy != "scan" and bool(found))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Box to Cloud - Box Record Helpers
+
+Box counter and status updates shared by upload_pages.py and the Lambdas
+(review_queue.py, progress_rollup.py). Only needs boto3, so the Lambdas
+can be deployed without the ingest script's image libraries.
+
+Requirements:
+    pip install boto3
+"""
+
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+def get_tenant_groups(tenant_id: str) -> list:
+    """Generate list of group names for a tenant (both viewer and reviewer)."""
+    return [
+        f"tenant_{tenant_id}_viewer",
+        f"tenant_{tenant_id}_reviewer",
+    ]
+
+
+def box_status(total_pages: int, pages_reviewed: int) -> str:
+    """Derive a box's status from its page counters."""
+    if total_pages == 0:
+        return "pending"
+    elif pages_reviewed >= total_pages:
+        return "complete"
+    elif pages_reviewed > 0:
+        return "in_progress"
+    else:
+        return "pending"
+
+
+def review_counter_deltas(pages: list, sign: int = 1) -> dict:
+    """Counter deltas for a list of page records, by their reviewStatus."""
+    deltas = {"pages": 0, "reviewed": 0, "shred": 0, "unsure": 0, "retain": 0}
+    for page in pages:
+        status = page.get("reviewStatus")
+        deltas["pages"] += sign
+        if status and status != "pending":
+            deltas["reviewed"] += sign
+        if status in ("shred", "unsure", "retain"):
+            deltas[status] += sign
+    return deltas
+
+
+def adjust_box_counters(dynamodb, table_name: str, box_id: str, sets: int = 0,
+                        pages: int = 0, reviewed: int = 0, shred: int = 0,
+                        unsure: int = 0, retain: int = 0) -> None:
+    """
+    Atomically add deltas to a box's counters and refresh its status.
+
+    The counters are changed with a single ADD, so concurrent ingesters and
+    reviewers never overwrite each other's updates. The status is derived
+    from the updated counters and only written if it changed; that second
+    write is conditional on the counters it was derived from, so a stale
+    status never replaces a newer one.
+    """
+    if not any((sets, pages, reviewed, shred, unsure, retain)):
+        return
+
+    table = dynamodb.Table(table_name)
+    response = table.update_item(
+        Key={"id": box_id},
+        UpdateExpression="ADD totalSets :sets, totalPages :pages, pagesReviewed :reviewed, pagesShred :shred, pagesUnsure :unsure, pagesRetain :retain SET updatedAt = :now",
+        ExpressionAttributeValues={
+            ":sets": sets,
+            ":pages": pages,
+            ":reviewed": reviewed,
+            ":shred": shred,
+            ":unsure": unsure,
+            ":retain": retain,
+            ":now": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        },
+        ReturnValues="ALL_NEW",
+    )
+    refresh_box_status(table, box_id, response["Attributes"])
+
+
+def refresh_box_status(table, box_id: str, box: dict) -> None:
+    """
+    Write the status derived from a box's counters, if it changed.
+
+    `box` is the box as read right after its counters were updated. The
+    write is conditional on those counters, so a stale status never
+    replaces a newer one.
+    """
+    total_pages = int(box.get("totalPages", 0))
+    pages_reviewed = int(box.get("pagesReviewed", 0))
+    status = box_status(total_pages, pages_reviewed)
+    if status == box.get("status"):
+        return
+
+    try:
+        table.update_item(
+            Key={"id": box_id},
+            UpdateExpression="SET #st = :status",
+            ConditionExpression="totalPages = :pages AND pagesReviewed = :reviewed",
+            ExpressionAttributeNames={"#st": "status"},
+            ExpressionAttributeValues={
+                ":status": status,
+                ":pages": total_pages,
+                ":reviewed": pages_reviewed,
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        # The counters moved again; whoever moved them refreshes the status
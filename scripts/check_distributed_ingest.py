@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Distributed Ingest Check
+
+Runs several `upload_pages.py --distributed` processes on one folder of
+synthetic scans against a local moto server, then checks that every page
+was recorded exactly once and that box counters match the records. With
+--kill, one node is killed part way through; once its leases expire the
+other nodes, which keep polling them, take its PDFs over and resume them
+from the page records it wrote. PDFs are longer than a record batch by
+default, so the killed node leaves partly recorded sets behind.
+
+Usage:
+    python check_distributed_ingest.py
+    python check_distributed_ingest.py --nodes 4 --pdfs 16 --pages 10 --kill
+
+    # Everything after -- goes to each upload_pages.py
+    python check_distributed_ingest.py --kill -- --renderer pymupdf
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import logging
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from moto.server import ThreadedMotoServer
+
+from bench_ingest import (
+    BENCH_ENV, bench_session, create_backend, free_port, generate_pdfs,
+    ingest_command, ingest_env,
+)
+from upload_pages import BATCH_WRITE_SIZE
+
+# Short leases so --kill's takeover happens within the check
+LEASE_SECONDS = 6
+
+# --kill stops node 0 once it has uploaded a record batch's worth of pages
+# and a little more, so its first batch is written; or after
+# KILL_AFTER_SECONDS, whichever comes first
+KILL_AFTER_PAGES = BATCH_WRITE_SIZE + 3
+KILL_AFTER_SECONDS = 120
+
+
+def scan_table(dynamodb, table_name: str) -> list:
+    table = dynamodb.Table(table_name)
+    response = table.scan()
+    items = response["Items"]
+    while "LastEvaluatedKey" in response:
+        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
+        items.extend(response["Items"])
+    return items
+
+
+def start_node(endpoint: str, pdf_folder: Path, work_folder: Path, node: int,
+               extra_args: list) -> subprocess.Popen:
+    """Start one ingester with its own manifest and log file."""
+    log = open(work_folder / f"node_{node}.log", "w")
+    command = ingest_command(
+        pdf_folder, work_folder / f"manifest_{node}.sqlite",
+        ["--distributed", "--lease-seconds", str(LEASE_SECONDS), *extra_args],
+    )
+    return subprocess.Popen(command, env=ingest_env(endpoint), stdout=log, stderr=subprocess.STDOUT)
+
+
+def check_results(endpoint: str, pdf_count: int, pages: int) -> list:
+    """Compare DynamoDB contents with what was generated; returns problems found."""
+    dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+    table = {model: f"Box2Cloud{model}-{BENCH_ENV}-NONE"
+             for model in ("Box", "Set", "Page", "IngestLease")}
+    problems = []
+
+    sets = scan_table(dynamodb, table["Set"])
+    page_items = scan_table(dynamodb, table["Page"])
+    if len(sets) != pdf_count:
+        problems.append(f"expected {pdf_count} sets, found {len(sets)}")
+    pages_per_set = Counter(item["setId"] for item in page_items)
+    for set_id, count in sorted(pages_per_set.items()):
+        if count != pages:
+            problems.append(f"{set_id}: expected {pages} pages, found {count}")
+    duplicates = [page_id for page_id, count in
+                  Counter(item["pageId"] for item in page_items).items() if count > 1]
+    if duplicates:
+        problems.append(f"{len(duplicates)} pages recorded more than once")
+
+    # Counters only add up if no PDF was counted by two nodes
+    pages_per_box = Counter(item["boxId"] for item in page_items)
+    sets_per_box = Counter(item["boxId"] for item in sets)
+    for box in scan_table(dynamodb, table["Box"]):
+        if int(box["totalPages"]) != pages_per_box[box["id"]]:
+            problems.append(f"box {box['boxNumber']}: totalPages {box['totalPages']}, "
+                            f"records {pages_per_box[box['id']]}")
+        if int(box["totalSets"]) != sets_per_box[box["id"]]:
+            problems.append(f"box {box['boxNumber']}: totalSets {box['totalSets']}, "
+                            f"records {sets_per_box[box['id']]}")
+
+    leases = scan_table(dynamodb, table["IngestLease"])
+    not_done = [lease["setId"] for lease in leases if lease["leaseStatus"] != "done"]
+    if len(leases) != pdf_count or not_done:
+        problems.append(f"{len(leases)} leases, not done: {not_done}")
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    extra_args = []
+    if "--" in args:
+        split = args.index("--")
+        args, extra_args = args[:split], args[split + 1:]
+
+    nodes = 3
+    pdf_count = 12
+    pages = 30
+    kill = False
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--nodes", "--pdfs", "--pages"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                value = int(args[i + 1])
+                if args[i] == "--nodes":
+                    nodes = value
+                elif args[i] == "--pdfs":
+                    pdf_count = value
+                else:
+                    pages = value
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a positive integer")
+                sys.exit(1)
+        elif args[i] == "--kill":
+            kill = True
+            i += 1
+        else:
+            print("Usage: python check_distributed_ingest.py [--nodes N] [--pdfs N] [--pages N] [--kill] "
+                  "[-- upload_pages.py options]")
+            sys.exit(1)
+
+    work_folder = Path(tempfile.mkdtemp(prefix="box2cloud-distributed-"))
+    pdf_folder = work_folder / "pdfs"
+    pdf_folder.mkdir()
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto's per-request log lines
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    try:
+        create_backend(endpoint)
+        print(f"Generating {pdf_count} PDFs of {pages} pages...")
+        generate_pdfs(pdf_folder, pdf_count, pages, seed=1)
+
+        print(f"Starting {nodes} ingesters on {pdf_folder}")
+        started = time.perf_counter()
+        processes = [start_node(endpoint, pdf_folder, work_folder, node, extra_args) for node in range(nodes)]
+
+        if kill:
+            log_path = work_folder / "node_0.log"
+            deadline = time.monotonic() + KILL_AFTER_SECONDS
+            while (time.monotonic() < deadline and processes[0].poll() is None
+                   and log_path.read_text().count("Uploaded page") < KILL_AFTER_PAGES):
+                time.sleep(0.2)
+            if processes[0].poll() is None:
+                print("Killing node 0 mid-run")
+                processes[0].kill()
+        for process in processes:
+            process.wait()
+
+        if kill and nodes == 1:
+            # Nobody is left to take node 0's leases over once they expire
+            time.sleep(LEASE_SECONDS + 1)
+            print("Starting a fresh node to take over stalled leases")
+            start_node(endpoint, pdf_folder, work_folder, nodes, extra_args).wait()
+
+        print(f"Ingest finished in {time.perf_counter() - started:.1f}s")
+        problems = check_results(endpoint, pdf_count, pages)
+    finally:
+        server.stop()
+
+    for node in range(nodes + (1 if kill and nodes == 1 else 0)):
+        log = (work_folder / f"node_{node}.log").read_text()
+        finished_elsewhere = log.count("finished by another ingester")
+        resumed = log.count("pages already recorded")
+        print(f"  node {node}: {finished_elsewhere} PDFs left to other nodes, {resumed} resumed")
+    shutil.rmtree(work_folder, ignore_errors=True)
+
+    if problems:
+        print("\nFAIL")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nPASS: every page recorded once and box counters match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - DocSense Migration Check
+
+Builds a small DocSense fixture (a docsense.db with boxes, documents and
+pages tables, synthetic PDFs, one OCR'd copy and one document whose PDF is
+missing) and runs migrate_docsense.py on it against a local moto server.
+With --kill, the first run is killed part way through and a second run
+resumes it; with --other-machine as well, the second run starts from an
+empty manifest, so it can only learn what was migrated from DynamoDB. A
+final run must skip everything. Then every document must be one set with
+all its pages recorded once, and box counters must match.
+
+Renders with pdf2image when poppler's pdftoppm is installed, else with
+PyMuPDF; pass --renderer after -- to choose.
+
+Usage:
+    python check_migrate_docsense.py
+    python check_migrate_docsense.py --docs 20 --pages 8 --kill
+    python check_migrate_docsense.py --kill --other-machine
+
+    # Everything after -- goes to migrate_docsense.py
+    python check_migrate_docsense.py --kill -- --renderer pymupdf
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import logging
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from moto.server import ThreadedMotoServer
+
+from bench_ingest import (
+    BENCH_ENV, BENCH_TENANT, SCRIPT_DIR, bench_session, create_backend, free_port,
+    generate_pdfs, ingest_env,
+)
+from check_distributed_ingest import scan_table
+from migrate_docsense import docsense_set_id
+from upload_pages import pymupdf_installed
+
+DOCS_PER_BOX = 4
+
+# --kill stops the first run KILL_SETTLE_SECONDS after page records appear,
+# while the rest of the document's pages are still in flight; or after
+# KILL_AFTER_SECONDS. That run uses one worker, so the kill lands between
+# batches rather than between a batch write and its box counter update,
+# which a machine without the manifest can't tell apart (reconcile.py
+# --repair fixes counters after such a crash)
+KILL_SETTLE_SECONDS = 0.5
+KILL_AFTER_SECONDS = 120
+
+
+def build_fixture(folder: Path, doc_count: int, pages: int) -> tuple[Path, Path, Path]:
+    """
+    Write docsense.db, pdfs/ and ocr/ under `folder`; returns their paths.
+
+    PDFs get DocSense-style names rather than scanner names. The first
+    document's OCR'd copy is the only one in ocr/, and the last document's
+    PDF is missing.
+    """
+    pdf_dir = folder / "pdfs"
+    ocr_dir = folder / "ocr"
+    pdf_dir.mkdir()
+    ocr_dir.mkdir()
+    generate_pdfs(pdf_dir, doc_count, pages, seed=3)
+
+    db_path = folder / "docsense.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE boxes (box_id INTEGER PRIMARY KEY, box_number TEXT NOT NULL);
+        CREATE TABLE documents (doc_id INTEGER PRIMARY KEY, box_id INTEGER NOT NULL,
+                                filename TEXT NOT NULL, page_count INTEGER);
+        CREATE TABLE pages (page_id INTEGER PRIMARY KEY, doc_id INTEGER NOT NULL,
+                            page_number INTEGER NOT NULL);
+        CREATE INDEX pages_by_doc ON pages (doc_id);
+    """)
+    for index, pdf_path in enumerate(sorted(pdf_dir.glob("*.pdf"))):
+        doc_id = 40 + index
+        box_id = index // DOCS_PER_BOX + 1
+        filename = f"Board Minutes {2001 + index}.pdf"
+        pdf_path.rename(pdf_dir / filename)
+        conn.execute("INSERT OR IGNORE INTO boxes VALUES (?, ?)", (box_id, str(box_id)))
+        conn.execute("INSERT INTO documents VALUES (?, ?, ?, ?)", (doc_id, box_id, filename, pages))
+        conn.executemany("INSERT INTO pages (doc_id, page_number) VALUES (?, ?)",
+                         [(doc_id, number) for number in range(1, pages + 1)])
+    conn.commit()
+    conn.close()
+
+    documents = sorted(pdf_dir.glob("*.pdf"))
+    shutil.copy(documents[0], ocr_dir / documents[0].name)
+    documents[-1].unlink()
+    return db_path, pdf_dir, ocr_dir
+
+
+def migrate_command(db_path: Path, pdf_dir: Path, ocr_dir: Path, extra_args: list) -> list:
+    return [
+        sys.executable, str(SCRIPT_DIR / "migrate_docsense.py"),
+        "--db", str(db_path), "--pdf-dir", str(pdf_dir), "--ocr-dir", str(ocr_dir),
+        "--env", BENCH_ENV, "--tenant", BENCH_TENANT, "--workers", "2", *extra_args,
+    ]
+
+
+def check_results(endpoint: str, doc_count: int, pages: int) -> list:
+    """Compare DynamoDB contents with the fixture; returns problems found."""
+    dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+    table = {model: f"Box2Cloud{model}-{BENCH_ENV}-NONE" for model in ("Box", "Set", "Page")}
+    problems = []
+
+    # The last document has no PDF and must not be migrated
+    expected_sets = {docsense_set_id(40 + index) for index in range(doc_count - 1)}
+    sets = scan_table(dynamodb, table["Set"])
+    if {item["setId"] for item in sets} != expected_sets or len(sets) != len(expected_sets):
+        problems.append(f"expected sets {sorted(expected_sets)}, found {sorted(item['setId'] for item in sets)}")
+
+    page_items = scan_table(dynamodb, table["Page"])
+    for set_id, count in sorted(Counter(item["setId"] for item in page_items).items()):
+        if count != pages:
+            problems.append(f"{set_id}: expected {pages} pages, found {count}")
+    if len({item["id"] for item in page_items}) != len(page_items):
+        problems.append("pages recorded more than once")
+
+    pages_per_box = Counter(item["boxId"] for item in page_items)
+    sets_per_box = Counter(item["boxId"] for item in sets)
+    boxes = scan_table(dynamodb, table["Box"])
+    box_numbers = sorted(box["boxNumber"] for box in boxes)
+    if box_numbers != [f"{number:03d}" for number in range(1, len(box_numbers) + 1)]:
+        problems.append(f"unexpected box numbers {box_numbers}")
+    for box in boxes:
+        if int(box["totalPages"]) != pages_per_box[box["id"]] or int(box["totalSets"]) != sets_per_box[box["id"]]:
+            problems.append(f"box {box['boxNumber']}: counters {box['totalSets']} sets/{box['totalPages']} pages, "
+                            f"records {sets_per_box[box['id']]}/{pages_per_box[box['id']]}")
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    extra_args = []
+    if "--" in args:
+        split = args.index("--")
+        args, extra_args = args[:split], args[split + 1:]
+
+    doc_count = 10
+    pages = 30
+    kill = False
+    other_machine = False
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--docs", "--pages"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 1:
+                if args[i] == "--docs":
+                    doc_count = int(args[i + 1])
+                else:
+                    pages = int(args[i + 1])
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires an integer above 1")
+                sys.exit(1)
+        elif args[i] == "--kill":
+            kill = True
+            i += 1
+        elif args[i] == "--other-machine":
+            other_machine = True
+            i += 1
+        else:
+            print("Usage: python check_migrate_docsense.py [--docs N] [--pages N] [--kill] "
+                  "[--other-machine] [-- migrate_docsense.py options]")
+            sys.exit(1)
+    if other_machine and not kill:
+        print("Error: --other-machine resumes a killed run, so it needs --kill")
+        sys.exit(1)
+
+    # Fail here rather than with a render error in every document
+    renderer = extra_args[extra_args.index("--renderer") + 1] if "--renderer" in extra_args[:-1] else None
+    if renderer != "pymupdf" and not shutil.which("pdftoppm"):
+        if renderer or not pymupdf_installed():
+            print("Error: pdf2image needs poppler's pdftoppm on the PATH; "
+                  "install poppler, or PyMuPDF and pass -- --renderer pymupdf")
+            sys.exit(1)
+        print("pdftoppm not found, rendering with PyMuPDF")
+        extra_args += ["--renderer", "pymupdf"]
+
+    work_folder = Path(tempfile.mkdtemp(prefix="box2cloud-docsense-"))
+    print(f"Building a fixture of {doc_count} documents of {pages} pages in {work_folder}")
+    db_path, pdf_dir, ocr_dir = build_fixture(work_folder, doc_count, pages)
+    command = migrate_command(db_path, pdf_dir, ocr_dir, extra_args)
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto's per-request log lines
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    problems = []
+    try:
+        create_backend(endpoint)
+        env = ingest_env(endpoint)
+        logs = []
+        started = time.perf_counter()
+        if kill:
+            # Its own session, so the kill takes the worker processes down too
+            client = bench_session().client("dynamodb", endpoint_url=endpoint)
+            page_table = f"Box2CloudPage-{BENCH_ENV}-NONE"
+            with open(work_folder / "killed.log", "w") as log:
+                process = subprocess.Popen(command + ["--workers", "1"], env=env, stdout=log,
+                                           stderr=subprocess.STDOUT, start_new_session=True)
+                deadline = time.monotonic() + KILL_AFTER_SECONDS
+                while (time.monotonic() < deadline and process.poll() is None
+                       and not client.scan(TableName=page_table, Limit=1)["Count"]):
+                    time.sleep(0.2)
+                time.sleep(KILL_SETTLE_SECONDS)
+                if process.poll() is None:
+                    print("Killing the migration mid-run")
+                    os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+
+        if other_machine:
+            command += ["--manifest", str(work_folder / "other-machine.sqlite")]
+        for run in ("resume" if kill else "first", "repeat"):
+            process = subprocess.run(command, env=env, capture_output=True, text=True)
+            logs.append(process.stdout + process.stderr)
+            summary = [line.strip() for line in logs[-1].splitlines()
+                       if line.strip().startswith(("Migrated:", "Skipped:", "Errors:"))]
+            print(f"  {run} run: {'; '.join(summary)}")
+            resumed = logs[-1].count("pages already recorded")
+            if resumed:
+                print(f"    {resumed} documents resumed from their page records")
+            # The missing PDF is an error on every run
+            if process.returncode != 1 or "PDF not found" not in logs[-1]:
+                problems.append(f"{run} run: expected exit 1 for the missing PDF, got {process.returncode}")
+        print(f"Migration finished in {time.perf_counter() - started:.1f}s")
+
+        if f"Skipped:  {doc_count - 1}" not in logs[-1]:
+            problems.append("the repeat run migrated documents again")
+        problems += check_results(endpoint, doc_count, pages)
+    finally:
+        server.stop()
+
+    if problems:
+        print(logs[-1][-3000:] if logs else "")
+        print("\nFAIL")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    shutil.rmtree(work_folder, ignore_errors=True)
+    print("\nPASS: every document migrated once and box counters match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Progress Rollup Check
+
+Records a synthetic Box table stream (boxes created, reviewed page by page,
+one deleted, with Page records mixed in) and feeds it to progress_rollup.py
+against a local moto server. The tenant summary must match the final box
+items after an in-order replay, after replaying every batch again in random
+order with duplicates, and after a rebuild followed by another replay. A
+batch retried after the rebuild must not roll boxes back, and a change made
+after it must still be applied.
+
+Usage:
+    python check_progress_rollup.py
+    python check_progress_rollup.py --boxes 40 --reviews 5000
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from boto3.dynamodb.types import TypeSerializer
+from moto.server import ThreadedMotoServer
+
+from bench_ingest import BENCH_ENV, bench_session, create_backend, free_port
+from progress_rollup import get_progress, load_recorded_records, process_records, rebuild_summary
+
+TENANT = "check"
+BATCH_SIZE = 100
+STREAM_ARN = "arn:aws:dynamodb:us-east-1:123456789012:table/{table}/stream/2026-01-01T00:00:00.000"
+
+
+def stream_record(table: str, event: str, key: str, old: dict | None, new: dict | None,
+                  sequence: int, created: int) -> dict:
+    """One stream record as Lambda delivers it."""
+    serializer = TypeSerializer()
+    stream = {"ApproximateCreationDateTime": created, "Keys": {"id": {"S": key}},
+              "SequenceNumber": str(sequence), "StreamViewType": "NEW_AND_OLD_IMAGES"}
+    if old:
+        stream["OldImage"] = {name: serializer.serialize(value) for name, value in old.items()}
+    if new:
+        stream["NewImage"] = {name: serializer.serialize(value) for name, value in new.items()}
+    return {"eventName": event, "eventSourceARN": STREAM_ARN.format(table=table), "dynamodb": stream}
+
+
+def record_stream(box_count: int, reviews: int, seed: int) -> tuple[list, dict]:
+    """
+    Synthetic stream records and the box items they end with.
+
+    Sequence numbers grow by a random step and cross a digit boundary
+    part way, as real ones do. Records were created over the last hour,
+    several to a second.
+    """
+    rng = random.Random(seed)
+    box_table = f"Box2CloudBox-{BENCH_ENV}-NONE"
+    page_table = f"Box2CloudPage-{BENCH_ENV}-NONE"
+    records = []
+    sequence = 10 ** 20 - 5000
+    created = int(time.time()) - 3600
+
+    def emit(table: str, event: str, key: str, old: dict | None, new: dict | None) -> None:
+        nonlocal sequence, created
+        sequence += rng.randint(1, 9)
+        created += rng.randint(0, 1)
+        records.append(stream_record(table, event, key, old, new, sequence, created))
+
+    boxes = {}
+    for number in range(1, box_count + 1):
+        box_id = f"{TENANT}-box-{number:03d}"
+        boxes[box_id] = {
+            "id": box_id, "tenantId": TENANT, "boxNumber": f"{number:03d}",
+            "totalSets": 1, "totalPages": rng.randint(20, 200), "pagesReviewed": 0,
+            "pagesShred": 0, "pagesUnsure": 0, "pagesRetain": 0, "status": "pending",
+        }
+        emit(box_table, "INSERT", box_id, None, boxes[box_id])
+
+    decisions = ("pagesShred",) * 8 + ("pagesUnsure", "pagesRetain")
+    for _ in range(reviews):
+        open_boxes = [box for box in boxes.values() if box["pagesReviewed"] < box["totalPages"]]
+        if not open_boxes:
+            break
+        box = rng.choice(open_boxes)
+        old = dict(box)
+        box["pagesReviewed"] += 1
+        box[rng.choice(decisions)] += 1
+        emit(page_table, "MODIFY", f"page-{rng.randint(1, 10 ** 6)}", None,
+             {"id": "page", "pageId": "1", "tenantId": TENANT, "boxNumber": box["boxNumber"]})
+        emit(box_table, "MODIFY", box["id"], old, box)
+
+    deleted = boxes.pop(rng.choice(sorted(boxes)))
+    emit(box_table, "REMOVE", deleted["id"], deleted, None)
+    return records, boxes
+
+
+def expected_progress(boxes: dict) -> dict:
+    """Totals and per-box breakdowns straight from the final box items."""
+    def recommendation(box):
+        if box["pagesReviewed"] < box["totalPages"]:
+            return None
+        return "RETAIN" if box["pagesRetain"] else "REVIEW" if box["pagesUnsure"] else "SHRED"
+
+    return {
+        "total_pages": sum(box["totalPages"] for box in boxes.values()),
+        "pages_reviewed": sum(box["pagesReviewed"] for box in boxes.values()),
+        "shred": sum(box["pagesShred"] for box in boxes.values()),
+        "boxes": sorted(
+            (box["boxNumber"], box["pagesReviewed"], box["pagesShred"], box["pagesUnsure"],
+             box["pagesRetain"], recommendation(box))
+            for box in boxes.values()
+        ),
+    }
+
+
+def compare(dynamodb, table_name: str, expected: dict, label: str) -> list:
+    started = time.perf_counter()
+    progress = get_progress(dynamodb, table_name, TENANT)
+    elapsed = time.perf_counter() - started
+    actual = {
+        "total_pages": progress["total_pages"],
+        "pages_reviewed": progress["pages_reviewed"],
+        "shred": progress["breakdown"]["shred"],
+        "boxes": sorted(
+            (box["box_number"], box["pages_reviewed"], box["breakdown"]["shred"],
+             box["breakdown"]["unsure"], box["breakdown"]["retain"], box["recommendation"])
+            for box in progress["boxes"]
+        ),
+    }
+    print(f"  {label}: {len(progress['boxes'])} boxes, {progress['percent_complete']}% complete, "
+          f"read in {elapsed * 1000:.1f}ms")
+    if actual == expected:
+        return []
+    wrong = [box for box in expected["boxes"] if box not in actual["boxes"]]
+    return [f"{label}: summary differs from the box items "
+            f"(totals {actual['pages_reviewed']}/{actual['total_pages']} vs "
+            f"{expected['pages_reviewed']}/{expected['total_pages']}, boxes {wrong[:3]})"]
+
+
+def main():
+    args = sys.argv[1:]
+    box_count = 20
+    reviews = 2000
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--boxes", "--reviews"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                if args[i] == "--boxes":
+                    box_count = int(args[i + 1])
+                else:
+                    reviews = int(args[i + 1])
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a positive integer")
+                sys.exit(1)
+        else:
+            print("Usage: python check_progress_rollup.py [--boxes N] [--reviews N]")
+            sys.exit(1)
+
+    records, boxes = record_stream(box_count, reviews, seed=1)
+    expected = expected_progress(boxes)
+
+    # Record the stream the way replay reads it: one Lambda event per batch
+    work_folder = Path(tempfile.mkdtemp(prefix="box2cloud-rollup-"))
+    events_path = work_folder / "events.json"
+    batches = [records[start:start + BATCH_SIZE] for start in range(0, len(records), BATCH_SIZE)]
+    events_path.write_text(json.dumps([{"Records": batch} for batch in batches]))
+    print(f"Recorded {len(records)} stream records for {box_count} boxes in {len(batches)} batches")
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto's per-request log lines
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    problems = []
+    try:
+        create_backend(endpoint)
+        dynamodb = bench_session().resource("dynamodb", endpoint_url=endpoint)
+        tables = {"box": f"Box2CloudBox-{BENCH_ENV}-NONE",
+                  "progress": f"Box2CloudTenantProgress-{BENCH_ENV}-NONE"}
+        with dynamodb.Table(tables["box"]).batch_writer() as writer:
+            for box in boxes.values():
+                writer.put_item(Item=box)
+
+        totals = {"applied": 0, "stale": 0, "ignored": 0}
+        started = time.perf_counter()
+        for batch in [event["Records"] for event in json.loads(events_path.read_text())]:
+            for name, count in process_records(dynamodb, tables["progress"], batch).items():
+                totals[name] += count
+        print(f"In order: {totals} in {time.perf_counter() - started:.1f}s")
+        problems += compare(dynamodb, tables["progress"], expected, "in order")
+
+        # Lambda retries failed batches, and a replay may overlap what was applied
+        rng = random.Random(2)
+        replayed = batches + rng.sample(batches, len(batches) // 2)
+        rng.shuffle(replayed)
+        totals = {"applied": 0, "stale": 0, "ignored": 0}
+        for batch in replayed:
+            for name, count in process_records(dynamodb, tables["progress"], batch).items():
+                totals[name] += count
+        print(f"Shuffled replay with duplicates: {totals}")
+        if totals["applied"]:
+            problems.append(f"replay changed {totals['applied']} box entries")
+        problems += compare(dynamodb, tables["progress"], expected, "after replay")
+
+        print(f"Rebuilt from {rebuild_summary(dynamodb, tables, TENANT)} boxes")
+        problems += compare(dynamodb, tables["progress"], expected, "rebuilt")
+
+        # The rebuild's entries carry no sequence numbers; a batch from
+        # before it, retried now, must still be stale
+        stats = process_records(dynamodb, tables["progress"], batches[len(batches) // 2])
+        if stats["applied"]:
+            problems.append(f"a batch retried after the rebuild changed {stats['applied']} box entries")
+        problems += compare(dynamodb, tables["progress"], expected, "rebuilt then retried a batch")
+        process_records(dynamodb, tables["progress"], load_recorded_records(str(events_path)))
+        problems += compare(dynamodb, tables["progress"], expected, "rebuilt then replayed")
+
+        # A review made after the rebuild moves a page from shred to retain
+        box = next(box for box in boxes.values() if box["pagesShred"])
+        old = dict(box)
+        box["pagesShred"] -= 1
+        box["pagesRetain"] += 1
+        last_sequence = int(records[-1]["dynamodb"]["SequenceNumber"])
+        stats = process_records(dynamodb, tables["progress"], [stream_record(
+            tables["box"], "MODIFY", box["id"], old, box, last_sequence + 1, int(time.time()) + 1)])
+        if stats["applied"] != 1:
+            problems.append("a change made after the rebuild was not applied")
+        problems += compare(dynamodb, tables["progress"], expected_progress(boxes), "changed after rebuild")
+    finally:
+        server.stop()
+        events_path.unlink()
+        work_folder.rmdir()
+
+    if problems:
+        print("\nFAIL")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nPASS: the summary matches the box items however the stream is replayed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Re-ingest Check
+
+Writes one set the way older versions of upload_pages.py wrote sets
+(random uuid4 record ids, found only through the byBox indexes), then
+ingests its folder of synthetic scans against a local moto server, as a
+first run of this version over an old folder would: the old set must be
+skipped, not ingested a second time. Then --force re-ingests one of the
+new sets and the old one. Every set must end with one set record and one
+record per page, its S3 prefix must hold its pages, and box counters must
+match the records.
+
+Usage:
+    python check_reingest.py
+    python check_reingest.py --pdfs 4 --pages 30
+
+    # Everything after -- goes to each upload_pages.py
+    python check_reingest.py -- --renderer pymupdf
+
+Requirements:
+    pip install -r requirements.txt -r requirements-bench.txt
+"""
+
+import logging
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from moto.server import ThreadedMotoServer
+
+from bench_ingest import (
+    BENCH_BUCKET, BENCH_ENV, BENCH_TENANT, bench_session, create_backend, free_port,
+    generate_pdfs, ingest_command, ingest_env,
+)
+from box_records import get_tenant_groups
+from check_distributed_ingest import scan_table
+from upload_pages import parse_pdf_filename
+
+
+def write_legacy_set(dynamodb, s3_client, tables: dict, pdf_info: dict, page_count: int) -> None:
+    """Box, set and page records and page images as older upload_pages.py wrote them."""
+    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    groups = get_tenant_groups(BENCH_TENANT)
+    box_id = str(uuid.uuid4())
+    set_id = pdf_info["setId"]
+    dynamodb.Table(tables["Box"]).put_item(Item={
+        "id": box_id, "boxNumber": pdf_info["boxNumber"], "tenantId": BENCH_TENANT,
+        "groups": groups, "totalSets": 1, "totalPages": page_count, "pagesReviewed": 0,
+        "pagesShred": 0, "pagesUnsure": 0, "pagesRetain": 0, "status": "pending",
+        "createdAt": now, "updatedAt": now,
+    })
+    dynamodb.Table(tables["Set"]).put_item(Item={
+        "id": str(uuid.uuid4()), "setId": set_id, "boxId": box_id, "tenantId": BENCH_TENANT,
+        "groups": groups, "filename": pdf_info["filename"], "pageCount": page_count,
+        "pagesReviewed": 0, "createdAt": now, "updatedAt": now,
+    })
+    with dynamodb.Table(tables["Page"]).batch_writer() as writer:
+        for number in range(1, page_count + 1):
+            s3_key = f"{BENCH_TENANT}/{pdf_info['boxNumber']}/{set_id}/page_{number:04d}.png"
+            s3_client.put_object(Bucket=BENCH_BUCKET, Key=s3_key, Body=b"legacy page")
+            writer.put_item(Item={
+                "id": str(uuid.uuid4()), "pageId": f"{set_id}_page_{number:04d}", "setId": set_id,
+                "boxId": box_id, "tenantId": BENCH_TENANT, "groups": groups,
+                "pageNumber": number, "filename": pdf_info["filename"], "s3Key": s3_key,
+                "reviewStatus": "pending", "createdAt": now, "updatedAt": now,
+            })
+
+
+def run_ingest(endpoint: str, target: Path, work_folder: Path, extra_args: list, label: str) -> list:
+    """Run upload_pages.py on a folder or PDF; returns problems found."""
+    command = ingest_command(target, work_folder / "manifest.sqlite", extra_args)
+    process = subprocess.run(command, env=ingest_env(endpoint), capture_output=True, text=True)
+    summary = [line.strip() for line in process.stdout.splitlines()
+               if line.strip().startswith(("Processed:", "Skipped:", "Errors:"))]
+    print(f"  {label}: {'; '.join(summary)}")
+    if process.returncode != 0:
+        print(process.stdout[-3000:] + process.stderr[-3000:])
+        return [f"{label}: upload_pages.py exited with {process.returncode}"]
+    return []
+
+
+def check_results(endpoint: str, expected_pages: dict, label: str) -> list:
+    """Compare DynamoDB and S3 with {set_id: page_count}; returns problems found."""
+    session = bench_session()
+    dynamodb = session.resource("dynamodb", endpoint_url=endpoint)
+    s3_client = session.client("s3", endpoint_url=endpoint)
+    table = {model: f"Box2Cloud{model}-{BENCH_ENV}-NONE" for model in ("Box", "Set", "Page")}
+    problems = []
+
+    sets = Counter(item["setId"] for item in scan_table(dynamodb, table["Set"]))
+    page_items = scan_table(dynamodb, table["Page"])
+    for set_id, page_count in sorted(expected_pages.items()):
+        if sets[set_id] != 1:
+            problems.append(f"{label}: {set_id} has {sets[set_id]} set records")
+        numbers = sorted(int(item["pageNumber"]) for item in page_items if item["setId"] == set_id)
+        if numbers != list(range(1, page_count + 1)):
+            problems.append(f"{label}: {set_id} has page records {numbers}, expected 1-{page_count}")
+        prefix = f"{BENCH_TENANT}/{set_id.split('_')[1]}/{set_id}/"
+        listing = s3_client.list_objects_v2(Bucket=BENCH_BUCKET, Prefix=prefix)
+        images = [item["Key"] for item in listing.get("Contents", []) if "/thumbs/" not in item["Key"]]
+        if len(images) != page_count:
+            problems.append(f"{label}: {prefix} holds {len(images)} page images, expected {page_count}")
+
+    set_items = scan_table(dynamodb, table["Set"])
+    for box in scan_table(dynamodb, table["Box"]):
+        records = (sum(1 for item in set_items if item["boxId"] == box["id"]),
+                   sum(1 for item in page_items if item["boxId"] == box["id"]))
+        if (int(box["totalSets"]), int(box["totalPages"])) != records:
+            problems.append(f"{label}: box {box['boxNumber']} counters {box['totalSets']} sets/"
+                            f"{box['totalPages']} pages, records {records[0]}/{records[1]}")
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    extra_args = []
+    if "--" in args:
+        split = args.index("--")
+        args, extra_args = args[:split], args[split + 1:]
+
+    pdf_count = 3
+    pages = 6
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--pdfs", "--pages"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 1:
+                if args[i] == "--pdfs":
+                    pdf_count = int(args[i + 1])
+                else:
+                    pages = int(args[i + 1])
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires an integer above 1")
+                sys.exit(1)
+        else:
+            print("Usage: python check_reingest.py [--pdfs N] [--pages N] [-- upload_pages.py options]")
+            sys.exit(1)
+
+    work_folder = Path(tempfile.mkdtemp(prefix="box2cloud-reingest-"))
+    pdf_folder = work_folder / "pdfs"
+    pdf_folder.mkdir()
+    print(f"Generating {pdf_count} PDFs of {pages} pages in {pdf_folder}")
+    # Five PDFs to a box, so the first few share box 001 with the old set
+    generate_pdfs(pdf_folder, pdf_count, pages, seed=5)
+    legacy_pdf, *pdfs = sorted(pdf_folder.glob("*.pdf"))
+    legacy_info = parse_pdf_filename(legacy_pdf.name)
+    expected_pages = {parse_pdf_filename(pdf.name)["setId"]: pages for pdf in pdfs + [legacy_pdf]}
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto's per-request log lines
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+
+    problems = []
+    try:
+        create_backend(endpoint)
+        session = bench_session()
+        tables = {model: f"Box2Cloud{model}-{BENCH_ENV}-NONE" for model in ("Box", "Set", "Page")}
+        write_legacy_set(session.resource("dynamodb", endpoint_url=endpoint),
+                         session.client("s3", endpoint_url=endpoint), tables, legacy_info, pages)
+        print(f"Wrote {legacy_info['setId']} with uuid4 record ids, as older versions did")
+
+        problems += run_ingest(endpoint, pdf_folder, work_folder, extra_args, "ingest")
+        problems += check_results(endpoint, expected_pages, "after ingest")
+
+        problems += run_ingest(endpoint, pdfs[0], work_folder, ["--force", *extra_args], "force new set")
+        problems += run_ingest(endpoint, legacy_pdf, work_folder, ["--force", *extra_args], "force old set")
+        problems += check_results(endpoint, expected_pages, "after --force")
+    finally:
+        server.stop()
+
+    if problems:
+        print("\nFAIL")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    shutil.rmtree(work_folder, ignore_errors=True)
+    print("\nPASS: every set recorded once with its pages, and box counters match")
+
+
+if __name__ == "__main__":
+    main()
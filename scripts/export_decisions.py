@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Export Review Decisions
+
+Writes a tenant's page decisions to CSV or Parquet, sorted and grouped by
+box, then set, then page number - e.g. a box-by-box shred manifest for
+the board.
+
+Each box's pages are read with one query on the Page table's byBox index,
+several boxes at a time. Boxes are written in order as they arrive, so
+memory holds a few boxes rather than the whole tenant, and rows reach the
+file while later boxes are still being read.
+
+Usage:
+    python export_decisions.py --tenant wth
+    python export_decisions.py --tenant wth --output shred_manifest.csv --decisions shred
+
+    # Parquet (needs pyarrow), with pages still awaiting review
+    python export_decisions.py --tenant wth --output decisions.parquet --include-pending
+
+    # Specify environment when multiple exist
+    python export_decisions.py --env 3qslisom2rf57gtlhmdx3gwuqa
+
+Requirements:
+    pip install boto3
+    pip install pyarrow  # optional, for .parquet output
+"""
+
+import csv
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import upload_pages
+from upload_pages import load_box_ids
+
+# Boxes queried at once, and how far ahead of the writer they may run
+BOX_WORKERS = 8
+BOX_LOOKAHEAD = 16
+
+# Parquet rows per row group
+ROW_GROUP_ROWS = 10000
+
+EXPORT_COLUMNS = (
+    "box_number", "set_id", "filename", "page_number", "decision",
+    "reviewed_by", "reviewed_at", "s3_key", "page_record_id",
+)
+
+REVIEW_DECISIONS = ("shred", "unsure", "retain")
+
+
+def import_pyarrow():
+    """Import pyarrow, only needed for Parquet output; None if not installed."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def query_box_pages(dynamodb_client, table_name: str, box_id: str, statuses: tuple) -> list:
+    """
+    One box's pages with the given review statuses, as export rows (without
+    box_number), sorted by set and page number.
+    """
+    query_args = {
+        "TableName": table_name,
+        "IndexName": "byBox",
+        "KeyConditionExpression": "boxId = :box",
+        "FilterExpression": "reviewStatus IN (" + ", ".join(f":s{i}" for i in range(len(statuses))) + ")",
+        "ProjectionExpression": "id, setId, filename, pageNumber, reviewStatus, reviewedBy, reviewedAt, s3Key",
+        "ExpressionAttributeValues": {":box": box_id, **{f":s{i}": s for i, s in enumerate(statuses)}},
+    }
+    rows = []
+    while True:
+        response = dynamodb_client.query(**query_args)
+        for item in response["Items"]:
+            rows.append({
+                "set_id": item["setId"],
+                "filename": item.get("filename", ""),
+                "page_number": int(item["pageNumber"]),
+                "decision": item.get("reviewStatus", ""),
+                "reviewed_by": item.get("reviewedBy") or "",
+                "reviewed_at": item.get("reviewedAt") or "",
+                "s3_key": item.get("s3Key", ""),
+                "page_record_id": item["id"],
+            })
+        if "LastEvaluatedKey" not in response:
+            break
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    rows.sort(key=lambda row: (row["set_id"], row["page_number"]))
+    return rows
+
+
+def iter_box_pages(dynamodb, table_name: str, boxes: list, statuses: tuple):
+    """
+    Yield (box_number, rows) for each of `boxes` [(box_number, box_id)] in
+    order, querying up to BOX_LOOKAHEAD boxes ahead on BOX_WORKERS threads.
+    """
+    # The resource's client is thread-safe and takes plain values
+    client = dynamodb.meta.client
+    boxes = iter(boxes)
+    with ThreadPoolExecutor(max_workers=BOX_WORKERS) as executor:
+        in_flight = deque()
+
+        def submit_next() -> None:
+            box = next(boxes, None)
+            if box is not None:
+                in_flight.append((box[0], executor.submit(query_box_pages, client, table_name, box[1], statuses)))
+
+        for _ in range(BOX_LOOKAHEAD):
+            submit_next()
+        while in_flight:
+            box_number, future = in_flight.popleft()
+            rows = future.result()
+            submit_next()
+            yield box_number, rows
+
+
+class CsvExport:
+    def __init__(self, path: Path):
+        self._file = open(path, "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, rows: list) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetExport:
+    """Buffers rows into row groups of ROW_GROUP_ROWS."""
+
+    def __init__(self, path: Path, pyarrow):
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            (name, pyarrow.int32() if name == "page_number" else pyarrow.string())
+            for name in EXPORT_COLUMNS
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(str(path), self._schema)
+        self._rows = []
+
+    def write(self, rows: list) -> None:
+        self._rows.extend(rows)
+        if len(self._rows) >= ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def export_decisions(dynamodb, tables: dict, tenant_id: str, writer, statuses: tuple) -> Counter:
+    """Write every box's rows through `writer`; returns page counts by decision."""
+    box_ids = load_box_ids(dynamodb, tables["box"], tenant_id)
+    boxes = sorted(box_ids.items())
+    totals = Counter()
+    for box_number, rows in iter_box_pages(dynamodb, tables["page"], boxes, statuses):
+        for row in rows:
+            row["box_number"] = box_number
+        writer.write(rows)
+
+        counts = Counter(row["decision"] for row in rows)
+        totals.update(counts)
+        if rows:
+            breakdown = ", ".join(f"{counts[status]} {status}" for status in statuses if counts[status])
+            print(f"  Box {box_number}: {len(rows)} pages ({breakdown})")
+    return totals
+
+
+def main():
+    args = sys.argv[1:]
+    env_id = None
+    tenant_id = os.environ.get("TENANT_ID", upload_pages.TENANT_ID)
+    output = None
+    statuses = REVIEW_DECISIONS
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--env", "--tenant", "--output", "--decisions"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires an argument")
+                sys.exit(1)
+            value = args[i + 1]
+            if args[i] == "--env":
+                env_id = value
+            elif args[i] == "--tenant":
+                tenant_id = value
+            elif args[i] == "--output":
+                output = Path(value)
+            else:
+                statuses = tuple(status.strip() for status in value.split(",") if status.strip())
+                unknown = [status for status in statuses if status not in REVIEW_DECISIONS]
+                if unknown or not statuses:
+                    print(f"Error: --decisions takes a comma-separated list of {', '.join(REVIEW_DECISIONS)}")
+                    sys.exit(1)
+            i += 2
+        elif args[i] == "--include-pending":
+            statuses = statuses + ("pending",)
+            i += 1
+        else:
+            print("Usage: python export_decisions.py [--tenant TENANT] [--env ENV_ID] [--output FILE.csv|FILE.parquet] "
+                  "[--decisions shred,unsure,retain] [--include-pending]")
+            sys.exit(1)
+
+    if output is None:
+        output = Path(f"decisions_{tenant_id}.csv")
+    pyarrow = None
+    if output.suffix == ".parquet":
+        pyarrow = import_pyarrow()
+        if pyarrow is None:
+            print("Error: Parquet output needs pyarrow (pip install pyarrow); use a .csv output instead")
+            sys.exit(1)
+    elif output.suffix != ".csv":
+        print(f"Error: --output must end in .csv or .parquet, got {output}")
+        sys.exit(1)
+
+    import boto3
+    upload_pages.AWS_REGION = os.environ.get("AWS_REGION", upload_pages.AWS_REGION)
+    session = boto3.Session(region_name=upload_pages.AWS_REGION)
+    dynamodb = session.resource("dynamodb")
+
+    cached = upload_pages.load_cached_environment(upload_pages.discovery_cache_key(env_id))
+    tables = cached["tables"] if cached else {}
+    if "page" not in tables:
+        tables = upload_pages.find_dynamodb_tables(dynamodb.meta.client, env_id)
+    if isinstance(tables, list):
+        print("Error: Multiple Box2Cloud environments found; use --env with one of:")
+        for env in tables:
+            print(f"  {env['env_id']}")
+        sys.exit(1)
+    if not all(name in tables for name in ("box", "page")):
+        print(f"Error: Could not find the Box and Page tables. Found: {tables}")
+        sys.exit(1)
+
+    print(f"Exporting {', '.join(statuses)} pages for tenant {tenant_id} to {output}")
+    started = time.perf_counter()
+    writer = ParquetExport(output, pyarrow) if pyarrow else CsvExport(output)
+    try:
+        totals = export_decisions(dynamodb, tables, tenant_id, writer, statuses)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+
+    pages = sum(totals.values())
+    breakdown = ", ".join(f"{totals[status]} {status}" for status in statuses)
+    print(f"\nExported {pages} pages ({breakdown}) in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
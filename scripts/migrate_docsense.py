@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - DocSense Migration
+
+Migrates the boxes and documents of a DocSense SQLite database (see Data
+Migration in CLOUD_MIGRATION_SPEC.md) into the Amplify tables and page
+bucket. Each DocSense document becomes a set, `docsense_{doc_id:05d}`, in
+its DocSense box, and its PDF goes through the same render, upload and
+record pipeline as upload_pages.py: pages are rendered on a pool of worker
+processes, and box, set and page records are written in batches.
+
+Documents are read from SQLite in chunks of MIGRATE_CHUNK with a
+read-only cursor, never all at once, and each chunk is handed to the
+worker pool before the next is read. Progress is checkpointed per PDF and
+per page in an ingest manifest (by default next to the database), so an
+interrupted migration resumes where it stopped and finished documents are
+skipped without touching their PDFs. A document the manifest has never
+seen but whose set exists, e.g. migrated in part from another machine, is
+checked against its page records: it is skipped only if every page of the
+set's pageCount is recorded, and otherwise resumes at the missing pages.
+
+Usage:
+    python migrate_docsense.py --db /path/to/docsense.db --pdf-dir /path/to/pdfs --tenant wth
+
+    # Prefer OCR'd PDFs where they exist, render with PyMuPDF on 8 processes
+    python migrate_docsense.py --db docsense.db --pdf-dir pdfs --ocr-dir ocr \\
+        --renderer pymupdf --workers 8
+
+    # Specify environment when multiple exist
+    python migrate_docsense.py --db docsense.db --pdf-dir pdfs --env 3qslisom2rf57gtlhmdx3gwuqa
+
+Requirements:
+    pip install boto3 pdf2image pillow numpy
+    pip install pymupdf  # optional, for --renderer pymupdf
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import upload_pages
+from upload_pages import (
+    IngestManifest, lookup_sets, print_pipeline_stats, print_transfer_stats,
+    process_pdfs_parallel, worker_pool,
+)
+
+# Documents read from SQLite and queued for the workers at a time
+MIGRATE_CHUNK = 100
+
+# Manifest created next to the DocSense database unless --manifest is given
+MIGRATION_MANIFEST_FILENAME = ".box2cloud_docsense.sqlite"
+
+# Every document, with its box and the number of page rows DocSense has for it
+DOCUMENTS_QUERY = """
+    SELECT d.doc_id, d.filename, d.page_count, b.box_number,
+           (SELECT COUNT(*) FROM pages p WHERE p.doc_id = d.doc_id) AS page_rows
+    FROM documents d
+    JOIN boxes b ON d.box_id = b.box_id
+    ORDER BY b.box_number, d.doc_id
+"""
+
+
+def docsense_set_id(doc_id: int) -> str:
+    """Set ID for a DocSense document; its pages are {set_id}_page_NNNN."""
+    return f"docsense_{int(doc_id):05d}"
+
+
+def box_number_text(box_number) -> str:
+    """DocSense box numbers as the 3-digit strings the app uses."""
+    text = str(box_number).strip()
+    return text.zfill(3) if text.isdigit() else text
+
+
+def find_document_pdf(filename: str, pdf_dir: Path, ocr_dir: Path | None) -> Path | None:
+    """The document's PDF, preferring the OCR'd copy; None if neither exists."""
+    for folder in (ocr_dir, pdf_dir):
+        if folder and (folder / filename).is_file():
+            return folder / filename
+    return None
+
+
+def iter_document_chunks(db_path: Path):
+    """Yield lists of up to MIGRATE_CHUNK document rows from a read-only connection."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(DOCUMENTS_QUERY)
+        while True:
+            rows = cursor.fetchmany(MIGRATE_CHUNK)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def migrate(db_path: Path, pdf_dir: Path, ocr_dir: Path | None, s3_client, dynamodb,
+            tables: dict, bucket: str, manifest: IngestManifest, workers: int) -> dict:
+    """
+    Migrate every DocSense document not yet finished in the manifest.
+
+    Returns run stats, plus "missing" (documents without a PDF) and
+    "mismatched" (documents whose PDF page count differs from DocSense).
+    """
+    stats = {"processed": 0, "skipped": 0, "errors": 0, "pages": 0}
+    missing = []
+    mismatched = []
+    completed = manifest.completed_sets()
+    expected = {}
+
+    def on_done(set_id: str, result: dict) -> None:
+        page_count, page_rows = expected.pop(set_id)
+        if "pages" in result and result["pages"] not in (page_count, page_rows):
+            mismatched.append((set_id, result["pages"], page_count, page_rows))
+
+    with worker_pool(workers, tables, bucket, manifest) as executor:
+        for rows in iter_document_chunks(db_path):
+            jobs = []
+            for row in rows:
+                set_id = docsense_set_id(row["doc_id"])
+                if set_id in completed:
+                    stats["skipped"] += 1
+                    continue
+                pdf_path = find_document_pdf(row["filename"], pdf_dir, ocr_dir)
+                if pdf_path is None:
+                    missing.append((set_id, row["filename"]))
+                    stats["errors"] += 1
+                    continue
+                pdf_info = {
+                    "boxNumber": box_number_text(row["box_number"]),
+                    "setId": set_id,
+                    "filename": Path(row["filename"]).name,
+                }
+                jobs.append((pdf_path, pdf_info))
+                expected[set_id] = (row["page_count"], row["page_rows"])
+            if not jobs:
+                continue
+
+            # Documents the manifest has never seen may have been migrated,
+            # perhaps only in part, from another machine; one point lookup
+            # each, and prepare_set checks the found sets' page records
+            unseen = [info for _, info in jobs if manifest.get_pdf(info["setId"]) is None]
+            existing_sets = lookup_sets(dynamodb, tables, unseen) if unseen else set()
+            process_pdfs_parallel(
+                jobs, workers, s3_client, dynamodb, tables, bucket, set(), existing_sets,
+                stats, manifest=manifest, executor=executor, on_done=on_done,
+            )
+    return {**stats, "missing": missing, "mismatched": mismatched}
+
+
+def main():
+    args = sys.argv[1:]
+    db_path = None
+    pdf_dir = None
+    ocr_dir = None
+    env_id = None
+    tenant_id_arg = None
+    manifest_path = None
+    workers = 4
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--db", "--pdf-dir", "--ocr-dir", "--env", "--tenant", "--manifest",
+                       "--renderer", "--workers"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires an argument")
+                sys.exit(1)
+            value = args[i + 1]
+            if args[i] == "--db":
+                db_path = Path(value)
+            elif args[i] == "--pdf-dir":
+                pdf_dir = Path(value)
+            elif args[i] == "--ocr-dir":
+                ocr_dir = Path(value)
+            elif args[i] == "--env":
+                env_id = value
+            elif args[i] == "--tenant":
+                tenant_id_arg = value
+            elif args[i] == "--manifest":
+                manifest_path = Path(value)
+            elif args[i] == "--renderer":
+                if value not in ("pdf2image", "pymupdf"):
+                    print("Error: --renderer must be pdf2image or pymupdf")
+                    sys.exit(1)
+                if value == "pymupdf" and not upload_pages.pymupdf_installed():
+                    print("Error: --renderer pymupdf requires PyMuPDF (pip install pymupdf)")
+                    sys.exit(1)
+                upload_pages.RENDERER = value
+            elif value.isdigit() and int(value) > 0:
+                workers = int(value)
+            else:
+                print("Error: --workers requires a positive integer")
+                sys.exit(1)
+            i += 2
+        else:
+            print("Usage: python migrate_docsense.py --db DOCSENSE.db --pdf-dir DIR [--ocr-dir DIR] "
+                  "[--tenant TENANT] [--env ENV_ID] [--workers N] [--renderer pdf2image|pymupdf] "
+                  "[--manifest PATH]")
+            sys.exit(1)
+
+    if not db_path or not pdf_dir:
+        print("Error: --db and --pdf-dir are required")
+        sys.exit(1)
+    if not db_path.is_file() or not pdf_dir.is_dir() or (ocr_dir and not ocr_dir.is_dir()):
+        print("Error: --db must be a file and --pdf-dir/--ocr-dir folders")
+        sys.exit(1)
+
+    upload_pages.load_amplify_config()
+    upload_pages.AWS_REGION = os.environ.get("AWS_REGION", upload_pages.AWS_REGION)
+    upload_pages.TENANT_ID = tenant_id_arg or os.environ.get("TENANT_ID", upload_pages.TENANT_ID)
+    print(f"Using tenant ID: {upload_pages.TENANT_ID}")
+
+    import boto3
+    session = boto3.Session(region_name=upload_pages.AWS_REGION)
+    s3_client = session.client("s3", config=upload_pages.s3_client_config())
+    dynamodb = session.resource("dynamodb")
+
+    cache_key = upload_pages.discovery_cache_key(env_id)
+    cached = upload_pages.load_cached_environment(cache_key)
+    tables = cached["tables"] if cached else upload_pages.find_dynamodb_tables(dynamodb.meta.client, env_id)
+    if isinstance(tables, list):
+        print("Error: Multiple Box2Cloud environments found; use --env with one of:")
+        for env in tables:
+            print(f"  {env['env_id']}")
+        sys.exit(1)
+    if not all(name in tables for name in ("box", "set", "page")):
+        print(f"Error: Could not find the Box, Set and Page tables. Found: {tables}")
+        sys.exit(1)
+
+    bucket = os.environ.get("S3_BUCKET", upload_pages.S3_BUCKET) or (cached or {}).get("bucket")
+    if not bucket:
+        bucket = upload_pages.find_s3_buckets(s3_client, env_id)
+        if not isinstance(bucket, str):
+            print("Error: Could not pick the page bucket; set S3_BUCKET")
+            sys.exit(1)
+    if not cached:
+        upload_pages.save_cached_environment(cache_key, tables, bucket)
+    upload_pages.S3_BUCKET = bucket
+    print(f"Using tables: {tables}")
+    print(f"Using S3 bucket: {bucket}")
+
+    manifest = IngestManifest(manifest_path or db_path.parent / MIGRATION_MANIFEST_FILENAME,
+                              upload_pages.TENANT_ID)
+    print(f"Using manifest: {manifest.path}")
+    print(f"Migrating {db_path} on {workers} worker processes")
+
+    started = time.perf_counter()
+    try:
+        result = migrate(db_path, pdf_dir, ocr_dir, s3_client, dynamodb, tables, bucket, manifest, workers)
+    finally:
+        manifest.close()
+    wall_seconds = time.perf_counter() - started
+
+    print(f"\n{'='*50}")
+    print("Migration Complete!" if not result["errors"] else "Migration finished with errors")
+    print(f"  Migrated: {result['processed']} documents ({result['pages']} pages)")
+    print(f"  Skipped:  {result['skipped']} (already migrated)")
+    print(f"  Errors:   {result['errors']}")
+    for set_id, filename in result["missing"][:10]:
+        print(f"    {set_id}: PDF not found: {filename}")
+    for set_id, pages, page_count, page_rows in result["mismatched"][:10]:
+        print(f"  Warning: {set_id} has {pages} pages in its PDF, DocSense says "
+              f"{page_count} (page_count) / {page_rows} (page rows)")
+    print_transfer_stats(wall_seconds)
+    print_pipeline_stats()
+    if result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
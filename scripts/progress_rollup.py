@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Progress Rollup
+
+Keeps one Box2CloudTenantProgress item per tenant, holding a snapshot of
+every box's counters and its SHRED/RETAIN/REVIEW recommendation, so the
+GET /progress response in CLOUD_MIGRATION_SPEC.md is a single GetItem
+instead of a scan of every box.
+
+The rollup is fed by the Box table's DynamoDB stream (view type
+NEW_AND_OLD_IMAGES). Every writer of review decisions - the web client,
+review_queue.py and the ingester - updates the box counters along with the
+pages, so box images carry everything the summary needs. Records from other
+tables, such as the Page stream, are ignored.
+
+Each box entry stores the stream sequence number it was built from, and is
+only replaced by a record with a higher one. Replaying a batch, or records
+arriving out of order, never double-counts or rolls a box back. Deleted
+boxes leave a tombstone for the same reason. A rebuild has no sequence
+numbers to store, so it stamps the summary with the time it read the Box
+table, and records created before then are ignored as stale.
+
+Runs as a Lambda on the stream (see handler) and behind GET /progress (see
+progress_handler), or from the command line. `replay` feeds recorded stream
+events (a Lambda event, or a JSON list of records) to the rollup, for
+testing locally or catching up after an outage:
+
+Usage:
+    python progress_rollup.py show --tenant wth
+    python progress_rollup.py replay events.json [more.json ...]
+    python progress_rollup.py rebuild --tenant wth
+
+    # Specify environment when multiple exist
+    python progress_rollup.py show --env 3qslisom2rf57gtlhmdx3gwuqa
+
+Requirements:
+    pip install boto3
+"""
+
+import json
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from box_records import box_status, get_tenant_groups
+from review_queue import utc_timestamp
+
+# Stream sequence numbers are decimal strings of up to 40 digits; padded to
+# a fixed width they compare correctly as DynamoDB strings
+SEQUENCE_WIDTH = 40
+
+# Entries written by `rebuild` lose to any stream record created after it
+# (the summary's rebuiltAt, in epoch seconds)
+REBUILD_SEQUENCE = "0" * SEQUENCE_WIDTH
+
+# Lambda containers keep their clients between invocations
+_lambda_context: dict = {}
+
+
+def box_recommendation(box: dict) -> str | None:
+    """Recommendation for a complete box, as BoxCard.tsx shows it; None until then."""
+    if box["status"] != "complete":
+        return None
+    if box["pagesRetain"] > 0:
+        return "RETAIN"
+    if box["pagesUnsure"] > 0:
+        return "REVIEW"
+    return "SHRED"
+
+
+def box_entry(box: dict, sequence: str) -> dict:
+    """The summary entry for one box item (plain values, as read from the table)."""
+    entry = {
+        "boxNumber": box.get("boxNumber", ""),
+        "totalPages": int(box.get("totalPages") or 0),
+        "pagesReviewed": int(box.get("pagesReviewed") or 0),
+        "pagesShred": int(box.get("pagesShred") or 0),
+        "pagesUnsure": int(box.get("pagesUnsure") or 0),
+        "pagesRetain": int(box.get("pagesRetain") or 0),
+        "seq": sequence,
+    }
+    # The stored status may lag the counters (see refresh_box_status)
+    entry["status"] = box_status(entry["totalPages"], entry["pagesReviewed"])
+    entry["recommendation"] = box_recommendation(entry)
+    return entry
+
+
+def _is_box_record(record: dict) -> bool:
+    arn = record.get("eventSourceARN")
+    if arn:
+        return ":table/Box2CloudBox-" in arn
+    # Hand-written records without a source: recognise box images
+    image = record["dynamodb"].get("NewImage") or record["dynamodb"].get("OldImage") or {}
+    return "boxNumber" in image and "pageId" not in image
+
+
+def latest_box_changes(records: list) -> tuple[dict, int]:
+    """
+    Reduce stream records to the newest change per box.
+
+    Returns ({tenant_id: {box_id: (sequence, box or None, created)}},
+    ignored), where box is the new image as plain values and None means the
+    box was deleted, and created is the record's ApproximateCreationDateTime
+    (None on hand-written records without one). `ignored` counts records
+    from other tables.
+    """
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+
+    changes: dict[str, dict] = {}
+    ignored = 0
+    for record in records:
+        if not _is_box_record(record):
+            ignored += 1
+            continue
+        stream = record["dynamodb"]
+        sequence = stream["SequenceNumber"].zfill(SEQUENCE_WIDTH)
+        image = stream.get("NewImage") if record["eventName"] != "REMOVE" else None
+        keys_from = image or stream.get("OldImage") or {}
+        if "tenantId" not in keys_from:
+            # A REMOVE without its old image can't be placed in a tenant
+            ignored += 1
+            continue
+        tenant_id = deserializer.deserialize(keys_from["tenantId"])
+        box_id = deserializer.deserialize(stream["Keys"]["id"])
+
+        boxes = changes.setdefault(tenant_id, {})
+        if box_id not in boxes or boxes[box_id][0] < sequence:
+            box = {name: deserializer.deserialize(value) for name, value in image.items()} if image else None
+            created = stream.get("ApproximateCreationDateTime")
+            boxes[box_id] = (sequence, box, int(created) if created is not None else None)
+    return changes, ignored
+
+
+def _ensure_summary(table, tenant_id: str) -> None:
+    """Create the tenant's summary item, or leave it as it is."""
+    now = utc_timestamp(datetime.now(timezone.utc))
+    table.update_item(
+        Key={"id": tenant_id},
+        UpdateExpression=(
+            "SET boxes = if_not_exists(boxes, :empty), tenantId = :tenant, "
+            "#groups = if_not_exists(#groups, :groups), "
+            "createdAt = if_not_exists(createdAt, :now), updatedAt = :now"
+        ),
+        ExpressionAttributeNames={"#groups": "groups"},
+        ExpressionAttributeValues={
+            ":empty": {},
+            ":tenant": tenant_id,
+            ":groups": get_tenant_groups(tenant_id),
+            ":now": now,
+        },
+    )
+
+
+def apply_box_change(table, tenant_id: str, box_id: str, sequence: str, box: dict | None,
+                     created: int | None = None) -> bool:
+    """
+    Write one box's entry if `sequence` is newer than the stored one and the
+    record was not created before the summary was last rebuilt.
+
+    Returns False when the stored entry is as new or newer (a replay or an
+    out-of-order record).
+    """
+    entry = box_entry(box, sequence) if box is not None else {"seq": sequence, "deleted": True}
+    condition = "(attribute_not_exists(boxes.#box) OR boxes.#box.seq < :seq)"
+    values = {":entry": entry, ":seq": sequence}
+    if created is not None:
+        condition += " AND (attribute_not_exists(rebuiltAt) OR rebuiltAt <= :created)"
+        values[":created"] = created
+    try:
+        table.update_item(
+            Key={"id": tenant_id},
+            UpdateExpression="SET boxes.#box = :entry",
+            ConditionExpression=condition,
+            ExpressionAttributeNames={"#box": box_id},
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+def process_records(dynamodb, table_name: str, records: list) -> dict:
+    """
+    Apply a batch of stream records to the tenant summaries.
+
+    Safe to call again with the same records. Returns counts of boxes
+    applied, changes skipped as stale and records ignored.
+    """
+    table = dynamodb.Table(table_name)
+    changes, ignored = latest_box_changes(records)
+    stats = {"applied": 0, "stale": 0, "ignored": ignored}
+    for tenant_id, boxes in changes.items():
+        _ensure_summary(table, tenant_id)
+        for box_id, (sequence, box, created) in boxes.items():
+            if apply_box_change(table, tenant_id, box_id, sequence, box, created):
+                stats["applied"] += 1
+            else:
+                stats["stale"] += 1
+    return stats
+
+
+def rebuild_summary(dynamodb, tables: dict, tenant_id: str) -> int:
+    """
+    Replace a tenant's summary with one built from the Box table.
+
+    For backfilling a tenant whose boxes predate the stream, or repairing a
+    summary after the stream fell more than its 24-hour retention behind.
+    Rebuilt entries lose to any stream record created after the rebuild
+    started reading; older records, such as a retried batch, are stale.
+    Returns the number of boxes.
+    """
+    from boto3.dynamodb.conditions import Key
+
+    # Whole seconds, as stream records carry them; a record from the same
+    # second is applied, since the read may have missed it
+    rebuilt_at = int(datetime.now(timezone.utc).timestamp())
+    box_table = dynamodb.Table(tables["box"])
+    query_args = {"IndexName": "byTenant", "KeyConditionExpression": Key("tenantId").eq(tenant_id)}
+    boxes = {}
+    while True:
+        response = box_table.query(**query_args)
+        for box in response["Items"]:
+            boxes[box["id"]] = box_entry(box, REBUILD_SEQUENCE)
+        if "LastEvaluatedKey" not in response:
+            break
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    now = utc_timestamp(datetime.now(timezone.utc))
+    dynamodb.Table(tables["progress"]).put_item(Item={
+        "id": tenant_id,
+        "tenantId": tenant_id,
+        "groups": get_tenant_groups(tenant_id),
+        "boxes": boxes,
+        "rebuiltAt": rebuilt_at,
+        "createdAt": now,
+        "updatedAt": now,
+    })
+    return len(boxes)
+
+
+def get_progress(dynamodb, table_name: str, tenant_id: str) -> dict:
+    """The GET /progress response for a tenant, from its summary item."""
+    response = dynamodb.Table(table_name).get_item(Key={"id": tenant_id})
+    entries = response.get("Item", {}).get("boxes", {})
+    boxes = sorted((entry for entry in entries.values() if not entry.get("deleted")),
+                   key=lambda entry: entry["boxNumber"])
+
+    total_pages = sum(int(box["totalPages"]) for box in boxes)
+    pages_reviewed = sum(int(box["pagesReviewed"]) for box in boxes)
+    statuses = [box["status"] for box in boxes]
+    return {
+        "total_pages": total_pages,
+        "pages_reviewed": pages_reviewed,
+        "pages_remaining": total_pages - pages_reviewed,
+        "percent_complete": round(100 * pages_reviewed / total_pages, 1) if total_pages else 0.0,
+        "breakdown": {
+            "shred": sum(int(box["pagesShred"]) for box in boxes),
+            "unsure": sum(int(box["pagesUnsure"]) for box in boxes),
+            "retain": sum(int(box["pagesRetain"]) for box in boxes),
+        },
+        "boxes_summary": {
+            "total": len(boxes),
+            "complete": statuses.count("complete"),
+            "in_progress": statuses.count("in_progress"),
+            "pending": statuses.count("pending"),
+        },
+        "boxes": [
+            {
+                "box_number": box["boxNumber"],
+                "total_pages": int(box["totalPages"]),
+                "pages_reviewed": int(box["pagesReviewed"]),
+                "status": box["status"],
+                "recommendation": box["recommendation"],
+                "breakdown": {
+                    "shred": int(box["pagesShred"]),
+                    "unsure": int(box["pagesUnsure"]),
+                    "retain": int(box["pagesRetain"]),
+                },
+            }
+            for box in boxes
+        ],
+    }
+
+
+def _lambda_dynamodb():
+    if not _lambda_context:
+        import boto3
+        _lambda_context["dynamodb"] = boto3.Session().resource("dynamodb")
+    return _lambda_context["dynamodb"]
+
+
+def handler(event: dict, context) -> dict:
+    """
+    DynamoDB stream entry point for the Box table. The summary table comes
+    from the PROGRESS_TABLE environment variable. Raising fails the batch,
+    and Lambda retries it; retries are harmless.
+    """
+    stats = process_records(_lambda_dynamodb(), os.environ["PROGRESS_TABLE"], event.get("Records", []))
+    print(json.dumps(stats))
+    return stats
+
+
+def progress_handler(event: dict, context) -> dict:
+    """API Gateway (REST, Cognito authorizer) entry point for GET /progress."""
+    claims = event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
+    groups = claims.get("cognito:groups", "")
+    groups = groups if isinstance(groups, list) else [g for g in re.split(r"[,\s\[\]]+", groups) if g]
+    tenants = {match.group(1) for match in
+               (re.fullmatch(r"tenant_(.+)_(viewer|reviewer)", group) for group in groups) if match}
+    if len(tenants) != 1:
+        return {"statusCode": 403, "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": "Not a member of exactly one tenant"})}
+
+    progress = get_progress(_lambda_dynamodb(), os.environ["PROGRESS_TABLE"], tenants.pop())
+    return {"statusCode": 200, "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(progress)}
+
+
+def load_recorded_records(path: str) -> list:
+    """Stream records from a recorded Lambda event, or a JSON list of events or records."""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    records = []
+    for item in data:
+        records.extend(item["Records"] if "Records" in item else [item])
+    return records
+
+
+def main():
+    # The command line shares upload_pages.py's configuration and table
+    # discovery; the Lambda handlers need neither
+    import upload_pages
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ("show", "replay", "rebuild"):
+        print("Usage: python progress_rollup.py show [--tenant TENANT] [--env ENV_ID]")
+        print("       python progress_rollup.py replay EVENTS.json [...] [--env ENV_ID]")
+        print("       python progress_rollup.py rebuild [--tenant TENANT] [--env ENV_ID]")
+        sys.exit(1)
+
+    command, args = args[0], args[1:]
+    env_id = None
+    tenant_id = os.environ.get("TENANT_ID", upload_pages.TENANT_ID)
+    paths = []
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--env", "--tenant"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires an argument")
+                sys.exit(1)
+            if args[i] == "--env":
+                env_id = args[i + 1]
+            else:
+                tenant_id = args[i + 1]
+            i += 2
+        else:
+            paths.append(args[i])
+            i += 1
+
+    if (command == "replay") != bool(paths):
+        print("Error: replay needs one or more event files, and the other commands take none")
+        sys.exit(1)
+
+    import boto3
+    upload_pages.AWS_REGION = os.environ.get("AWS_REGION", upload_pages.AWS_REGION)
+    session = boto3.Session(region_name=upload_pages.AWS_REGION)
+    dynamodb = session.resource("dynamodb")
+
+    cached = upload_pages.load_cached_environment(upload_pages.discovery_cache_key(env_id))
+    tables = cached["tables"] if cached else {}
+    if "progress" not in tables:
+        tables = upload_pages.find_dynamodb_tables(dynamodb.meta.client, env_id)
+    if isinstance(tables, list):
+        print("Error: Multiple Box2Cloud environments found; use --env with one of:")
+        for env in tables:
+            print(f"  {env['env_id']}")
+        sys.exit(1)
+    if not all(name in tables for name in ("box", "progress")):
+        print(f"Error: Could not find the Box and TenantProgress tables. Found: {tables}")
+        sys.exit(1)
+
+    if command == "show":
+        print(json.dumps(get_progress(dynamodb, tables["progress"], tenant_id), indent=2))
+    elif command == "replay":
+        for path in paths:
+            stats = process_records(dynamodb, tables["progress"], load_recorded_records(path))
+            print(f"{path}: {stats['applied']} boxes updated, {stats['stale']} stale, "
+                  f"{stats['ignored']} records ignored")
+    else:
+        count = rebuild_summary(dynamodb, tables, tenant_id)
+        print(f"Rebuilt the {tenant_id} summary from {count} boxes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Consistency Reconciler
+
+Checks that a tenant's page images in S3, Box2CloudPage records,
+Box2CloudSet page counts and box counters agree, and optionally repairs
+what can be repaired. Finds:
+
+  orphan objects    images in S3 that no page record refers to
+  missing objects   page records whose image or thumbnail is not in S3
+  missing pages     page numbers of a set (1..pageCount) with no record,
+                    other than those --blank-pages skip left out
+  orphan pages      page records whose set record does not exist
+  duplicate pages   more than one record for the same set and page number
+  counter drift     box counters that differ from the records
+
+Each box number is checked on its own, several at a time: its S3 prefix
+is listed while the set and page records of its box records (normally
+one, but concurrent ingesters of older versions could create several)
+are queried through the byBox indexes. Objects are compared with the
+pages of all of them, so one record's images are not another's orphans. S3 lists keys in order and sets come back in setId order, so
+objects are joined to records by s3Key, and records to sets by setId,
+with sort-merges over one box's data rather than tenant-wide lookups.
+
+With --repair:
+  - orphan objects older than ORPHAN_MIN_AGE_SECONDS are deleted (younger
+    ones may belong to an ingest that has not written its records yet)
+  - duplicate page records are deleted, keeping a reviewed one
+  - box counters are rewritten from the records, unless the box changed
+    while it was being checked
+Missing objects and missing pages need the PDF: re-run upload_pages.py on
+it (its manifest resumes the missing pages) or with --force.
+
+Usage:
+    python reconcile.py --tenant wth
+    python reconcile.py --tenant wth --repair
+
+    # Specify environment when multiple exist
+    python reconcile.py --env 3qslisom2rf57gtlhmdx3gwuqa
+
+Requirements:
+    pip install boto3
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+from botocore.exceptions import ClientError
+
+import upload_pages
+from upload_pages import (
+    S3_DELETE_BATCH, batch_delete, box_status, query_all, review_counter_deltas,
+)
+
+# Boxes checked at once; each also lists its S3 prefix on another thread
+BOX_WORKERS = 8
+
+# Orphan objects younger than this are left alone by --repair
+ORPHAN_MIN_AGE_SECONDS = 3600
+
+# Examples printed per finding
+SHOW_EXAMPLES = 3
+
+BOX_COUNTERS = {
+    "sets": "totalSets", "pages": "totalPages", "reviewed": "pagesReviewed",
+    "shred": "pagesShred", "unsure": "pagesUnsure", "retain": "pagesRetain",
+}
+
+
+def list_objects(s3_client, bucket: str, prefix: str) -> list:
+    """(key, last_modified) of every object under a prefix, in key order."""
+    objects = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend((obj["Key"], obj["LastModified"]) for obj in page.get("Contents", []))
+    return objects
+
+
+def merge_objects(objects: list, referenced: list) -> tuple[list, list]:
+    """
+    Sort-merge S3 objects (in key order) with the sorted keys page records
+    refer to. Returns (orphan objects, missing keys).
+    """
+    orphans = []
+    missing = []
+    i = j = 0
+    while i < len(objects) or j < len(referenced):
+        if j == len(referenced) or (i < len(objects) and objects[i][0] < referenced[j]):
+            orphans.append(objects[i])
+            i += 1
+        elif i == len(objects) or referenced[j] < objects[i][0]:
+            missing.append(referenced[j])
+            j += 1
+        else:
+            # Several records may share a key (duplicates); consume them all
+            key = referenced[j]
+            while j < len(referenced) and referenced[j] == key:
+                j += 1
+            i += 1
+    return orphans, missing
+
+
+def merge_sets(sets: list, pages: list) -> dict:
+    """
+    Sort-merge set records (in setId order) with page records sorted by
+    (setId, pageNumber). Returns missing, orphan and duplicate pages.
+    """
+    findings = {"missing_pages": [], "orphan_pages": [], "duplicates": []}
+    page_groups = groupby(pages, key=lambda page: page["setId"])
+    group = next(page_groups, None)
+    for set_item in sets:
+        # Page groups before this set have no set record
+        while group is not None and group[0] < set_item["setId"]:
+            findings["orphan_pages"].extend(group[1])
+            group = next(page_groups, None)
+        set_pages = []
+        if group is not None and group[0] == set_item["setId"]:
+            set_pages = list(group[1])
+            group = next(page_groups, None)
+
+        numbers = set()
+        for number, copies in groupby(set_pages, key=lambda page: int(page["pageNumber"])):
+            copies = list(copies)
+            numbers.add(number)
+            if len(copies) > 1:
+                findings["duplicates"].append(copies)
+        expected = int(set_item.get("pageCount") or 0)
+        skipped = {int(number) for number in set_item.get("skippedPages", [])}
+        absent = [number for number in range(1, expected + 1)
+                  if number not in numbers and number not in skipped]
+        if absent:
+            findings["missing_pages"].append((set_item["setId"], absent))
+    while group is not None:
+        findings["orphan_pages"].extend(group[1])
+        group = next(page_groups, None)
+    return findings
+
+
+def check_box(dynamodb, s3_client, s3_pool, tables: dict, bucket: str,
+              tenant_id: str, boxes: list) -> dict:
+    """
+    Check the box records of one box number; returns their findings and,
+    per box record id, the counters its records add up to.
+    """
+    # Boxes are checked on several threads, so queries go through the
+    # resource's client, which is thread-safe and takes plain values
+    client = dynamodb.meta.client
+    objects_future = s3_pool.submit(list_objects, s3_client, bucket, f"{tenant_id}/{boxes[0]['boxNumber']}/")
+    findings = {"missing_pages": [], "orphan_pages": [], "duplicates": [], "drift": {}, "counts": {}}
+    referenced = []
+    for box in boxes:
+        sets = list(query_all(
+            client,
+            TableName=tables["set"],
+            IndexName="byBox",
+            KeyConditionExpression="boxId = :box",
+            ExpressionAttributeValues={":box": box["id"]},
+            ProjectionExpression="id, setId, pageCount, skippedPages",
+        ))
+        pages = list(query_all(
+            client,
+            TableName=tables["page"],
+            IndexName="byBox",
+            KeyConditionExpression="boxId = :box",
+            ExpressionAttributeValues={":box": box["id"]},
+            ProjectionExpression="id, setId, pageNumber, s3Key, thumbnailKey, reviewStatus",
+        ))
+        pages.sort(key=lambda page: (page["setId"], int(page["pageNumber"])))
+
+        merged = merge_sets(sets, pages)
+        for name, items in merged.items():
+            findings[name].extend(items)
+        referenced.extend(key for page in pages for key in (page.get("s3Key"), page.get("thumbnailKey")) if key)
+
+        # Duplicates are counted once: that is what the box will hold after --repair
+        extra = {page["id"] for copies in merged["duplicates"] for page in keep_one(copies)[1]}
+        counts = review_counter_deltas([page for page in pages if page["id"] not in extra])
+        counts["sets"] = len(sets)
+        drift = {
+            name: (int(box.get(attribute) or 0), counts[name])
+            for name, attribute in BOX_COUNTERS.items()
+            if int(box.get(attribute) or 0) != counts[name]
+        }
+        if drift:
+            findings["drift"][box["id"]] = drift
+        findings["counts"][box["id"]] = counts
+
+    referenced.sort()
+    findings["orphan_objects"], findings["missing_objects"] = merge_objects(objects_future.result(), referenced)
+    return findings
+
+
+def keep_one(copies: list) -> tuple[dict, list]:
+    """Pick the record to keep among duplicates (a reviewed one if any); returns (kept, extra)."""
+    ordered = sorted(copies, key=lambda page: (page.get("reviewStatus") in (None, "pending"), page["id"]))
+    return ordered[0], ordered[1:]
+
+
+def repair_box_counters(dynamodb, table_name: str, box: dict, counts: dict) -> bool:
+    """
+    Overwrite a box's counters with the counted values, unless they changed
+    since the box was read. Returns False if they had.
+    """
+    names = {"#st": "status"}
+    values = {":status": box_status(counts["pages"], counts["reviewed"])}
+    assignments = ["#st = :status"]
+    conditions = []
+    for name, attribute in BOX_COUNTERS.items():
+        names[f"#{name}"] = attribute
+        values[f":{name}"] = counts[name]
+        assignments.append(f"#{name} = :{name}")
+        if attribute in box:
+            values[f":old_{name}"] = box[attribute]
+            conditions.append(f"#{name} = :old_{name}")
+        else:
+            conditions.append(f"attribute_not_exists(#{name})")
+    try:
+        dynamodb.Table(table_name).update_item(
+            Key={"id": box["id"]},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ConditionExpression=" AND ".join(conditions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+def delete_objects(s3_client, bucket: str, keys: list) -> None:
+    """Delete keys with batched DeleteObjects calls."""
+    for start in range(0, len(keys), S3_DELETE_BATCH):
+        batch = keys[start:start + S3_DELETE_BATCH]
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        if response.get("Errors"):
+            error = response["Errors"][0]
+            raise RuntimeError(f"Could not delete s3://{bucket}/{error['Key']}: {error['Message']}")
+
+
+def orphan_box_objects(s3_client, bucket: str, tenant_id: str, box_numbers: set) -> list:
+    """Objects under box prefixes of the tenant that have no box record."""
+    objects = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{tenant_id}/", Delimiter="/"):
+        for common in page.get("CommonPrefixes", []):
+            box_number = common["Prefix"][len(tenant_id) + 1:-1]
+            if box_number not in box_numbers:
+                objects.extend(list_objects(s3_client, bucket, common["Prefix"]))
+    return objects
+
+
+def print_findings(box_number: str, boxes: list, findings: dict) -> None:
+    """Print one box number's findings, a few examples each."""
+    def examples(items) -> str:
+        shown = ", ".join(str(item) for item in items[:SHOW_EXAMPLES])
+        return shown + (", ..." if len(items) > SHOW_EXAMPLES else "")
+
+    lines = []
+    if len(boxes) > 1:
+        lines.append(f"{len(boxes)} box records share this box number: {examples([box['id'] for box in boxes])}")
+    if findings["orphan_objects"]:
+        lines.append(f"{len(findings['orphan_objects'])} orphan objects: "
+                     f"{examples([key for key, _ in findings['orphan_objects']])}")
+    if findings["missing_objects"]:
+        lines.append(f"{len(findings['missing_objects'])} missing objects: {examples(findings['missing_objects'])}")
+    for set_id, absent in findings["missing_pages"]:
+        lines.append(f"set {set_id}: {len(absent)} pages without records: {examples(absent)}")
+    if findings["orphan_pages"]:
+        lines.append(f"{len(findings['orphan_pages'])} page records without a set: "
+                     f"{examples(sorted({page['setId'] for page in findings['orphan_pages']}))}")
+    if findings["duplicates"]:
+        lines.append(f"{len(findings['duplicates'])} pages recorded more than once: "
+                     f"{examples([(copies[0]['setId'], int(copies[0]['pageNumber'])) for copies in findings['duplicates']])}")
+    for box_id, drift in findings["drift"].items():
+        lines.append(("counters: " if len(boxes) == 1 else f"counters of {box_id}: ") + ", ".join(
+            f"{BOX_COUNTERS[name]} {stored} -> {counted}" for name, (stored, counted) in drift.items()))
+    if lines:
+        print(f"  Box {box_number}:")
+        for line in lines:
+            print(f"    {line}")
+
+
+def reconcile_tenant(dynamodb, s3_client, tables: dict, bucket: str, tenant_id: str,
+                     repair: bool = False) -> dict:
+    """Check (and with `repair`, fix) every box of a tenant; returns totals per finding."""
+    from boto3.dynamodb.conditions import Key
+
+    boxes = sorted(query_all(
+        dynamodb.Table(tables["box"]),
+        IndexName="byTenant",
+        KeyConditionExpression=Key("tenantId").eq(tenant_id),
+    ), key=lambda box: box["boxNumber"])
+    # Box records sharing a box number share its S3 prefix, so they are checked together
+    box_groups = [list(group) for _, group in groupby(boxes, key=lambda box: box["boxNumber"])]
+    print(f"Checking {len(boxes)} boxes of tenant {tenant_id} against s3://{bucket}/{tenant_id}/")
+
+    totals = dict.fromkeys(("orphan_objects", "missing_objects", "missing_pages", "orphan_pages",
+                            "duplicates", "drift"), 0)
+    repaired = dict.fromkeys(("objects", "records", "boxes", "boxes_changed"), 0)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ORPHAN_MIN_AGE_SECONDS)
+
+    with ThreadPoolExecutor(max_workers=BOX_WORKERS) as box_pool, \
+            ThreadPoolExecutor(max_workers=BOX_WORKERS) as s3_pool:
+        stray_future = s3_pool.submit(orphan_box_objects, s3_client, bucket, tenant_id, {box["boxNumber"] for box in boxes})
+        results = box_pool.map(
+            lambda group: check_box(dynamodb, s3_client, s3_pool, tables, bucket, tenant_id, group), box_groups)
+
+        for group, findings in zip(box_groups, results):
+            print_findings(group[0]["boxNumber"], group, findings)
+            totals["orphan_objects"] += len(findings["orphan_objects"])
+            totals["missing_objects"] += len(findings["missing_objects"])
+            totals["missing_pages"] += sum(len(absent) for _, absent in findings["missing_pages"])
+            totals["orphan_pages"] += len(findings["orphan_pages"])
+            totals["duplicates"] += len(findings["duplicates"])
+            totals["drift"] += len(findings["drift"])
+            if not repair:
+                continue
+
+            old_orphans = [key for key, modified in findings["orphan_objects"] if modified < cutoff]
+            delete_objects(s3_client, bucket, old_orphans)
+            repaired["objects"] += len(old_orphans)
+            extra = [{"id": page["id"]} for copies in findings["duplicates"] for page in keep_one(copies)[1]]
+            repaired["records"] += batch_delete(dynamodb, tables["page"], extra)
+            for box in group:
+                if box["id"] not in findings["drift"]:
+                    continue
+                if repair_box_counters(dynamodb, tables["box"], box, findings["counts"][box["id"]]):
+                    repaired["boxes"] += 1
+                else:
+                    repaired["boxes_changed"] += 1
+
+        stray = stray_future.result()
+
+    if stray:
+        print(f"  {len(stray)} objects under box prefixes with no box record: "
+              f"{', '.join(key for key, _ in stray[:SHOW_EXAMPLES])}")
+        totals["orphan_objects"] += len(stray)
+        if repair:
+            old_stray = [key for key, modified in stray if modified < cutoff]
+            delete_objects(s3_client, bucket, old_stray)
+            repaired["objects"] += len(old_stray)
+    return {**totals, **({"repaired": repaired} if repair else {})}
+
+
+def main():
+    args = sys.argv[1:]
+    env_id = None
+    tenant_id = os.environ.get("TENANT_ID", upload_pages.TENANT_ID)
+    repair = False
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--env", "--tenant"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires an argument")
+                sys.exit(1)
+            if args[i] == "--env":
+                env_id = args[i + 1]
+            else:
+                tenant_id = args[i + 1]
+            i += 2
+        elif args[i] == "--repair":
+            repair = True
+            i += 1
+        else:
+            print("Usage: python reconcile.py [--tenant TENANT] [--env ENV_ID] [--repair]")
+            sys.exit(1)
+
+    upload_pages.load_amplify_config()
+    upload_pages.AWS_REGION = os.environ.get("AWS_REGION", upload_pages.AWS_REGION)
+
+    import boto3
+    session = boto3.Session(region_name=upload_pages.AWS_REGION)
+    s3_client = session.client("s3", config=upload_pages.s3_client_config())
+    dynamodb = session.resource("dynamodb")
+
+    cached = upload_pages.load_cached_environment(upload_pages.discovery_cache_key(env_id))
+    tables = cached["tables"] if cached else {}
+    if "set" not in tables:
+        tables = upload_pages.find_dynamodb_tables(dynamodb.meta.client, env_id)
+    if isinstance(tables, list):
+        print("Error: Multiple Box2Cloud environments found; use --env with one of:")
+        for env in tables:
+            print(f"  {env['env_id']}")
+        sys.exit(1)
+    if not all(name in tables for name in ("box", "set", "page")):
+        print(f"Error: Could not find the Box, Set and Page tables. Found: {tables}")
+        sys.exit(1)
+
+    bucket = os.environ.get("S3_BUCKET", upload_pages.S3_BUCKET) or (cached or {}).get("bucket")
+    if not bucket:
+        bucket = upload_pages.find_s3_buckets(s3_client, env_id)
+        if not isinstance(bucket, str):
+            print("Error: Could not pick the page bucket; set S3_BUCKET")
+            sys.exit(1)
+
+    started = time.perf_counter()
+    totals = reconcile_tenant(dynamodb, s3_client, tables, bucket, tenant_id, repair)
+    elapsed = time.perf_counter() - started
+
+    print(f"\nChecked in {elapsed:.1f}s: {totals['orphan_objects']} orphan objects, "
+          f"{totals['missing_objects']} missing objects, {totals['missing_pages']} missing pages, "
+          f"{totals['orphan_pages']} orphan page records, {totals['duplicates']} duplicated pages, "
+          f"{totals['drift']} boxes with counter drift")
+    if repair:
+        repaired = totals["repaired"]
+        print(f"Repaired: deleted {repaired['objects']} orphan objects and {repaired['records']} duplicate "
+              f"records, rewrote the counters of {repaired['boxes']} boxes")
+        if repaired["boxes_changed"]:
+            print(f"  {repaired['boxes_changed']} boxes changed while being checked; run again to repair them")
+    if totals["missing_objects"] or totals["missing_pages"]:
+        print("Missing objects and pages need their PDFs: re-run upload_pages.py on them, or with --force")
+
+
+if __name__ == "__main__":
+    main()
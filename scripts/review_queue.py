@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Box to Cloud - Review Queue
+
+Server-side queue for reviewers: hands out the next pending page under a
+5-minute lock and records review decisions, following the Queue Lock
+Mechanism in CLOUD_MIGRATION_SPEC.md on the Amplify tables.
+
+Candidates come from the Page table's byTenantAndStatus index. Instead of
+every reviewer reading the head of the queue and racing for the same page,
+the first SHARD_COUNT x SHARD_SIZE pending pages are split into shards
+whose start keys are remembered, and each claim reads one shard chosen at
+random. A page is claimed with a conditional update that only succeeds if
+it is still pending and unlocked (or its lock has expired), so two
+reviewers can never hold the same page, and a claim costs one query and
+usually one update however long the queue is.
+
+Runs as a Lambda behind the spec's routes (see handler), or from the
+command line:
+
+Usage:
+    python review_queue.py next --user USER_SUB --tenant wth
+    python review_queue.py review PAGE_RECORD_ID shred --user USER_SUB --tenant wth
+    python review_queue.py unlock PAGE_RECORD_ID --user USER_SUB --tenant wth
+
+    # Specify environment when multiple exist
+    python review_queue.py next --user USER_SUB --env 3qslisom2rf57gtlhmdx3gwuqa
+
+Requirements:
+    pip install boto3
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from box_records import get_tenant_groups, refresh_box_status
+
+# A lock older than this may be taken by another reviewer
+LOCK_SECONDS = 300
+
+# Claims read one shard of SHARD_SIZE pending pages, chosen at random from
+# the first SHARD_COUNT shards of the queue. Shard start keys are looked
+# up again after SHARD_REFRESH_SECONDS, or sooner once a shard runs dry.
+SHARD_COUNT = 16
+SHARD_SIZE = 25
+SHARD_REFRESH_SECONDS = 60
+
+REVIEW_DECISIONS = ("shred", "unsure", "retain")
+
+
+class ReviewError(Exception):
+    """A request the queue can't satisfy; `status` is the HTTP status for the API."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def utc_timestamp(moment: datetime) -> str:
+    # Same format as JavaScript's toISOString(), so locks written by the
+    # web client and by this module compare correctly as strings
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class ReviewQueue:
+    """
+    Claims, reviews and unlocks pages for one tenant.
+
+    All requests go through the resource's low-level client, which is safe
+    to share between threads. Shard start keys are kept per instance, as a
+    warm Lambda container would keep them between requests.
+    """
+
+    def __init__(self, dynamodb, tables: dict, tenant_id: str,
+                 shard_count: int | None = None, shard_size: int | None = None):
+        self.client = dynamodb.meta.client
+        self.box_table = dynamodb.Table(tables["box"])
+        self.tables = tables
+        self.tenant_id = tenant_id
+        self.shard_count = shard_count or SHARD_COUNT
+        self.shard_size = shard_size or SHARD_SIZE
+        # Conditional lock writes that lost a race, for the benchmark
+        self.conflicts = 0
+        self._shards: list = []
+        self._queue_rest = None
+        self._shards_at = 0.0
+
+    def _pending_pages(self, start_key: dict | None, limit: int) -> tuple[list, dict | None]:
+        query_args = {
+            "TableName": self.tables["page"],
+            "IndexName": "byTenantAndStatus",
+            "KeyConditionExpression": "tenantId = :tenant AND reviewStatus = :pending",
+            "ExpressionAttributeValues": {":tenant": self.tenant_id, ":pending": "pending"},
+            "Limit": limit,
+        }
+        if start_key:
+            query_args["ExclusiveStartKey"] = start_key
+        response = self.client.query(**query_args)
+        return response.get("Items", []), response.get("LastEvaluatedKey")
+
+    def _shard_keys(self) -> list:
+        """
+        Start keys of the first shard_count shards of the queue.
+
+        These are LastEvaluatedKeys handed out by DynamoDB, read with
+        shard_count small key-only queries; None starts at the head. The
+        key after the last shard is kept for when every shard is taken.
+        """
+        if self._shards and time.monotonic() - self._shards_at < SHARD_REFRESH_SECONDS:
+            return self._shards
+
+        shards = [None]
+        query_args = {
+            "TableName": self.tables["page"],
+            "IndexName": "byTenantAndStatus",
+            "KeyConditionExpression": "tenantId = :tenant AND reviewStatus = :pending",
+            "ExpressionAttributeValues": {":tenant": self.tenant_id, ":pending": "pending"},
+            "ProjectionExpression": "id",
+            "Limit": self.shard_size,
+        }
+        next_key = None
+        for _ in range(self.shard_count):
+            response = self.client.query(**query_args)
+            next_key = response.get("LastEvaluatedKey")
+            if not next_key:
+                break
+            query_args["ExclusiveStartKey"] = next_key
+            shards.append(next_key)
+        if next_key:
+            shards.pop()  # that key starts the rest of the queue, not a shard
+        self._shards, self._queue_rest = shards, next_key
+        self._shards_at = time.monotonic()
+        return shards
+
+    def _try_lock(self, page: dict, user_id: str) -> str | None:
+        """Lock one candidate page; returns the lock time, or None if the page was taken."""
+        now = datetime.now(timezone.utc)
+        locked_at = utc_timestamp(now)
+        try:
+            self.client.update_item(
+                TableName=self.tables["page"],
+                Key={"id": page["id"]},
+                UpdateExpression="SET lockedBy = :user, lockedAt = :now",
+                ConditionExpression=(
+                    "reviewStatus = :pending AND (attribute_not_exists(lockedBy) OR "
+                    "attribute_type(lockedBy, :null) OR lockedBy = :user OR lockedAt < :expiry)"
+                ),
+                ExpressionAttributeValues={
+                    ":user": user_id,
+                    ":now": locked_at,
+                    ":pending": "pending",
+                    ":null": "NULL",
+                    ":expiry": utc_timestamp(now - timedelta(seconds=LOCK_SECONDS)),
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            self.conflicts += 1
+            return None
+        return locked_at
+
+    def _claim_from(self, pages: list, user_id: str) -> tuple[dict, str] | None:
+        """Lock the first free page of a shard, trying them in random order."""
+        expiry = utc_timestamp(datetime.now(timezone.utc) - timedelta(seconds=LOCK_SECONDS))
+        free = [
+            page for page in pages
+            if not page.get("lockedBy") or page["lockedBy"] == user_id
+            or (page.get("lockedAt") or "") < expiry
+        ]
+        random.shuffle(free)
+        # A page this reviewer already holds (e.g. after a reload) comes first
+        free.sort(key=lambda page: page.get("lockedBy") != user_id)
+        for page in free:
+            locked_at = self._try_lock(page, user_id)
+            if locked_at:
+                return page, locked_at
+        return None
+
+    def claim_next_page(self, user_id: str) -> tuple[dict, str] | None:
+        """
+        Lock the next page for a reviewer.
+
+        Returns (page record, lockedAt), or None if nothing is pending.
+        Raises ReviewError(503) if pages are pending but all are locked.
+        """
+        shards = self._shard_keys()
+        saw_pages = False
+        for start_key in random.sample(shards, len(shards)):
+            pages, _ = self._pending_pages(start_key, self.shard_size)
+            if not pages:
+                self._shards_at = 0.0  # the queue has shrunk; re-shard next time
+                continue
+            saw_pages = True
+            claimed = self._claim_from(pages, user_id)
+            if claimed:
+                return claimed
+
+        # Every shard is locked: walk the rest of the queue
+        start_key = self._queue_rest
+        while start_key:
+            pages, start_key = self._pending_pages(start_key, self.shard_size)
+            saw_pages = saw_pages or bool(pages)
+            claimed = self._claim_from(pages, user_id)
+            if claimed:
+                return claimed
+
+        if saw_pages:
+            raise ReviewError(503, "All pending pages are locked by other reviewers")
+        return None
+
+    def get_next_page(self, user_id: str, s3_client=None, bucket: str | None = None) -> dict | None:
+        """GET /queue/next: the claimed page in the API's response shape, or None if the queue is empty."""
+        claimed = self.claim_next_page(user_id)
+        if not claimed:
+            return None
+        page, locked_at = claimed
+        box = self.client.get_item(
+            TableName=self.tables["box"], Key={"id": page["boxId"]},
+            ProjectionExpression="boxNumber, totalPages, pagesReviewed",
+        ).get("Item", {})
+
+        response = {
+            "page": {
+                "id": page["id"],
+                "page_id": page["pageId"],
+                "box_number": box.get("boxNumber"),
+                "set_id": page["setId"],
+                "page_number": int(page["pageNumber"]),
+                "filename": page["filename"],
+                "s3_key": page["s3Key"],
+                "thumbnail_key": page.get("thumbnailKey"),
+                "context": {
+                    "box_total_pages": int(box.get("totalPages", 0)),
+                    "box_pages_reviewed": int(box.get("pagesReviewed", 0)),
+                },
+            },
+            "lock_expires_at": utc_timestamp(
+                datetime.fromisoformat(locked_at.replace("Z", "+00:00"))
+                + timedelta(seconds=LOCK_SECONDS)
+            ),
+        }
+        if s3_client and bucket:
+            response["page"]["image_url"] = s3_client.generate_presigned_url(
+                "get_object", Params={"Bucket": bucket, "Key": page["s3Key"]},
+                ExpiresIn=LOCK_SECONDS,
+            )
+        return response
+
+    def submit_review(self, page_id: str, user_id: str, decision: str) -> dict:
+        """
+        POST /pages/{id}/review: record a decision on a page this reviewer has locked.
+
+        The page update, the box counters and the UserReview audit record
+        are written in one transaction that only goes through while the
+        reviewer still holds the lock.
+        """
+        if decision not in REVIEW_DECISIONS:
+            raise ReviewError(400, f"decision must be one of: {', '.join(REVIEW_DECISIONS)}")
+        page = self.client.get_item(
+            TableName=self.tables["page"], Key={"id": page_id}, ConsistentRead=True,
+        ).get("Item")
+        if not page or page.get("tenantId") != self.tenant_id:
+            raise ReviewError(404, "Page not found")
+
+        # Page filenames are image names, so the box number comes from the
+        # box record, as the web client takes it
+        box_number = self.client.get_item(
+            TableName=self.tables["box"], Key={"id": page["boxId"]},
+            ProjectionExpression="boxNumber",
+        ).get("Item", {}).get("boxNumber", "")
+        now = utc_timestamp(datetime.now(timezone.utc))
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {"Update": {
+                    "TableName": self.tables["page"],
+                    "Key": {"id": page_id},
+                    "UpdateExpression": "SET reviewStatus = :decision, reviewedBy = :user, "
+                                        "reviewedAt = :now, updatedAt = :now REMOVE lockedBy, lockedAt",
+                    "ConditionExpression": "lockedBy = :user AND reviewStatus = :pending",
+                    "ExpressionAttributeValues": {
+                        ":decision": decision, ":user": user_id, ":now": now, ":pending": "pending",
+                    },
+                }},
+                {"Update": {
+                    "TableName": self.tables["box"],
+                    "Key": {"id": page["boxId"]},
+                    "UpdateExpression": f"ADD pagesReviewed :one, pages{decision.capitalize()} :one "
+                                        "SET updatedAt = :now",
+                    "ExpressionAttributeValues": {":one": 1, ":now": now},
+                }},
+                {"Put": {
+                    "TableName": self.tables["review"],
+                    "Item": {
+                        "id": str(uuid.uuid4()),
+                        "userId": user_id,
+                        "tenantId": self.tenant_id,
+                        "groups": get_tenant_groups(self.tenant_id),
+                        "pageId": page["pageId"],
+                        "boxNumber": box_number,
+                        "setId": page["setId"],
+                        "pageNumber": page["pageNumber"],
+                        "decision": decision,
+                        "createdAt": now,
+                        "updatedAt": now,
+                    },
+                }},
+            ])
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            reasons = e.response.get("CancellationReasons") or [{}]
+            if reasons[0].get("Code") == "ConditionalCheckFailed":
+                raise ReviewError(403, "Page is not locked by this user") from e
+            raise
+
+        box = self.box_table.get_item(Key={"id": page["boxId"]}, ConsistentRead=True).get("Item", {})
+        refresh_box_status(self.box_table, page["boxId"], box)
+        return {
+            "success": True,
+            "box_number": box.get("boxNumber", box_number),
+            "pages_remaining_in_box": int(box.get("totalPages", 0)) - int(box.get("pagesReviewed", 0)),
+        }
+
+    def unlock_page(self, page_id: str, user_id: str) -> dict:
+        """POST /pages/{id}/unlock: give a page back without a decision."""
+        try:
+            self.client.update_item(
+                TableName=self.tables["page"],
+                Key={"id": page_id},
+                UpdateExpression="REMOVE lockedBy, lockedAt",
+                ConditionExpression="lockedBy = :user",
+                ExpressionAttributeValues={":user": user_id},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            raise ReviewError(403, "Page is not locked by this user") from e
+        return {"success": True}
+
+
+# Lambda state kept between invocations of a warm container
+_lambda_context: dict = {}
+
+
+def tenant_from_groups(groups: list) -> str | None:
+    """The tenant a reviewer belongs to, from Cognito groups named tenant_{id}_reviewer."""
+    for group in groups:
+        match = re.fullmatch(r"tenant_(.+)_reviewer", group)
+        if match:
+            return match.group(1)
+    return None
+
+
+def handler(event: dict, context) -> dict:
+    """
+    API Gateway (REST, Cognito authorizer) entry point for:
+
+        GET  /queue/next
+        POST /pages/{page_id}/review   {"decision": "shred" | "unsure" | "retain"}
+        POST /pages/{page_id}/unlock
+
+    Table names come from the PAGE_TABLE, BOX_TABLE and USER_REVIEW_TABLE
+    environment variables, and images are presigned from S3_BUCKET.
+    """
+    import boto3
+
+    claims = event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
+    user_id = claims.get("sub")
+    groups = claims.get("cognito:groups", "")
+    groups = groups if isinstance(groups, list) else [g for g in re.split(r"[,\s\[\]]+", groups) if g]
+    tenant_id = tenant_from_groups(groups)
+    if not user_id or not tenant_id:
+        return _api_response(403, {"error": "Not a reviewer"})
+
+    if not _lambda_context:
+        session = boto3.Session()
+        _lambda_context["dynamodb"] = session.resource("dynamodb")
+        _lambda_context["s3"] = session.client("s3")
+        _lambda_context["queues"] = {}
+    queues = _lambda_context["queues"]
+    if tenant_id not in queues:
+        queues[tenant_id] = ReviewQueue(_lambda_context["dynamodb"], {
+            "page": os.environ["PAGE_TABLE"],
+            "box": os.environ["BOX_TABLE"],
+            "review": os.environ["USER_REVIEW_TABLE"],
+        }, tenant_id)
+    queue = queues[tenant_id]
+
+    method = event.get("httpMethod", "GET")
+    path = event.get("path", "")
+    try:
+        if method == "GET" and path.endswith("/queue/next"):
+            result = queue.get_next_page(user_id, _lambda_context["s3"], os.environ.get("S3_BUCKET"))
+            return _api_response(204, None) if result is None else _api_response(200, result)
+        match = re.search(r"/pages/([^/]+)/(review|unlock)$", path)
+        if method == "POST" and match:
+            page_id, action = match.groups()
+            if action == "unlock":
+                return _api_response(200, queue.unlock_page(page_id, user_id))
+            try:
+                decision = json.loads(event.get("body") or "{}").get("decision")
+            except ValueError:
+                decision = None
+            return _api_response(200, queue.submit_review(page_id, user_id, decision))
+        return _api_response(404, {"error": f"No route for {method} {path}"})
+    except ReviewError as e:
+        return _api_response(e.status, {"error": str(e)})
+
+
+def _api_response(status: int, body: dict | None) -> dict:
+    return {
+        "statusCode": status,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(body, default=str) if body is not None else "",
+    }
+
+
+def main():
+    # The command line shares upload_pages.py's configuration and table
+    # discovery; the Lambda handler needs neither
+    import upload_pages
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ("next", "review", "unlock"):
+        print("Usage: python review_queue.py next --user USER_SUB [--tenant TENANT] [--env ENV_ID]")
+        print("       python review_queue.py review PAGE_RECORD_ID DECISION --user USER_SUB [...]")
+        print("       python review_queue.py unlock PAGE_RECORD_ID --user USER_SUB [...]")
+        sys.exit(1)
+
+    command, args = args[0], args[1:]
+    user_id = None
+    env_id = None
+    tenant_id = os.environ.get("TENANT_ID", upload_pages.TENANT_ID)
+    positional = []
+
+    i = 0
+    while i < len(args):
+        if args[i] in ("--user", "--env", "--tenant"):
+            if i + 1 >= len(args):
+                print(f"Error: {args[i]} requires an argument")
+                sys.exit(1)
+            if args[i] == "--user":
+                user_id = args[i + 1]
+            elif args[i] == "--env":
+                env_id = args[i + 1]
+            else:
+                tenant_id = args[i + 1]
+            i += 2
+        else:
+            positional.append(args[i])
+            i += 1
+
+    needed = {"next": 0, "review": 2, "unlock": 1}[command]
+    if not user_id or len(positional) != needed:
+        print(f"Error: {command} needs --user and {needed} argument(s); run without arguments for usage")
+        sys.exit(1)
+
+    import boto3
+    upload_pages.AWS_REGION = os.environ.get("AWS_REGION", upload_pages.AWS_REGION)
+    session = boto3.Session(region_name=upload_pages.AWS_REGION)
+    dynamodb = session.resource("dynamodb")
+
+    cached = upload_pages.load_cached_environment(upload_pages.discovery_cache_key(env_id))
+    tables = cached["tables"] if cached else {}
+    if "review" not in tables:
+        tables = upload_pages.find_dynamodb_tables(dynamodb.meta.client, env_id)
+    if isinstance(tables, list):
+        print("Error: Multiple Box2Cloud environments found; use --env with one of:")
+        for env in tables:
+            print(f"  {env['env_id']}")
+        sys.exit(1)
+    if not all(name in tables for name in ("box", "page", "review")):
+        print(f"Error: Could not find the Box, Page and UserReview tables. Found: {tables}")
+        sys.exit(1)
+
+    queue = ReviewQueue(dynamodb, tables, tenant_id)
+    try:
+        if command == "next":
+            result = queue.get_next_page(user_id)
+            if result is None:
+                print("Queue is empty: every page has been reviewed")
+                return
+        elif command == "review":
+            result = queue.submit_review(positional[0], user_id, positional[1])
+        else:
+            result = queue.unlock_page(positional[0], user_id)
+    except ReviewError as e:
+        print(f"Error ({e.status}): {e}")
+        sys.exit(1)
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,27 @@ Usage:
     # Specify environment when multiple exist
     python upload_pages.py /path/to/scanned/pdfs --env 3qslisom2rf57gtlhmdx3gwuqa
 
+    # Render and upload on 4 worker processes
+    python upload_pages.py /path/to/scanned/pdfs --workers 4
+
+    # Check S3/DynamoDB for PDFs uploaded before the local manifest existed
+    python upload_pages.py /path/to/scanned/pdfs --reconcile
+
+    # Render in-process with PyMuPDF instead of poppler's pdftoppm
+    python upload_pages.py /path/to/scanned/pdfs --renderer pymupdf
+
+    # Share a backfill between machines (run the same command on each)
+    python upload_pages.py /mnt/scans --distributed --workers 4
+
+    # Keep running and ingest each scan minutes after the scanner writes it
+    python upload_pages.py /path/to/scanned/pdfs --watch
+
+    # Store text pages as 1-bit PNG, grayscale as WebP, color as JPEG
+    python upload_pages.py /path/to/scanned/pdfs --format auto
+
 Requirements:
-    pip install boto3 pdf2image pillow
+    pip install boto3 pdf2image pillow numpy
+    pip install pymupdf  # optional, for --renderer pymupdf
 
     Also requires poppler-utils:
     - macOS: brew install poppler
@@ -26,13 +45,35 @@ Requirements:
 import os
 import sys
 import re
+import base64
+import ctypes
+import ctypes.util
+import hashlib
 import json
+import math
+import queue
+import select
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+)
 from pathlib import Path
 from datetime import datetime, timezone
+from decimal import Decimal
 from io import BytesIO
 
-import boto3
-from pdf2image import convert_from_path
+# boto3, PIL, numpy, pdf2image and PyMuPDF take most of a second to import
+# between them and are imported where first used, so a run only pays for
+# what it touches; botocore.exceptions on its own is cheap
+from botocore.exceptions import ClientError
+
+from box_records import (
+    adjust_box_counters, box_status, get_tenant_groups, refresh_box_status,
+    review_counter_deltas,
+)
 
 # Configuration - update these after deploying Amplify
 # TENANT_ID should be the groupId from the Tenant record (e.g., "wth" for Waikiki Townhouse)
@@ -44,6 +85,55 @@ AWS_REGION = "us-east-1"
 S3_BUCKET = None
 DYNAMODB_TABLE_PREFIX = "Box2Cloud"
 
+# Number of pages rendered per pdftoppm call. Larger windows amortize process
+# startup; smaller windows keep fewer full-size page images in memory at once.
+RENDER_WINDOW = 4
+
+# Page renderer, see RENDERERS: "pdf2image" runs poppler's pdftoppm in a
+# subprocess; "pymupdf" renders in-process straight into a pixel buffer
+RENDERER = "pdf2image"
+
+# With --workers, PDFs longer than this are split into page ranges of this size
+# so a single large scan can use several worker processes
+PAGES_PER_TASK = 50
+
+# Page pipeline sizing: encode threads are CPU-bound (PIL releases the GIL
+# while compressing), upload threads wait on the network, and each queue
+# between stages holds at most PIPELINE_QUEUE_SIZE pages
+ENCODE_THREADS = 2
+UPLOAD_THREADS = 8
+PIPELINE_QUEUE_SIZE = 4
+
+# Page images are far below S3_MULTIPART_THRESHOLD and go up with a single
+# PutObject; anything larger uses the managed transfer in parts of that size.
+# With VERIFY_MD5 (--verify-md5) each PutObject carries a Content-MD5 that
+# S3 checks before storing the object.
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_CONCURRENCY = 4
+VERIFY_MD5 = False
+
+# Page image output: see PAGE_FORMATS. Every ENCODE_SAMPLE_EVERY-th page is
+# also encoded as PNG to report the saving against the original output
+PAGE_FORMAT = "png"
+JPEG_QUALITY = 80
+ENCODE_SAMPLE_EVERY = 10
+
+# Blank and near-duplicate page detection. BLANK_PAGES is "mark" (flag
+# the record only), "shred" (also record it as reviewed: shred) or "skip"
+# (neither upload nor record it)
+BLANK_PAGES = "mark"
+BLANK_PAGE_MODES = ("mark", "shred", "skip")
+
+# --watch: a new PDF is ingested once its size and mtime have not changed
+# for WATCH_SETTLE_SECONDS; without inotify the folder is polled every
+# WATCH_POLL_SECONDS
+WATCH_SETTLE_SECONDS = 10
+WATCH_POLL_SECONDS = 5
+
+# Metrics output (--metrics): JSON lines, or a Prometheus text file when the
+# path ends in .prom. Rewritten every METRICS_INTERVAL seconds during a run
+METRICS_INTERVAL = 60
+
 
 def load_amplify_config():
     """Load S3 bucket name from amplify_outputs.json if available."""
@@ -89,43 +179,797 @@ def parse_pdf_filename(filename: str) -> dict | None:
     }
 
 
-def get_existing_s3_keys(s3_client, bucket: str, tenant_id: str) -> set:
-    """Get all existing S3 keys under the tenant prefix."""
-    existing_keys = set()
-    paginator = s3_client.get_paginator("list_objects_v2")
-    prefix = f"{tenant_id}/"
+# Upper bounds (seconds) of the latency histogram buckets, plus +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
 
-    print(f"Fetching existing S3 objects from {bucket}/{prefix}...")
 
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            existing_keys.add(obj["Key"])
+class OperationMetrics:
+    """
+    Latency histograms and byte/item counts per operation, mergeable.
+
+    Operations are render, analyze, encode, thumbnail, s3_put, s3_head,
+    s3_list, dynamodb_write and dynamodb_query. `items` counts what an operation
+    handled (e.g. records in one BatchWriteItem, keys in one listing page).
+    """
 
-    print(f"Found {len(existing_keys)} existing objects in S3")
-    return existing_keys
+    def __init__(self):
+        self._ops: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"count": 0, "seconds": 0.0, "bytes": 0, "items": 0,
+                "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+
+    def observe(self, op: str, seconds: float, size: int = 0, items: int = 1) -> None:
+        slot = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                    len(LATENCY_BUCKETS))
+        with self._lock:
+            entry = self._ops.setdefault(op, self._empty())
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["bytes"] += size
+            entry["items"] += items
+            entry["buckets"][slot] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {op: dict(entry, buckets=list(entry["buckets"]))
+                    for op, entry in self._ops.items()}
+
+    def drain(self) -> dict:
+        """Return a snapshot and reset, so a worker reports each task once."""
+        with self._lock:
+            ops, self._ops = self._ops, {}
+            return ops
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            for op, other in snapshot.items():
+                entry = self._ops.setdefault(op, self._empty())
+                for field in ("count", "seconds", "bytes", "items"):
+                    entry[field] += other[field]
+                entry["buckets"] = [a + b for a, b in zip(entry["buckets"], other["buckets"])]
+
+
+METRICS = OperationMetrics()
+
+
+def metrics_record(stats: dict, elapsed: float, final: bool) -> dict:
+    """One JSON-lines metrics record for the run so far."""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "tenant": TENANT_ID,
+        "elapsed_seconds": round(elapsed, 3),
+        "final": final,
+        "sets": dict(stats),
+        "operations": METRICS.snapshot(),
+        "latency_buckets": list(LATENCY_BUCKETS),
+    }
 
 
-def get_existing_sets(dynamodb, table_name: str) -> set:
-    """Get all existing set IDs from DynamoDB."""
-    existing_sets = set()
-    table = dynamodb.Table(table_name)
+def prometheus_text(record: dict) -> str:
+    """Render a metrics record in the Prometheus text exposition format."""
+    tenant = record["tenant"]
+    lines = [
+        "# HELP box2cloud_ingest_operation_seconds Latency of ingest operations.",
+        "# TYPE box2cloud_ingest_operation_seconds histogram",
+    ]
+    for op, entry in sorted(record["operations"].items()):
+        labels = f'tenant="{tenant}",op="{op}"'
+        cumulative = 0
+        for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], entry["buckets"]):
+            cumulative += count
+            lines.append(f'box2cloud_ingest_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"box2cloud_ingest_operation_seconds_sum{{{labels}}} {entry['seconds']:.6f}")
+        lines.append(f"box2cloud_ingest_operation_seconds_count{{{labels}}} {entry['count']}")
+
+    for field, help_text in (("bytes", "Bytes handled by ingest operations."),
+                             ("items", "Items handled by ingest operations.")):
+        lines.append(f"# HELP box2cloud_ingest_operation_{field}_total {help_text}")
+        lines.append(f"# TYPE box2cloud_ingest_operation_{field}_total counter")
+        for op, entry in sorted(record["operations"].items()):
+            lines.append(f'box2cloud_ingest_operation_{field}_total{{tenant="{tenant}",op="{op}"}} '
+                         f"{entry[field]}")
+
+    lines.append("# HELP box2cloud_ingest_sets Sets processed, skipped and failed, and pages ingested.")
+    lines.append("# TYPE box2cloud_ingest_sets gauge")
+    for outcome, value in sorted(record["sets"].items()):
+        lines.append(f'box2cloud_ingest_sets{{tenant="{tenant}",outcome="{outcome}"}} {value}')
+    lines.append("# TYPE box2cloud_ingest_elapsed_seconds gauge")
+    lines.append(f'box2cloud_ingest_elapsed_seconds{{tenant="{tenant}"}} {record["elapsed_seconds"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Path, stats: dict, elapsed: float, final: bool = False) -> None:
+    """Append a JSON line to `path`, or atomically replace it for a .prom file."""
+    record = metrics_record(stats, elapsed, final)
+    if path.suffix == ".prom":
+        # The node_exporter textfile collector must never see a partial file
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_text(prometheus_text(record))
+        os.replace(temp_path, path)
+    else:
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class MetricsReporter:
+    """Background thread writing metrics every METRICS_INTERVAL seconds."""
+
+    def __init__(self, path: Path, stats: dict):
+        self.path = path
+        self.stats = stats
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(METRICS_INTERVAL):
+            try:
+                write_metrics(self.path, self.stats, time.perf_counter() - self.started)
+            except OSError as e:
+                print(f"Warning: could not write metrics to {self.path}: {e}")
+
+    def close(self) -> None:
+        """Stop the thread and write the final record."""
+        self._stop.set()
+        self._thread.join()
+        write_metrics(self.path, self.stats, time.perf_counter() - self.started, final=True)
+
+
+class BloomFilter:
+    """
+    Fixed-size probabilistic set of strings.
+
+    Membership tests never miss a key that was added, but report a key that
+    was not added with probability of about `error_rate`. At 1% that costs
+    under 10 bits per key, against ~100 bytes per key for a set of str.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
 
-    print(f"Fetching existing sets from {table_name}...")
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
 
-    response = table.scan(ProjectionExpression="setId")
-    existing_sets.update(item["setId"] for item in response.get("Items", []))
 
-    while "LastEvaluatedKey" in response:
-        response = table.scan(
+# Concurrent S3 listings when checking which page images already exist
+S3_LIST_THREADS = 8
+
+# Expected pages per PDF, used to size the Bloom filter for --bloom-filter
+BLOOM_PAGES_PER_PDF = 300
+
+
+class S3KeyIndex:
+    """
+    Existence checks for page images, scoped to the sets being processed.
+
+    Instead of listing the whole tenant up front, each {tenant}/{box}/{set}/
+    prefix is listed on its own, in the background, from a small thread
+    pool. A lookup only waits for its own prefix. Keys are kept per prefix
+    and can be released once a set is finished.
+
+    With `bloom_capacity`, listed keys go into a BloomFilter instead. A
+    positive answer is then confirmed with a HEAD request, so a false
+    positive costs one request and never skips an upload.
+    """
+
+    def __init__(self, s3_client, bucket: str, bloom_capacity: int | None = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity else None
+        self._pool = ThreadPoolExecutor(max_workers=S3_LIST_THREADS)
+        self._prefixes: dict[str, Future] = {}
+        self._keys: dict[str, set] = {}
+        self._deleted: set = set()
+        self._lock = threading.Lock()
+
+    def prefetch(self, prefixes) -> None:
+        """Start listing prefixes in the background, in the order given."""
+        for prefix in prefixes:
+            self._load(prefix)
+
+    def _load(self, prefix: str) -> Future:
+        with self._lock:
+            if prefix not in self._prefixes:
+                self._prefixes[prefix] = self._pool.submit(self._list_prefix, prefix)
+            return self._prefixes[prefix]
+
+    def _list_prefix(self, prefix: str) -> int:
+        keys = set()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        started = time.perf_counter()
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            contents = page.get("Contents", [])
+            keys.update(obj["Key"] for obj in contents)
+            METRICS.observe("s3_list", time.perf_counter() - started, items=len(contents))
+            started = time.perf_counter()
+        with self._lock:
+            if self.bloom is not None:
+                for key in keys:
+                    self.bloom.add(key)
+            else:
+                self._keys[prefix] = keys
+        return len(keys)
+
+    def __contains__(self, key: str) -> bool:
+        # {tenant}/{box}/{set}/, which also covers the set's thumbs/ folder
+        prefix = "/".join(key.split("/")[:3]) + "/"
+        self._load(prefix).result()
+        with self._lock:
+            if key in self._deleted:
+                return False
+            if self.bloom is None:
+                return key in self._keys.get(prefix, ())
+            if key not in self.bloom:
+                return False
+        return self._head(key)
+
+    def _head(self, key: str) -> bool:
+        started = time.perf_counter()
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        finally:
+            METRICS.observe("s3_head", time.perf_counter() - started)
+
+    def keys_under(self, prefix: str) -> set:
+        """Exact set of existing keys under a set prefix, e.g. to hand to a worker."""
+        self._load(prefix).result()
+        with self._lock:
+            if self.bloom is None:
+                return set(self._keys.get(prefix, ())) - self._deleted
+        # The filter can't enumerate its keys, so list this one prefix again
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return {
+            obj["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        } - self._deleted
+
+    def difference_update(self, keys) -> None:
+        """Forget keys that have been deleted from S3."""
+        with self._lock:
+            self._deleted.update(keys)
+
+    def release(self, prefix: str) -> None:
+        """Drop the keys held for a finished set."""
+        with self._lock:
+            self._keys.pop(prefix, None)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def set_prefix(pdf_info: dict) -> str:
+    """S3 prefix holding a set's page images: {tenant}/{box}/{set}/"""
+    return f"{TENANT_ID}/{pdf_info['boxNumber']}/{pdf_info['setId']}/"
+
+
+# Up to this many PDFs, set existence is checked with one point lookup each
+# instead of reading every set of the tenant
+SET_POINT_LOOKUP_LIMIT = 50
+SET_LOOKUP_THREADS = 8
+
+
+def get_tenant_sets(dynamodb, table_name: str, tenant_id: str) -> set:
+    """Get the set IDs of one tenant through the Set table's byTenant index."""
+    from boto3.dynamodb.conditions import Key
+    print(f"Fetching existing sets for tenant {tenant_id} from {table_name}...")
+    existing_sets = {
+        item["setId"] for item in query_all(
+            dynamodb.Table(table_name),
+            IndexName="byTenant",
+            KeyConditionExpression=Key("tenantId").eq(tenant_id),
             ProjectionExpression="setId",
-            ExclusiveStartKey=response["LastEvaluatedKey"]
         )
-        existing_sets.update(item["setId"] for item in response.get("Items", []))
-
+    }
     print(f"Found {len(existing_sets)} existing sets in DynamoDB")
     return existing_sets
 
 
+def lookup_sets(dynamodb, tables: dict, pdf_infos: list) -> set:
+    """
+    Point-check which of the given sets already exist.
+
+    Each set is looked up by (boxId, setId) on the Set table's byBox index,
+    from SET_LOOKUP_THREADS threads. A set whose box doesn't exist yet
+    can't exist either, so it costs no request at all.
+    """
+    client = dynamodb.meta.client
+    box_ids = {info["boxNumber"]: find_box_id(dynamodb, tables["box"], info["boxNumber"])
+               for info in pdf_infos}
+
+    def exists(info: dict) -> bool:
+        box_id = box_ids[info["boxNumber"]]
+        if not box_id:
+            return False
+        started = time.perf_counter()
+        response = client.query(
+            TableName=tables["set"],
+            IndexName="byBox",
+            KeyConditionExpression="boxId = :bid AND setId = :sid",
+            ExpressionAttributeValues={":bid": box_id, ":sid": info["setId"]},
+            ProjectionExpression="id",
+            Limit=1,
+        )
+        METRICS.observe("dynamodb_query", time.perf_counter() - started,
+                        items=len(response.get("Items", [])))
+        return bool(response.get("Items"))
+
+    with ThreadPoolExecutor(max_workers=SET_LOOKUP_THREADS) as pool:
+        found = list(pool.map(exists, pdf_infos))
+    return {info["setId"] for info, hit in zip(pdf_infos, found) if hit}
+
+
+def find_existing_sets(dynamodb, tables: dict, pdf_infos: list) -> set:
+    """Which of the given sets exist: point lookups for a few, one tenant query for many."""
+    if len(pdf_infos) <= SET_POINT_LOOKUP_LIMIT:
+        return lookup_sets(dynamodb, tables, pdf_infos)
+    return get_tenant_sets(dynamodb, tables["set"], TENANT_ID)
+
+
+# Name of the ingest manifest created next to the scanned PDFs
+MANIFEST_FILENAME = ".box2cloud_manifest.sqlite"
+
+
+class IngestManifest:
+    """
+    Local SQLite record of what has been ingested from a scan folder.
+
+    Each PDF is tracked by setId with its content hash, and each page with
+    whether its image has been uploaded and its record written. Reruns
+    skip finished PDFs and resume interrupted ones at the first unfinished
+    page without listing S3 or scanning DynamoDB. The database uses WAL
+    mode so pipeline threads and --workers processes can update it
+    concurrently.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pdfs (
+            tenant_id TEXT NOT NULL,
+            set_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            page_count INTEGER,
+            box_id TEXT,
+            set_recorded INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (tenant_id, set_id)
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            tenant_id TEXT NOT NULL,
+            set_id TEXT NOT NULL,
+            page_number INTEGER NOT NULL,
+            s3_key TEXT,
+            thumbnail_key TEXT,
+            uploaded INTEGER NOT NULL DEFAULT 0,
+            recorded INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, set_id, page_number)
+        );
+    """
+
+    def __init__(self, path: Path, tenant_id: str):
+        self.path = Path(path)
+        self.tenant_id = tenant_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(pages)")}
+        if "thumbnail_key" not in columns:
+            # Manifests written before thumbnails existed
+            self._conn.execute("ALTER TABLE pages ADD COLUMN thumbnail_key TEXT")
+        if "skipped" not in columns:
+            # Manifests written before --blank-pages skip was noted on sets
+            self._conn.execute("ALTER TABLE pages ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_pdf(self, set_id: str) -> dict | None:
+        rows = self._execute(
+            "SELECT * FROM pdfs WHERE tenant_id = ? AND set_id = ?",
+            (self.tenant_id, set_id),
+        )
+        return dict(rows[0]) if rows else None
+
+    def start_pdf(self, set_id: str, path: Path, fingerprint: dict,
+                  page_count: int, box_id: str) -> None:
+        """Create or refresh a PDF's entry, keeping any existing page progress."""
+        self._execute(
+            """
+            INSERT INTO pdfs (tenant_id, set_id, path, size, mtime, sha256,
+                              page_count, box_id, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
+            ON CONFLICT (tenant_id, set_id) DO UPDATE SET
+                path = excluded.path, size = excluded.size, mtime = excluded.mtime,
+                sha256 = excluded.sha256, page_count = excluded.page_count,
+                box_id = excluded.box_id, updated_at = excluded.updated_at
+            """,
+            (self.tenant_id, set_id, str(path), fingerprint["size"], fingerprint["mtime"],
+             fingerprint["sha256"], page_count, box_id, _utc_now()),
+        )
+
+    def reset_pdf(self, set_id: str) -> None:
+        """Forget a PDF and its pages, e.g. before a --force re-ingest."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM pages WHERE tenant_id = ? AND set_id = ?",
+                (self.tenant_id, set_id),
+            )
+            self._conn.execute(
+                "DELETE FROM pdfs WHERE tenant_id = ? AND set_id = ?",
+                (self.tenant_id, set_id),
+            )
+            self._conn.execute("COMMIT")
+
+    def mark_set_recorded(self, set_id: str) -> None:
+        self._execute(
+            "UPDATE pdfs SET set_recorded = 1, updated_at = ? WHERE tenant_id = ? AND set_id = ?",
+            (_utc_now(), self.tenant_id, set_id),
+        )
+
+    def complete_pdf(self, set_id: str) -> None:
+        self._execute(
+            "UPDATE pdfs SET status = 'complete', updated_at = ? WHERE tenant_id = ? AND set_id = ?",
+            (_utc_now(), self.tenant_id, set_id),
+        )
+
+    def completed_sets(self) -> set:
+        """The set IDs of every PDF finished under this tenant."""
+        rows = self._execute(
+            "SELECT set_id FROM pdfs WHERE tenant_id = ? AND status = 'complete'",
+            (self.tenant_id,),
+        )
+        return {row["set_id"] for row in rows}
+
+    def page_states(self, set_id: str) -> dict:
+        """
+        Return {page_number: {"uploaded", "recorded", "s3_key", "thumbnail_key"}}
+        for a PDF's known pages.
+        """
+        rows = self._execute(
+            "SELECT page_number, uploaded, recorded, s3_key, thumbnail_key FROM pages "
+            "WHERE tenant_id = ? AND set_id = ?",
+            (self.tenant_id, set_id),
+        )
+        return {
+            row["page_number"]: {
+                "uploaded": bool(row["uploaded"]),
+                "recorded": bool(row["recorded"]),
+                "s3_key": row["s3_key"],
+                "thumbnail_key": row["thumbnail_key"],
+            }
+            for row in rows
+        }
+
+    def mark_uploaded(self, set_id: str, page_number: int, s3_key: str,
+                      thumbnail_key: str | None = None) -> None:
+        self._execute(
+            """
+            INSERT INTO pages (tenant_id, set_id, page_number, s3_key, thumbnail_key, uploaded)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT (tenant_id, set_id, page_number) DO UPDATE SET
+                s3_key = excluded.s3_key, thumbnail_key = excluded.thumbnail_key, uploaded = 1
+            """,
+            (self.tenant_id, set_id, page_number, s3_key, thumbnail_key),
+        )
+
+    def mark_skipped(self, set_id: str, page_number: int) -> None:
+        """Mark a page finished without an image or record (--blank-pages skip)."""
+        self._execute(
+            """
+            INSERT INTO pages (tenant_id, set_id, page_number, s3_key, uploaded, recorded, skipped)
+            VALUES (?, ?, ?, NULL, 1, 1, 1)
+            ON CONFLICT (tenant_id, set_id, page_number) DO UPDATE SET
+                s3_key = NULL, uploaded = 1, recorded = 1, skipped = 1
+            """,
+            (self.tenant_id, set_id, page_number),
+        )
+
+    def skipped_pages(self, set_id: str) -> list:
+        """Page numbers of a PDF left out by --blank-pages skip, in order."""
+        rows = self._execute(
+            "SELECT page_number FROM pages WHERE tenant_id = ? AND set_id = ? AND skipped = 1 "
+            "ORDER BY page_number",
+            (self.tenant_id, set_id),
+        )
+        return [row["page_number"] for row in rows]
+
+    def adopt_pages(self, set_id: str, pages: dict) -> None:
+        """
+        Mark pages another ingester recorded as finished here too.
+
+        `pages` is {page_number: {"s3_key", "thumbnail_key"}}, as returned
+        by fetch_remote_progress.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                """
+                INSERT INTO pages (tenant_id, set_id, page_number, s3_key, thumbnail_key,
+                                   uploaded, recorded)
+                VALUES (?, ?, ?, ?, ?, 1, 1)
+                ON CONFLICT (tenant_id, set_id, page_number) DO UPDATE SET
+                    s3_key = excluded.s3_key, thumbnail_key = excluded.thumbnail_key,
+                    uploaded = 1, recorded = 1
+                """,
+                [(self.tenant_id, set_id, number, page["s3_key"], page["thumbnail_key"])
+                 for number, page in pages.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    def mark_recorded(self, set_id: str, page_numbers: list) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                """
+                INSERT INTO pages (tenant_id, set_id, page_number, uploaded, recorded)
+                VALUES (?, ?, ?, 1, 1)
+                ON CONFLICT (tenant_id, set_id, page_number) DO UPDATE SET recorded = 1
+                """,
+                [(self.tenant_id, set_id, page_number) for page_number in page_numbers],
+            )
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def fingerprint_pdf(pdf_path: Path, known: dict | None = None) -> dict:
+    """
+    Size, mtime and SHA-256 of a PDF.
+
+    If the manifest already has an entry with the same size and mtime its
+    hash is reused instead of reading the file again.
+    """
+    stat = pdf_path.stat()
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": known["sha256"]}
+
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+
+
+# --distributed: how long a PDF lease lasts without a heartbeat before
+# another ingester may take it over. Heartbeats renew held leases every
+# LEASE_SECONDS / 3, so only a stopped or partitioned node loses one.
+LEASE_SECONDS = 300
+
+
+class LeaseManager:
+    """
+    Claims PDFs for this ingester through lease items in the IngestLease table.
+
+    A lease is one item per tenant and setId, written with a conditional
+    put that only succeeds if there is no lease, the lease has expired, or
+    this ingester already holds it. Finished PDFs keep a "done" lease so
+    other nodes skip them. A background thread renews held leases; a lease
+    that could not be renewed is added to `lost`, and the page pipeline
+    working on that PDF stops (see is_lost) and leaves it to whoever took
+    it over.
+    """
+
+    def __init__(self, dynamodb, table_name: str, tenant_id: str,
+                 lease_seconds: int | None = None):
+        import socket
+        import uuid
+
+        self.table = dynamodb.Table(table_name)
+        self.tenant_id = tenant_id
+        self.lease_seconds = lease_seconds or LEASE_SECONDS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held: set = set()
+        self.lost: set = set()
+        # set_id -> time.monotonic() before the last successful acquire or renewal
+        self._renewed: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _key(self, set_id: str) -> dict:
+        return {"id": f"{self.tenant_id}#{set_id}"}
+
+    def acquire(self, set_id: str) -> bool:
+        """Claim a PDF; False if another ingester holds it or has finished it."""
+        started = time.monotonic()
+        now = int(time.time())
+        try:
+            self.table.put_item(
+                Item={
+                    **self._key(set_id),
+                    "tenantId": self.tenant_id,
+                    "setId": set_id,
+                    "leaseOwner": self.owner,
+                    "leaseStatus": "held",
+                    "expiresAt": now + self.lease_seconds,
+                    "heartbeatAt": now,
+                    "createdAt": _utc_now(),
+                    "updatedAt": _utc_now(),
+                },
+                ConditionExpression=(
+                    "attribute_not_exists(id) OR leaseOwner = :me OR "
+                    "(leaseStatus = :held AND expiresAt < :now)"
+                ),
+                ExpressionAttributeValues={":me": self.owner, ":held": "held", ":now": now},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        with self._lock:
+            self.held.add(set_id)
+            self.lost.discard(set_id)
+            self._renewed[set_id] = started
+        return True
+
+    def _finish(self, set_id: str, status: str | None) -> None:
+        with self._lock:
+            self.held.discard(set_id)
+            self._renewed.pop(set_id, None)
+        try:
+            if status is None:
+                self.table.delete_item(
+                    Key=self._key(set_id),
+                    ConditionExpression="leaseOwner = :me",
+                    ExpressionAttributeValues={":me": self.owner},
+                )
+            else:
+                self.table.update_item(
+                    Key=self._key(set_id),
+                    UpdateExpression="SET leaseStatus = :status, updatedAt = :at",
+                    ConditionExpression="leaseOwner = :me",
+                    ExpressionAttributeValues={":status": status, ":me": self.owner,
+                                               ":at": _utc_now()},
+                )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            print(f"  Warning: lease for {set_id} was taken over by another ingester")
+
+    def is_lost(self, set_id: str) -> bool:
+        """
+        True once another ingester has taken this PDF's lease over, or may
+        have: a lease not renewed for lease_seconds (e.g. after this process
+        was stopped) has expired, whether or not the heartbeat has seen it yet.
+        """
+        with self._lock:
+            if set_id in self.lost:
+                return True
+            renewed = self._renewed.get(set_id)
+        return renewed is not None and time.monotonic() - renewed > self.lease_seconds
+
+    def is_done(self, set_id: str) -> bool:
+        """True if some ingester has finished this PDF."""
+        item = self.table.get_item(
+            Key=self._key(set_id), ConsistentRead=True, ProjectionExpression="leaseStatus",
+        ).get("Item")
+        return bool(item) and item.get("leaseStatus") == "done"
+
+    def complete(self, set_id: str) -> None:
+        """Mark a PDF done so no other ingester picks it up again."""
+        self._finish(set_id, "done")
+
+    def release(self, set_id: str) -> None:
+        """Give a PDF back, e.g. after an error, so any ingester can retry it."""
+        self._finish(set_id, None)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self.held)
+            for set_id in held:
+                started = time.monotonic()
+                now = int(time.time())
+                try:
+                    self.table.update_item(
+                        Key=self._key(set_id),
+                        UpdateExpression="SET expiresAt = :expires, heartbeatAt = :now",
+                        ConditionExpression="leaseOwner = :me AND leaseStatus = :held",
+                        ExpressionAttributeValues={":expires": now + self.lease_seconds,
+                                                   ":now": now, ":me": self.owner,
+                                                   ":held": "held"},
+                    )
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        print(f"  Warning: lease heartbeat for {set_id} failed: {e}")
+                        continue
+                    print(f"  Warning: lost the lease for {set_id}")
+                    with self._lock:
+                        self.held.discard(set_id)
+                        self.lost.add(set_id)
+                    continue
+                with self._lock:
+                    self._renewed[set_id] = started
+
+    def close(self) -> None:
+        """Stop heartbeats and give back any lease still held."""
+        self._stop.set()
+        self._thread.join()
+        for set_id in list(self.held):
+            self.release(set_id)
+
+
+# How often a worker process re-reads the lease of a PDF it is working on
+LEASE_CHECK_SECONDS = 10
+
+# How often --distributed looks for a PDF to claim while it waits on PDFs
+# other ingesters hold
+CLAIM_POLL_SECONDS = 1
+
+
+class LeaseCheck:
+    """
+    LeaseManager.is_lost for --workers processes.
+
+    The heartbeat runs in the main process, so workers read the lease item
+    themselves, at most every LEASE_CHECK_SECONDS per PDF. A lease is lost
+    once it is gone or another ingester owns it.
+    """
+
+    def __init__(self, dynamodb, table_name: str, tenant_id: str, owner: str):
+        self.table = dynamodb.Table(table_name)
+        self.tenant_id = tenant_id
+        self.owner = owner
+        # set_id -> (time.monotonic() of the last read, lost)
+        self._checked: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, set_id: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(set_id)
+        if checked and (checked[1] or now - checked[0] < LEASE_CHECK_SECONDS):
+            return checked[1]
+        item = self.table.get_item(
+            Key={"id": f"{self.tenant_id}#{set_id}"}, ConsistentRead=True,
+            ProjectionExpression="leaseOwner",
+        ).get("Item")
+        lost = not item or item.get("leaseOwner") != self.owner
+        with self._lock:
+            self._checked[set_id] = (now, lost)
+        return lost
+
+
 def find_dynamodb_tables(dynamodb_client, env_id: str | None = None) -> dict | list:
     """
     Find the Box2Cloud DynamoDB tables.
@@ -160,6 +1004,12 @@ def find_dynamodb_tables(dynamodb_client, env_id: str | None = None) -> dict | l
                     environments[env]["tables"]["set"] = table_name
                 elif "Box2CloudPage" in table_name:
                     environments[env]["tables"]["page"] = table_name
+                elif "Box2CloudIngestLease" in table_name:
+                    environments[env]["tables"]["lease"] = table_name
+                elif "Box2CloudUserReview" in table_name:
+                    environments[env]["tables"]["review"] = table_name
+                elif "Box2CloudTenantProgress" in table_name:
+                    environments[env]["tables"]["progress"] = table_name
 
     # If env_id specified, return just those tables
     if env_id:
@@ -201,104 +1051,1052 @@ def find_s3_buckets(s3_client, env_id: str | None = None) -> str | list:
     return buckets
 
 
-def convert_pdf_to_images(pdf_path: Path, dpi: int = 150) -> list:
-    """Convert PDF pages to PIL images."""
-    return convert_from_path(str(pdf_path), dpi=dpi)
+# Resolved tables and bucket are cached on disk per AWS profile, endpoint,
+# region and --env, so a run doesn't list every table and bucket in the
+# account. A cached entry is used once describe_table/head_bucket confirm
+# it still exists, and looked up again after DISCOVERY_CACHE_SECONDS.
+DISCOVERY_CACHE_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "box2cloud" / "environments.json"
+)
+DISCOVERY_CACHE_SECONDS = 7 * 24 * 3600
+
+
+def discovery_cache_key(env_id: str | None) -> str:
+    return "|".join([
+        os.environ.get("AWS_PROFILE", "default"),
+        os.environ.get("AWS_ENDPOINT_URL", ""),
+        AWS_REGION,
+        env_id or "*",
+    ])
+
+
+def _read_discovery_cache() -> dict:
+    try:
+        return json.loads(DISCOVERY_CACHE_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def load_cached_environment(cache_key: str) -> dict | None:
+    """Return the cached {"tables", "bucket"} for cache_key, or None if missing or stale."""
+    entry = _read_discovery_cache().get(cache_key)
+    if not entry or time.time() - entry.get("resolvedAt", 0) > DISCOVERY_CACHE_SECONDS:
+        return None
+    return entry
+
+
+def save_cached_environment(cache_key: str, tables: dict, bucket: str | None = None) -> None:
+    """Remember resolved tables and bucket. The cache is only a shortcut, so write errors are ignored."""
+    cache = _read_discovery_cache()
+    cache[cache_key] = {"tables": tables, "bucket": bucket, "resolvedAt": int(time.time())}
+    try:
+        DISCOVERY_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = DISCOVERY_CACHE_PATH.with_name(f"{DISCOVERY_CACHE_PATH.name}.{os.getpid()}")
+        temp_path.write_text(json.dumps(cache, indent=2))
+        os.replace(temp_path, DISCOVERY_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def cached_environment_exists(dynamodb_client, s3_client, entry: dict) -> bool:
+    """Check, with one concurrent request per resource, that a cached environment still exists."""
+    checks = [
+        lambda name=name: dynamodb_client.describe_table(TableName=name)
+        for name in entry["tables"].values()
+    ]
+    if entry.get("bucket"):
+        checks.append(lambda: s3_client.head_bucket(Bucket=entry["bucket"]))
+    try:
+        with ThreadPoolExecutor(max_workers=len(checks)) as pool:
+            list(pool.map(lambda check: check(), checks))
+    except ClientError:
+        return False
+    return True
+
+
+def get_pdf_page_count(pdf_path: Path) -> int:
+    """Read the page count from the PDF metadata without rendering any pages."""
+    return RENDERERS[RENDERER][0](pdf_path)
+
+
+def iter_pdf_images(pdf_path: Path, dpi: int = 150, first_page: int = 1,
+                    last_page: int | None = None, window: int | None = None):
+    """
+    Yield (page_number, PIL image) for each page of a PDF, in order.
+
+    Rendering is done by the configured RENDERER. Callers should close
+    each image once it has been uploaded.
+    """
+    if last_page is None:
+        last_page = get_pdf_page_count(pdf_path)
+    return RENDERERS[RENDERER][1](pdf_path, dpi, first_page, last_page, window)
+
+
+def _pdf2image_page_count(pdf_path: Path) -> int:
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(str(pdf_path))["Pages"])
+
+
+def _pdf2image_pages(pdf_path: Path, dpi: int, first_page: int, last_page: int,
+                     window: int | None):
+    """
+    Render with pdftoppm, a small window of pages per call.
+
+    At most `window` page images are alive at once no matter how long the
+    PDF is.
+    """
+    from pdf2image import convert_from_path
+    window = max(1, window or RENDER_WINDOW)
+    for start in range(first_page, last_page + 1, window):
+        end = min(start + window - 1, last_page)
+        images = convert_from_path(
+            str(pdf_path), dpi=dpi, first_page=start, last_page=end
+        )
+        page_num = start
+        # Pop as we go so the list doesn't keep released pages alive
+        images.reverse()
+        while images:
+            yield page_num, images.pop()
+            page_num += 1
+
+
+def import_pymupdf():
+    """Import PyMuPDF, only needed for --renderer pymupdf; None if not installed."""
+    try:
+        import pymupdf
+        return pymupdf
+    except ImportError:
+        try:
+            import fitz  # PyMuPDF before 1.24.3
+            return fitz
+        except ImportError:
+            return None
+
+
+def pymupdf_installed() -> bool:
+    """Whether import_pymupdf() would succeed, without paying for the import."""
+    import importlib.util
+    return any(importlib.util.find_spec(name) for name in ("pymupdf", "fitz"))
+
+
+def _pymupdf_page_count(pdf_path: Path) -> int:
+    fitz = import_pymupdf()
+    with fitz.open(str(pdf_path)) as doc:
+        return doc.page_count
+
 
+def _pymupdf_pages(pdf_path: Path, dpi: int, first_page: int, last_page: int,
+                   window: int | None):
+    """
+    Render in-process with PyMuPDF, one page at a time.
 
-def upload_page_image(s3_client, bucket: str, image, s3_key: str) -> bool:
-    """Upload a PIL image to S3 as PNG."""
+    Each page is rasterized into a pixmap and wrapped as a PIL image
+    without temp files or a subprocess. `window` does not apply.
+    """
+    from PIL import Image
+    fitz = import_pymupdf()
+    with fitz.open(str(pdf_path)) as doc:
+        for page_num in range(first_page, last_page + 1):
+            pixmap = doc[page_num - 1].get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            del pixmap
+            yield page_num, image
+
+
+# --renderer name -> (page count function, page iterator)
+RENDERERS = {
+    "pdf2image": (_pdf2image_page_count, _pdf2image_pages),
+    "pymupdf": (_pymupdf_page_count, _pymupdf_pages),
+}
+
+
+# Thumbnails are rendered from the same page image, no larger than
+# THUMBNAIL_SIZE pixels on the long edge (0 disables them). Page keys are
+# rewritten by --force, so clients may cache them but not forever
+THUMBNAIL_SIZE = 200
+THUMBNAIL_QUALITY = 70
+THUMBNAIL_CACHE_CONTROL = "private, max-age=86400"
+
+
+def thumbnail_key(pdf_info: dict, page_num: int) -> str:
+    """S3 key of a page thumbnail: {tenant}/{box}/{set}/thumbs/page_xxxx.jpg"""
+    return f"{set_prefix(pdf_info)}thumbs/page_{page_num:04d}.jpg"
+
+
+def encode_thumbnail(image) -> BytesIO:
+    """Downscale a rendered page to a JPEG thumbnail."""
+    from PIL import Image
+    # reduce() box-filters by an integer factor cheaply; LANCZOS finishes
+    started = time.perf_counter()
+    factor = max(image.size) // (THUMBNAIL_SIZE * 2)
+    small = image.reduce(factor) if factor > 1 else image.copy()
+    small.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
     buffer = BytesIO()
-    image.save(buffer, format="PNG", optimize=True)
+    small.convert("RGB").save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    small.close()
     buffer.seek(0)
+    METRICS.observe("thumbnail", time.perf_counter() - started, buffer.getbuffer().nbytes)
+    return buffer
 
-    s3_client.upload_fileobj(
-        buffer,
-        bucket,
-        s3_key,
-        ExtraArgs={"ContentType": "image/png"}
-    )
-    return True
+
+# Page image formats for --format. "png" is the original output; "auto"
+# picks per page: 1-bit PNG for black-and-white text, lossless WebP for
+# grayscale, and JPEG for color
+PAGE_FORMATS = ("png", "auto", "png1", "webp", "jpeg")
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg"}
+
+# Auto-detection thresholds, measured on a subsampled copy of the page.
+# A page is grayscale if no pixel's channels differ by more than
+# GRAY_TOLERANCE, and bilevel if at most BILEVEL_MIDTONES of its pixels
+# fall between the paper and ink tones.
+GRAY_TOLERANCE = 12
+BILEVEL_MIDTONES = 0.02
+CLASSIFY_SIZE = 512
+
+
+def page_key(pdf_info: dict, page_num: int, extension: str) -> str:
+    """S3 key of a page image: {tenant}/{box}/{set}/page_xxxx.{ext}"""
+    return f"{set_prefix(pdf_info)}page_{page_num:04d}.{extension}"
+
+
+def page_extensions() -> tuple:
+    """File extensions the current --format can produce."""
+    return {
+        "png": ("png",),
+        "png1": ("png",),
+        "webp": ("webp",),
+        "jpeg": ("jpg",),
+        "auto": ("png", "webp", "jpg"),
+    }[PAGE_FORMAT]
+
+
+# A pixel counts as ink below INK_THRESHOLD (0-255 gray). A page is blank
+# when less than BLANK_INK_COVERAGE of its area, ignoring a
+# SCAN_MARGIN border where scanners leave edge shadows, is ink. Pages
+# whose 64-bit difference hashes differ in at most DUPLICATE_HASH_DISTANCE
+# bits are near-duplicates.
+ANALYSIS_SIZE = 512
+INK_THRESHOLD = 160
+BLANK_INK_COVERAGE = 0.002
+SCAN_MARGIN = 0.04
+DUPLICATE_HASH_DISTANCE = 5
+
+
+def analyze_page(image) -> dict:
+    """
+    Measure ink coverage and a perceptual hash of a rendered page.
+
+    Returns {"isBlank", "inkCoverage", "pageHash"}, where pageHash is a
+    16-digit hex difference hash (dHash) of a 9x8 grayscale thumbnail.
+    """
+    import numpy as np
+    from PIL import Image
+    sample = image.convert("L")
+    sample.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(sample)
+
+    height, width = pixels.shape
+    dy, dx = int(height * SCAN_MARGIN), int(width * SCAN_MARGIN)
+    body = pixels[dy:height - dy, dx:width - dx]
+    coverage = float(np.count_nonzero(body < INK_THRESHOLD)) / max(body.size, 1)
+
+    thumb = np.asarray(sample.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    page_hash = int(np.packbits(bits).view(">u8")[0])
+
+    sample.close()
+    return {
+        "isBlank": coverage < BLANK_INK_COVERAGE,
+        "inkCoverage": round(coverage, 5),
+        "pageHash": f"{page_hash:016x}",
+    }
 
 
-def get_tenant_groups(tenant_id: str) -> list:
-    """Generate list of group names for a tenant (both viewer and reviewer)."""
-    return [
-        f"tenant_{tenant_id}_viewer",
-        f"tenant_{tenant_id}_reviewer",
+def find_duplicate(page_hash: str, seen: dict) -> int | None:
+    """Lowest page number in `seen` ({page: hash}) within DUPLICATE_HASH_DISTANCE."""
+    value = int(page_hash, 16)
+    matches = [
+        page for page, other in seen.items()
+        if bin(value ^ int(other, 16)).count("1") <= DUPLICATE_HASH_DISTANCE
     ]
+    return min(matches) if matches else None
+
+
+def classify_page(image) -> str:
+    """Return "bilevel", "gray" or "color" for a rendered page."""
+    from PIL import Image, ImageChops
+    # Nearest-neighbour sampling keeps real pixel values; averaging would
+    # turn thin black-on-white strokes into midtones
+    scale = CLASSIFY_SIZE / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    sample = image.resize(size, Image.Resampling.NEAREST) if scale < 1 else image.copy()
+    if sample.mode != "L":
+        red, green, blue = sample.convert("RGB").split()
+        spread = max(
+            ImageChops.difference(red, green).getextrema()[1],
+            ImageChops.difference(green, blue).getextrema()[1],
+        )
+        if spread > GRAY_TOLERANCE:
+            return "color"
+        sample = sample.convert("L")
 
+    histogram = sample.histogram()
+    midtones = sum(histogram[48:208])
+    if midtones <= BILEVEL_MIDTONES * sum(histogram):
+        return "bilevel"
+    return "gray"
 
-def get_or_create_box(dynamodb, table_name: str, box_number: str) -> str:
-    """Get existing box or create a new one, returns the box ID."""
-    table = dynamodb.Table(table_name)
 
-    # Check if box exists
-    response = table.scan(
-        FilterExpression="boxNumber = :bn AND tenantId = :tid",
-        ExpressionAttributeValues={
-            ":bn": box_number,
-            ":tid": TENANT_ID,
-        }
+def _encode(image, kind: str) -> tuple[BytesIO, str]:
+    from PIL import Image
+    buffer = BytesIO()
+    if kind == "png":
+        image.save(buffer, format="PNG", optimize=True)
+        extension = "png"
+    elif kind == "bilevel":
+        image.convert("L").convert("1", dither=Image.Dither.NONE).save(buffer, format="PNG")
+        extension = "png"
+    elif kind in ("gray", "webp"):
+        source = image.convert("L") if kind == "gray" else image
+        source.save(buffer, format="WEBP", lossless=True, method=4)
+        extension = "webp"
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        extension = "jpg"
+    buffer.seek(0)
+    return buffer, extension
+
+
+def encode_page_image(image, sample: bool = False) -> tuple[BytesIO, str, str]:
+    """
+    Encode a rendered page in the configured PAGE_FORMAT.
+
+    Returns (buffer, extension, content type). With `sample`, the page is
+    also encoded as optimized PNG, the original output, so the run report
+    can compare against it.
+    """
+    started = time.perf_counter()
+    if PAGE_FORMAT == "auto":
+        kind = {"bilevel": "bilevel", "gray": "gray", "color": "jpeg"}[classify_page(image)]
+    else:
+        kind = {"png": "png", "png1": "bilevel", "webp": "webp", "jpeg": "jpeg"}[PAGE_FORMAT]
+    buffer, extension = _encode(image, kind)
+    seconds = time.perf_counter() - started
+    size = buffer.getbuffer().nbytes
+
+    ENCODE_STATS.add(kind, size, seconds)
+    METRICS.observe("encode", seconds, size)
+    if sample and PAGE_FORMAT != "png":
+        started = time.perf_counter()
+        baseline, _ = _encode(image, "png")
+        ENCODE_STATS.add_sample(size, seconds, baseline.getbuffer().nbytes,
+                                time.perf_counter() - started)
+        baseline.close()
+
+    return buffer, extension, CONTENT_TYPES[extension]
+
+
+class EncodeStats:
+    """Encoded bytes and time per run, plus PNG comparisons on sampled pages."""
+
+    FIELDS = ("pages", "bytes", "seconds", "sample_pages", "sample_bytes",
+              "sample_seconds", "png_bytes", "png_seconds")
+
+    def __init__(self):
+        self.values = dict.fromkeys(self.FIELDS, 0)
+        self.kinds: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, size: int, seconds: float) -> None:
+        with self._lock:
+            self.values["pages"] += 1
+            self.values["bytes"] += size
+            self.values["seconds"] += seconds
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+
+    def add_sample(self, size: int, seconds: float, png_size: int, png_seconds: float) -> None:
+        with self._lock:
+            self.values["sample_pages"] += 1
+            self.values["sample_bytes"] += size
+            self.values["sample_seconds"] += seconds
+            self.values["png_bytes"] += png_size
+            self.values["png_seconds"] += png_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"values": dict(self.values), "kinds": dict(self.kinds)}
+
+    def drain(self) -> dict:
+        """Return a snapshot and reset, so a worker reports each task once."""
+        with self._lock:
+            snapshot = {"values": self.values, "kinds": self.kinds}
+            self.values = dict.fromkeys(self.FIELDS, 0)
+            self.kinds = {}
+            return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            for field, value in snapshot["values"].items():
+                self.values[field] += value
+            for kind, count in snapshot["kinds"].items():
+                self.kinds[kind] = self.kinds.get(kind, 0) + count
+
+
+ENCODE_STATS = EncodeStats()
+
+
+def print_encode_stats() -> None:
+    """Print output size and encode time, and the estimated saving over PNG."""
+    values = ENCODE_STATS.values
+    if not values["pages"]:
+        return
+    kinds = ", ".join(f"{count} {kind}" for kind, count in sorted(ENCODE_STATS.kinds.items()))
+    print(f"\nEncoding ({PAGE_FORMAT}): {values['pages']} pages, "
+          f"{values['bytes'] / 1e6:.1f} MB in {values['seconds']:.1f}s ({kinds})")
+    if values["sample_pages"] and values["sample_bytes"] and values["sample_seconds"]:
+        # Scale the sampled pages' PNG/chosen ratios up to the whole run
+        png_bytes = values["bytes"] * values["png_bytes"] / values["sample_bytes"]
+        png_seconds = values["seconds"] * values["png_seconds"] / values["sample_seconds"]
+        print(f"  PNG baseline (estimated from {values['sample_pages']} sampled pages): "
+              f"{png_bytes / 1e6:.1f} MB in {png_seconds:.1f}s")
+        print(f"  Saved: {1 - values['bytes'] / png_bytes:.0%} of bytes, "
+              f"{1 - values['seconds'] / png_seconds:.0%} of encode time")
+
+
+def s3_client_config():
+    """
+    Client settings for the S3 client shared by every thread of a process.
+
+    botocore keeps 10 connections per client by default, fewer than the
+    upload, listing and delete threads that can use it at once; a thread
+    without a free connection blocks or opens one just to throw it away.
+    """
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=max(10, UPLOAD_THREADS + S3_LIST_THREADS + DELETE_THREADS),
+        retries={"max_attempts": 10, "mode": "standard"},
+        tcp_keepalive=True,
     )
 
-    if response.get("Items"):
-        return response["Items"][0]["id"]
+
+def upload_page_buffer(s3_client, bucket: str, buffer: BytesIO, s3_key: str,
+                       content_type: str = "image/png",
+                       cache_control: str | None = None) -> int:
+    """Upload an encoded page image to S3; returns the bytes sent."""
+    size = buffer.getbuffer().nbytes
+    extra_args = {"ContentType": content_type}
+    if cache_control:
+        extra_args["CacheControl"] = cache_control
+
+    started = time.perf_counter()
+    if size >= S3_MULTIPART_THRESHOLD:
+        from boto3.s3.transfer import TransferConfig
+        transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_THRESHOLD,
+            max_concurrency=S3_MULTIPART_CONCURRENCY,
+        )
+        s3_client.upload_fileobj(buffer, bucket, s3_key, ExtraArgs=extra_args, Config=transfer_config)
     else:
-        # Create new box
-        import uuid
-        box_id = str(uuid.uuid4())
-        groups = get_tenant_groups(TENANT_ID)
-        table.put_item(Item={
-            "id": box_id,
-            "boxNumber": box_number,
-            "tenantId": TENANT_ID,
-            "groups": groups,  # Array of group names for authorization
-            "totalSets": 0,
-            "totalPages": 0,
-            "pagesReviewed": 0,
-            "pagesShred": 0,
-            "pagesUnsure": 0,
-            "pagesRetain": 0,
-            "status": "pending",
-            "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-            "updatedAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-        })
+        if VERIFY_MD5:
+            digest = hashlib.md5(buffer.getbuffer()).digest()
+            extra_args["ContentMD5"] = base64.b64encode(digest).decode("ascii")
+        s3_client.put_object(Bucket=bucket, Key=s3_key, Body=buffer, **extra_args)
+    METRICS.observe("s3_put", time.perf_counter() - started, size)
+    return size
+
+
+class StageStats:
+    """
+    Busy time for one pipeline stage, mergeable across pipeline runs.
+
+    Utilization is busy thread-seconds divided by available thread-seconds
+    (wall time x threads), so a stage near 100% is the bottleneck and a
+    stage near 0% spends its time waiting on its neighbours.
+    """
+
+    def __init__(self):
+        self.busy = 0.0
+        self.capacity = 0.0
+        self.items = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, size: int = 0) -> None:
+        with self._lock:
+            self.busy += seconds
+            self.items += 1
+            self.bytes += size
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            self.busy += snapshot["busy"]
+            self.capacity += snapshot["capacity"]
+            self.items += snapshot["items"]
+            self.bytes += snapshot["bytes"]
+
+    def snapshot(self) -> dict:
+        return {"busy": self.busy, "capacity": self.capacity,
+                "items": self.items, "bytes": self.bytes}
+
+    @property
+    def utilization(self) -> float:
+        return self.busy / self.capacity if self.capacity else 0.0
+
+
+PIPELINE_STAGES = ("render", "encode", "upload", "record")
+
+# Run-wide stage statistics, printed in the summary at the end of main()
+PIPELINE_STATS = {name: StageStats() for name in PIPELINE_STAGES}
+
+# Sentinel passed down the pipeline queues once a stage has no more work
+_STAGE_DONE = object()
+
+
+def run_page_pipeline(pdf_path: Path, pdf_info: dict, box_id: str,
+                      first_page: int, last_page: int, page_count: int,
+                      s3_client, dynamodb, tables: dict, bucket: str,
+                      existing_s3_keys: set, set_item: dict | None = None,
+                      manifest: IngestManifest | None = None, lease_lost=None) -> dict:
+    """
+    Render, encode, upload and record a page range as a staged pipeline.
+
+    render (1 thread) -> encode (ENCODE_THREADS) -> upload (UPLOAD_THREADS)
+    -> record (1 thread), connected by queues of PIPELINE_QUEUE_SIZE items.
+    Full queues block the stage feeding them, so at most a few pages per
+    stage are in memory while encoding overlaps with network round trips.
+    The record stage batches page records (and set_item, if given) through
+    a BatchWriter that is flushed when the range is finished.
+
+    With a manifest, each upload and each written batch is recorded as it
+    happens. Pages the manifest already has are not uploaded or recorded
+    again, and rendering starts at the first unfinished page.
+
+    Each written batch is added to the box counters before the manifest
+    marks its pages recorded, so the manifest is also the record of what
+    has been counted: a resume rewrites, and counts, exactly the pages it
+    does not have. Only a crash between a counter update and the manifest
+    write that follows it counts a batch twice; reconcile.py --repair
+    fixes that.
+
+    With `lease_lost` (--distributed), called as lease_lost(set_id) before
+    each upload and record, the pipeline stops as soon as another ingester
+    has taken the PDF over, without writing anything more.
+
+    Returns {"pages", "sets"} counting the page and set records actually
+    written, "stage_stats" with a per-stage snapshot, and "error" if any
+    stage failed. The first error stops the renderer and drains the
+    pipeline; records already written are still counted.
+    """
+    set_id = pdf_info["setId"]
+    stats = {name: StageStats() for name in PIPELINE_STAGES}
+    threads_per_stage = {"render": 1, "encode": ENCODE_THREADS,
+                         "upload": UPLOAD_THREADS, "record": 1}
+
+    encode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    upload_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    record_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE * UPLOAD_THREADS)
+
+    page_states = manifest.page_states(set_id) if manifest else {}
+    done = {
+        p for p, state in page_states.items()
+        if first_page <= p <= last_page and state["uploaded"] and state["recorded"]
+    }
+    render_from = first_page
+    while render_from in done:
+        render_from += 1
+    if render_from > first_page:
+        print(f"    Resuming at page {render_from}")
+
+    # Counted from the encode threads and the record thread
+    detections = {"blank": 0, "duplicates": 0}
+    detections_lock = threading.Lock()
+
+    def detected(name: str) -> None:
+        with detections_lock:
+            detections[name] += 1
+
+    def on_written(table_name: str, requests: list) -> None:
+        if table_name == tables["set"]:
+            adjust_box_counters(dynamodb, tables["box"], box_id, sets=len(requests))
+            if manifest:
+                manifest.mark_set_recorded(set_id)
+            return
+        items = [request["PutRequest"]["Item"] for request in requests]
+        adjust_box_counters(dynamodb, tables["box"], box_id, **review_counter_deltas(items))
+        if manifest:
+            manifest.mark_recorded(set_id, [int(item["pageNumber"]) for item in items])
+
+    errors = []
+    abort = threading.Event()
+    writer = BatchWriter(dynamodb, on_written=on_written)
+
+    def fail(exc: Exception) -> None:
+        errors.append(exc)
+        abort.set()
+
+    def check_lease() -> None:
+        if lease_lost and lease_lost(set_id):
+            raise RuntimeError("lost the lease to another ingester")
+
+    def render():
+        try:
+            pages = iter_pdf_images(pdf_path, first_page=render_from, last_page=last_page)
+            while not abort.is_set():
+                started = time.perf_counter()
+                item = next(pages, None)
+                if item is None:
+                    break
+                elapsed = time.perf_counter() - started
+                stats["render"].add(elapsed)
+                METRICS.observe("render", elapsed)
+                if item[0] in done:
+                    item[1].close()
+                    continue
+                encode_queue.put(item)
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(ENCODE_THREADS):
+                encode_queue.put(_STAGE_DONE)
+
+    def encode():
+        while True:
+            item = encode_queue.get()
+            if item is _STAGE_DONE:
+                break
+            page_num, image = item
+            try:
+                if abort.is_set():
+                    continue
+                started = time.perf_counter()
+                analysis = analyze_page(image)
+                METRICS.observe("analyze", time.perf_counter() - started)
+                if analysis["isBlank"] and BLANK_PAGES == "skip":
+                    if manifest:
+                        manifest.mark_skipped(set_id, page_num)
+                    print(f"    Skipped blank page {page_num}/{page_count}")
+                    detected("blank")
+                    stats["encode"].add(time.perf_counter() - started)
+                    continue
+                state = page_states.get(page_num)
+                uploads = []
+                if state and state["uploaded"]:
+                    s3_key = state["s3_key"]
+                else:
+                    s3_key = next((key for key in (
+                        page_key(pdf_info, page_num, ext) for ext in page_extensions()
+                    ) if key in existing_s3_keys), None)
+                    if s3_key is None:
+                        sample = ENCODE_SAMPLE_EVERY and page_num % ENCODE_SAMPLE_EVERY == 0
+                        buffer, extension, content_type = encode_page_image(image, sample=bool(sample))
+                        s3_key = page_key(pdf_info, page_num, extension)
+                        uploads.append((buffer, s3_key, content_type, None))
+
+                thumb_key = None
+                if THUMBNAIL_SIZE:
+                    thumb_key = thumbnail_key(pdf_info, page_num)
+                    if not (state and state["thumbnail_key"]) and thumb_key not in existing_s3_keys:
+                        uploads.append((encode_thumbnail(image), thumb_key,
+                                        "image/jpeg", THUMBNAIL_CACHE_CONTROL))
+                stats["encode"].add(time.perf_counter() - started)
+                upload_queue.put((page_num, s3_key, thumb_key, uploads, analysis))
+            except Exception as e:
+                fail(e)
+            finally:
+                image.close()
+
+    def upload():
+        while True:
+            item = upload_queue.get()
+            if item is _STAGE_DONE:
+                break
+            page_num, s3_key, thumb_key, uploads, analysis = item
+            try:
+                if abort.is_set():
+                    continue
+                check_lease()
+                started = time.perf_counter()
+                sent = 0
+                for buffer, key, content_type, cache_control in uploads:
+                    sent += upload_page_buffer(s3_client, bucket, buffer, key,
+                                               content_type, cache_control)
+                if uploads:
+                    if manifest:
+                        manifest.mark_uploaded(set_id, page_num, s3_key, thumb_key)
+                    print(f"    Uploaded page {page_num}/{page_count}")
+                else:
+                    print(f"    Page {page_num} already exists in S3")
+                stats["upload"].add(time.perf_counter() - started, sent)
+                record_queue.put((page_num, s3_key, thumb_key, analysis))
+            except Exception as e:
+                fail(e)
+            finally:
+                # Hand the encoded bytes back as soon as the page is sent
+                for buffer, *_ in uploads:
+                    buffer.close()
+
+    def record():
+        try:
+            if set_item is not None:
+                check_lease()
+                writer.put(tables["set"], set_item)
+        except Exception as e:
+            fail(e)
+
+        # Pages reaching this stage are already in S3, so keep recording
+        # them even after another stage has failed
+        hashes = {}
+        while True:
+            item = record_queue.get()
+            if item is _STAGE_DONE:
+                break
+            page_num, s3_key, thumb_key, analysis = item
+            try:
+                check_lease()
+                started = time.perf_counter()
+                if analysis["isBlank"]:
+                    detected("blank")
+                else:
+                    # Pages arrive roughly in order, so this points each
+                    # near-duplicate at the earliest match seen so far
+                    analysis["duplicateOf"] = find_duplicate(analysis["pageHash"], hashes)
+                    hashes[page_num] = analysis["pageHash"]
+                    if analysis["duplicateOf"] is not None:
+                        detected("duplicates")
+                writer.put(tables["page"], build_page_item(
+                    f"{set_id}_page_{page_num:04d}", set_id, box_id,
+                    page_num, s3_key.rsplit("/", 1)[1], s3_key, analysis, thumb_key
+                ))
+                stats["record"].add(time.perf_counter() - started)
+            except Exception as e:
+                fail(e)
+
+        try:
+            check_lease()
+            started = time.perf_counter()
+            writer.flush()
+            stats["record"].busy += time.perf_counter() - started
+        except Exception as e:
+            fail(e)
+
+    def run_stage(target, count: int, downstream: queue.Queue | None,
+                  downstream_count: int) -> list:
+        """Start a stage's threads plus a closer that signals the next stage."""
+        workers = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for worker in workers:
+            worker.start()
+
+        def close():
+            for worker in workers:
+                worker.join()
+            if downstream is not None:
+                for _ in range(downstream_count):
+                    downstream.put(_STAGE_DONE)
+
+        closer = threading.Thread(target=close, daemon=True)
+        closer.start()
+        return [closer]
+
+    wall_start = time.perf_counter()
+    waiters = (
+        run_stage(render, 1, None, 0)
+        + run_stage(encode, ENCODE_THREADS, upload_queue, UPLOAD_THREADS)
+        + run_stage(upload, UPLOAD_THREADS, record_queue, 1)
+        + run_stage(record, 1, None, 0)
+    )
+    for waiter in waiters:
+        waiter.join()
+    wall = time.perf_counter() - wall_start
+
+    for name, stage in stats.items():
+        stage.capacity = wall * threads_per_stage[name]
+
+    if detections["blank"] or detections["duplicates"]:
+        print(f"    Detected {detections['blank']} blank and "
+              f"{detections['duplicates']} near-duplicate pages")
+
+    result = {
+        "pages": writer.written.get(tables["page"], 0),
+        "sets": writer.written.get(tables["set"], 0),
+        "stage_stats": {name: stage.snapshot() for name, stage in stats.items()},
+    }
+    if errors:
+        result["error"] = str(errors[0])
+    return result
+
+
+def print_transfer_stats(wall_seconds: float) -> None:
+    """Print upload throughput over the whole run, for sizing against the uplink."""
+    upload = PIPELINE_STATS["upload"]
+    if not upload.items or wall_seconds <= 0:
+        return
+    print(f"\nUpload throughput: {upload.items / wall_seconds:.1f} pages/s, "
+          f"{upload.bytes / 1e6 / wall_seconds:.2f} MB/s "
+          f"({upload.bytes / 1e6:.1f} MB in {wall_seconds:.1f}s, {UPLOAD_THREADS} upload threads)")
+    if upload.busy:
+        print(f"  Per upload thread while busy: {upload.bytes / 1e6 / upload.busy:.2f} MB/s")
+
+
+def run_summary(stats: dict, wall_seconds: float) -> dict:
+    """Machine-readable summary of a run, written by --stats-json."""
+    return {
+        "wall_seconds": wall_seconds,
+        "sets": stats,
+        "upload_threads": UPLOAD_THREADS,
+        "encode_threads": ENCODE_THREADS,
+        "renderer": RENDERER,
+        "format": PAGE_FORMAT,
+        "stages": {
+            name: dict(stage.snapshot(), utilization=stage.utilization)
+            for name, stage in PIPELINE_STATS.items()
+        },
+        "encode": ENCODE_STATS.snapshot(),
+    }
+
+
+def print_pipeline_stats() -> None:
+    """Print per-stage utilization accumulated over the run."""
+    if not PIPELINE_STATS["render"].items:
+        return
+    bottleneck = max(PIPELINE_STATS, key=lambda name: PIPELINE_STATS[name].utilization)
+    print("\nPipeline utilization:")
+    for name in PIPELINE_STAGES:
+        stage = PIPELINE_STATS[name]
+        marker = "  <- bottleneck" if name == bottleneck else ""
+        print(f"  {name:<7} {stage.utilization:6.1%}  "
+              f"({stage.items} pages, {stage.busy:.1f}s busy){marker}")
+
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_RETRIES = 8
+
+
+def write_batch(dynamodb, request_items: dict) -> None:
+    """
+    Send one BatchWriteItem request, retrying unprocessed items.
+
+    `dynamodb` may be the service resource (plain Python values) or the
+    low-level client (typed attribute values).
+
+    DynamoDB returns items it could not write (throttling, partition limits)
+    as UnprocessedItems; those are resent with exponential backoff until
+    they succeed or BATCH_WRITE_RETRIES is exhausted.
+    """
+    for attempt in range(BATCH_WRITE_RETRIES + 1):
+        started = time.perf_counter()
+        response = dynamodb.batch_write_item(RequestItems=request_items)
+        METRICS.observe("dynamodb_write", time.perf_counter() - started,
+                        items=sum(len(requests) for requests in request_items.values()))
+        request_items = response.get("UnprocessedItems") or {}
+        if not request_items:
+            return
+        time.sleep(min(0.05 * (2 ** attempt), 5.0))
+
+    remaining = sum(len(requests) for requests in request_items.values())
+    raise RuntimeError(f"BatchWriteItem left {remaining} items unprocessed after retries")
+
+
+class BatchWriter:
+    """
+    Buffer DynamoDB puts and deletes and send them with BatchWriteItem.
+
+    Requests for different tables share batches. Nothing is sent until 25
+    requests are buffered or flush() is called; leaving a `with` block
+    flushes whatever is left.
+    """
+
+    def __init__(self, dynamodb, on_written=None):
+        self.dynamodb = dynamodb
+        # Called as on_written(table_name, requests) after each successful batch
+        self.on_written = on_written
+        # Requests successfully written, per table name
+        self.written: dict[str, int] = {}
+        self._pending: list[tuple[str, dict]] = []
+        self._lock = threading.Lock()
+
+    def put(self, table_name: str, item: dict) -> None:
+        self._add(table_name, {"PutRequest": {"Item": item}})
+
+    def delete(self, table_name: str, key: dict) -> None:
+        self._add(table_name, {"DeleteRequest": {"Key": key}})
+
+    def _add(self, table_name: str, request: dict) -> None:
+        with self._lock:
+            self._pending.append((table_name, request))
+            if len(self._pending) < BATCH_WRITE_SIZE:
+                return
+            batch, self._pending = self._pending, []
+        self._send(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, []
+        for start in range(0, len(batch), BATCH_WRITE_SIZE):
+            self._send(batch[start:start + BATCH_WRITE_SIZE])
+
+    def _send(self, batch: list) -> None:
+        if not batch:
+            return
+        request_items: dict[str, list] = {}
+        for table_name, request in batch:
+            request_items.setdefault(table_name, []).append(request)
+        write_batch(self.dynamodb, request_items)
+        with self._lock:
+            for table_name, requests in request_items.items():
+                self.written[table_name] = self.written.get(table_name, 0) + len(requests)
+        if self.on_written:
+            for table_name, requests in request_items.items():
+                self.on_written(table_name, requests)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Don't mask the original error with a flush failure
+        if exc_type is None:
+            self.flush()
+
+
+# boxNumber -> box id per (box table, tenant), filled by one byTenant query
+# per run and kept up to date as boxes are created
+_box_id_cache: dict[tuple[str, str], dict[str, str]] = {}
+
+
+def load_box_ids(dynamodb, table_name: str, tenant_id: str) -> dict:
+    """Return the cached boxNumber -> id map for a tenant, querying byTenant once."""
+    from boto3.dynamodb.conditions import Key
+    cache_key = (table_name, tenant_id)
+    if cache_key not in _box_id_cache:
+        table = dynamodb.Table(table_name)
+        box_ids = {}
+        query_args = {
+            "IndexName": "byTenant",
+            "KeyConditionExpression": Key("tenantId").eq(tenant_id),
+            "ProjectionExpression": "id, boxNumber",
+        }
+        while True:
+            response = table.query(**query_args)
+            for item in response.get("Items", []):
+                box_ids.setdefault(item["boxNumber"], item["id"])
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        _box_id_cache[cache_key] = box_ids
+    return _box_id_cache[cache_key]
+
+
+def box_id_for(tenant_id: str, box_number: str) -> str:
+    """
+    Deterministic id for a new box.
+
+    Every ingester derives the same id for the same tenant and box number,
+    so a conditional put on it lets exactly one of them create the box.
+    """
+    import uuid
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"box2cloud:{tenant_id}:box:{box_number}"))
+
+
+def find_box_id(dynamodb, table_name: str, box_number: str) -> str | None:
+    """Look up a box's id by number, from the cache or the byTenant index."""
+    from boto3.dynamodb.conditions import Key
+    box_ids = load_box_ids(dynamodb, table_name, TENANT_ID)
+    if box_number in box_ids:
+        return box_ids[box_number]
+
+    # Not there when the cache was warmed - another ingester may have added it since
+    response = dynamodb.Table(table_name).query(
+        IndexName="byTenant",
+        KeyConditionExpression=Key("tenantId").eq(TENANT_ID) & Key("boxNumber").eq(box_number),
+        ProjectionExpression="id",
+    )
+    if response.get("Items"):
+        box_ids[box_number] = response["Items"][0]["id"]
+        return box_ids[box_number]
+    return None
+
+
+def get_or_create_box(dynamodb, table_name: str, box_number: str) -> str:
+    """Get existing box or create a new one, returns the box ID."""
+    box_id = find_box_id(dynamodb, table_name, box_number)
+    if box_id:
         return box_id
 
+    table = dynamodb.Table(table_name)
+
+    # Create new box; the condition makes a concurrent create of the same box a no-op
+    box_id = box_id_for(TENANT_ID, box_number)
+    groups = get_tenant_groups(TENANT_ID)
+    try:
+        table.put_item(
+            Item={
+                "id": box_id,
+                "boxNumber": box_number,
+                "tenantId": TENANT_ID,
+                "groups": groups,  # Array of group names for authorization
+                "totalSets": 0,
+                "totalPages": 0,
+                "pagesReviewed": 0,
+                "pagesShred": 0,
+                "pagesUnsure": 0,
+                "pagesRetain": 0,
+                "status": "pending",
+                "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                "updatedAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            },
+            ConditionExpression="attribute_not_exists(id)",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        # Another ingester created this box first; its id is the same one
+
+    load_box_ids(dynamodb, table_name, TENANT_ID)[box_number] = box_id
+    return box_id
+
+
+def query_all(table, **query_args):
+    """Yield every item from a query, following LastEvaluatedKey."""
+    while True:
+        started = time.perf_counter()
+        response = table.query(**query_args)
+        METRICS.observe("dynamodb_query", time.perf_counter() - started,
+                        items=len(response.get("Items", [])))
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def rebuild_box_totals(dynamodb, tables: dict, box_id: str) -> dict:
+    """
+    Recalculate box totals from actual set and page records.
 
-def recalculate_box_totals(dynamodb, tables: dict, box_id: str) -> None:
-    """Recalculate box totals from actual set and page records."""
+    Reads the box's sets and pages through the byBox indexes, following
+    pagination, and overwrites the counters. Used by --rebuild-totals to
+    repair drift; normal ingest keeps counters with adjust_box_counters.
+    """
+    from boto3.dynamodb.conditions import Key
     # Count sets for this box
     set_table = dynamodb.Table(tables["set"])
-    set_response = set_table.scan(
-        FilterExpression="boxId = :bid",
-        ExpressionAttributeValues={":bid": box_id}
-    )
-    total_sets = len(set_response.get("Items", []))
+    total_sets = sum(1 for _ in query_all(
+        set_table,
+        IndexName="byBox",
+        KeyConditionExpression=Key("boxId").eq(box_id),
+        ProjectionExpression="id",
+    ))
 
     # Count pages and review statuses for this box
     page_table = dynamodb.Table(tables["page"])
-    page_response = page_table.scan(
-        FilterExpression="boxId = :bid",
-        ExpressionAttributeValues={":bid": box_id}
-    )
-    pages = page_response.get("Items", [])
-    total_pages = len(pages)
-    pages_reviewed = sum(1 for p in pages if p.get("reviewStatus") and p["reviewStatus"] != "pending")
-    pages_shred = sum(1 for p in pages if p.get("reviewStatus") == "shred")
-    pages_unsure = sum(1 for p in pages if p.get("reviewStatus") == "unsure")
-    pages_retain = sum(1 for p in pages if p.get("reviewStatus") == "retain")
-
-    # Determine status
-    if total_pages == 0:
-        status = "pending"
-    elif pages_reviewed == total_pages:
-        status = "complete"
-    elif pages_reviewed > 0:
-        status = "in_progress"
-    else:
-        status = "pending"
+    counts = review_counter_deltas(query_all(
+        page_table,
+        IndexName="byBox",
+        KeyConditionExpression=Key("boxId").eq(box_id),
+        ProjectionExpression="reviewStatus",
+    ))
+    status = box_status(counts["pages"], counts["reviewed"])
 
     # Update box with calculated totals
     box_table = dynamodb.Table(tables["box"])
@@ -308,25 +2106,44 @@ def recalculate_box_totals(dynamodb, tables: dict, box_id: str) -> None:
         ExpressionAttributeNames={"#st": "status"},
         ExpressionAttributeValues={
             ":sets": total_sets,
-            ":pages": total_pages,
-            ":reviewed": pages_reviewed,
-            ":shred": pages_shred,
-            ":unsure": pages_unsure,
-            ":retain": pages_retain,
+            ":pages": counts["pages"],
+            ":reviewed": counts["reviewed"],
+            ":shred": counts["shred"],
+            ":unsure": counts["unsure"],
+            ":retain": counts["retain"],
             ":status": status,
         }
     )
+    return {"sets": total_sets, **counts, "status": status}
 
 
-def create_set(dynamodb, table_name: str, set_id: str, box_id: str,
-               filename: str, page_count: int) -> None:
-    """Create a set record."""
-    table = dynamodb.Table(table_name)
+def rebuild_tenant_totals(dynamodb, tables: dict) -> None:
+    """Rebuild the counters of every box belonging to TENANT_ID."""
+    box_ids = load_box_ids(dynamodb, tables["box"], TENANT_ID)
+    print(f"Rebuilding totals for {len(box_ids)} boxes...")
+    for box_number, box_id in sorted(box_ids.items()):
+        totals = rebuild_box_totals(dynamodb, tables, box_id)
+        print(f"  Box {box_number}: {totals['sets']} sets, {totals['pages']} pages, "
+              f"{totals['reviewed']} reviewed ({totals['status']})")
+
+
+def record_id_for(kind: str, natural_id: str) -> str:
+    """
+    Deterministic id for a set or page record.
+
+    Writing the same set or page twice (e.g. when resuming after a crash)
+    overwrites the earlier record instead of duplicating it.
+    """
     import uuid
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"box2cloud:{TENANT_ID}:{kind}:{natural_id}"))
+
+
+def build_set_item(set_id: str, box_id: str, filename: str, page_count: int) -> dict:
+    """Build a set record."""
     groups = get_tenant_groups(TENANT_ID)
 
-    table.put_item(Item={
-        "id": str(uuid.uuid4()),
+    return {
+        "id": record_id_for("set", set_id),
         "setId": set_id,
         "boxId": box_id,
         "tenantId": TENANT_ID,
@@ -336,18 +2153,24 @@ def create_set(dynamodb, table_name: str, set_id: str, box_id: str,
         "pagesReviewed": 0,
         "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
         "updatedAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-    })
+    }
 
 
-def create_page(dynamodb, table_name: str, page_id: str, set_id: str,
-                box_id: str, page_number: int, filename: str, s3_key: str) -> None:
-    """Create a page record."""
-    table = dynamodb.Table(table_name)
-    import uuid
+def build_page_item(page_id: str, set_id: str, box_id: str, page_number: int,
+                    filename: str, s3_key: str, analysis: dict | None = None,
+                    thumbnail_key: str | None = None) -> dict:
+    """
+    Build a page record.
+
+    `analysis` is analyze_page's result, optionally with "duplicateOf";
+    its detections are stored on the record so they can be audited. Blank
+    pages are recorded as already shredded when BLANK_PAGES is "shred".
+    `thumbnail_key` is the page's small preview image, if one was made.
+    """
     groups = get_tenant_groups(TENANT_ID)
 
-    table.put_item(Item={
-        "id": str(uuid.uuid4()),
+    item = {
+        "id": record_id_for("page", page_id),
         "pageId": page_id,
         "setId": set_id,
         "boxId": box_id,
@@ -359,96 +2182,762 @@ def create_page(dynamodb, table_name: str, page_id: str, set_id: str,
         "reviewStatus": "pending",
         "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
         "updatedAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-    })
-
+    }
+    if thumbnail_key:
+        item["thumbnailKey"] = thumbnail_key
+    if analysis:
+        item["isBlank"] = analysis["isBlank"]
+        item["inkCoverage"] = Decimal(str(analysis["inkCoverage"]))
+        item["pageHash"] = analysis["pageHash"]
+        if analysis.get("duplicateOf") is not None:
+            item["duplicateOf"] = analysis["duplicateOf"]
+        if analysis["isBlank"] and BLANK_PAGES == "shred":
+            item["reviewStatus"] = "shred"
+            item["reviewedBy"] = "auto:blank"
+            item["reviewedAt"] = item["createdAt"]
+    return item
+
+
+def record_skipped_pages(dynamodb, tables: dict, manifest: IngestManifest, set_id: str) -> None:
+    """
+    Note the pages --blank-pages skip left out on a finished PDF's set record.
 
-def delete_existing_records(dynamodb, tables: dict, set_id: str) -> None:
-    """Delete existing set and page records for a set_id."""
-    # Delete set records
-    set_table = dynamodb.Table(tables["set"])
-    response = set_table.scan(
-        FilterExpression="setId = :sid",
-        ExpressionAttributeValues={":sid": set_id}
+    They have no page records, so readers of pageCount (reconcile.py, and
+    ingesters resuming the set) need them to tell a finished set from one
+    with missing pages. Written once every page is done, when the set
+    record is known to exist: it goes out with the first page batch.
+    """
+    skipped = manifest.skipped_pages(set_id)
+    if not skipped:
+        return
+    dynamodb.Table(tables["set"]).update_item(
+        Key={"id": record_id_for("set", set_id)},
+        UpdateExpression="SET skippedPages = :pages, updatedAt = :now",
+        ConditionExpression="attribute_exists(id)",
+        ExpressionAttributeValues={":pages": skipped, ":now": _utc_now()},
     )
-    for item in response.get("Items", []):
-        set_table.delete_item(Key={"id": item["id"]})
-        print(f"    Deleted existing set record: {item['id']}")
 
-    # Delete page records
-    page_table = dynamodb.Table(tables["page"])
-    response = page_table.scan(
-        FilterExpression="setId = :sid",
-        ExpressionAttributeValues={":sid": set_id}
-    )
-    deleted_pages = len(response.get("Items", []))
-    for item in response.get("Items", []):
-        page_table.delete_item(Key={"id": item["id"]})
-    if deleted_pages > 0:
-        print(f"    Deleted {deleted_pages} existing page records")
 
+# DeleteObjects accepts at most 1000 keys per call
+S3_DELETE_BATCH = 1000
+DELETE_THREADS = 8
 
-def process_pdf(pdf_path: Path, pdf_info: dict, s3_client, dynamodb,
-                tables: dict, bucket: str, existing_s3_keys: set,
-                existing_sets: set, force: bool = False) -> dict:
-    """Process a single PDF file."""
+
+def batch_delete(dynamodb, table_name: str, keys: list) -> int:
+    """
+    Delete items by primary key with parallel BatchWriteItem calls.
+
+    Keys are sent in batches of 25 from DELETE_THREADS threads. The
+    resource's client is used because, unlike the resource itself, it is
+    safe to share between threads; it still takes plain Python values.
+    """
+    client = dynamodb.meta.client
+
+    def send(chunk):
+        write_batch(client, {table_name: [{"DeleteRequest": {"Key": key}} for key in chunk]})
+
+    chunks = [keys[i:i + BATCH_WRITE_SIZE] for i in range(0, len(keys), BATCH_WRITE_SIZE)]
+    with ThreadPoolExecutor(max_workers=DELETE_THREADS) as pool:
+        list(pool.map(send, chunks))
+    return len(keys)
+
+
+def delete_s3_prefix(s3_client, bucket: str, prefix: str) -> list:
+    """Delete every object under a prefix with DeleteObjects; returns the deleted keys."""
+    deleted = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys = [obj["Key"] for obj in page.get("Contents", [])]
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            batch = keys[start:start + S3_DELETE_BATCH]
+            response = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            if response.get("Errors"):
+                error = response["Errors"][0]
+                raise RuntimeError(f"Could not delete s3://{bucket}/{error['Key']}: {error['Message']}")
+            deleted.extend(batch)
+    return deleted
+
+
+def delete_existing_records(dynamodb, s3_client, tables: dict, bucket: str,
+                            pdf_info: dict) -> list:
+    """
+    Delete a set's records and page images so it can be re-ingested.
+
+    The set records are found through the Set byBox index, and the pages
+    of a set written with deterministic ids by BatchGetItem over its
+    pageCount. Only a set written by older versions of this script, with
+    random ids, has its pages found through the Page byBox index, which
+    reads every page of the box. Records are removed with parallel batch
+    deletes while the set's S3 prefix is cleared with DeleteObjects.
+    Returns the S3 keys that were deleted.
+    """
+    from boto3.dynamodb.conditions import Attr, Key
     set_id = pdf_info["setId"]
     box_number = pdf_info["boxNumber"]
+    box_id = find_box_id(dynamodb, tables["box"], box_number)
+    prefix = set_prefix(pdf_info)
+
+    deleted_sets = []
+    deleted_pages = {}
+    if box_id:
+        deleted_sets = list(query_all(
+            dynamodb.Table(tables["set"]),
+            IndexName="byBox",
+            KeyConditionExpression=Key("boxId").eq(box_id) & Key("setId").eq(set_id),
+            ProjectionExpression="id, boxId, pageCount",
+        ))
+    for set_item in deleted_sets:
+        if set_item["id"] == record_id_for("set", set_id):
+            pages = get_set_pages(dynamodb, tables["page"], set_id, int(set_item.get("pageCount") or 0),
+                                  "id, boxId, reviewStatus")
+        else:
+            pages = query_all(
+                dynamodb.Table(tables["page"]),
+                IndexName="byBox",
+                KeyConditionExpression=Key("boxId").eq(box_id),
+                FilterExpression=Attr("setId").eq(set_id),
+                ProjectionExpression="id, boxId, reviewStatus",
+            )
+        deleted_pages.update((page["id"], page) for page in pages)
+    deleted_pages = list(deleted_pages.values())
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        set_future = pool.submit(
+            batch_delete, dynamodb, tables["set"],
+            [{"id": item["id"]} for item in deleted_sets]
+        )
+        page_future = pool.submit(
+            batch_delete, dynamodb, tables["page"],
+            [{"id": item["id"]} for item in deleted_pages]
+        )
+        s3_future = pool.submit(delete_s3_prefix, s3_client, bucket, prefix)
+        set_future.result()
+        page_future.result()
+        deleted_keys = s3_future.result()
+
+    if deleted_sets:
+        print(f"    Deleted {len(deleted_sets)} existing set records")
+    if deleted_pages:
+        print(f"    Deleted {len(deleted_pages)} existing page records")
+    if deleted_keys:
+        print(f"    Deleted {len(deleted_keys)} existing objects from s3://{bucket}/{prefix}")
+
+    # Take the deleted records back out of the box's counters
+    if box_id and (deleted_sets or deleted_pages):
+        adjust_box_counters(
+            dynamodb, tables["box"], box_id, sets=-len(deleted_sets),
+            **review_counter_deltas(deleted_pages, sign=-1)
+        )
+
+    return deleted_keys
+
+
+# BatchGetItem accepts at most 100 keys per call
+BATCH_GET_SIZE = 100
+
+
+def get_set_pages(dynamodb, table_name: str, set_id: str, page_count: int,
+                  projection: str) -> list:
+    """
+    The page records of set pages 1..page_count, read by their deterministic
+    ids with BatchGetItem rather than through the byBox index, which would
+    read every page of the box. Pages with no record are left out.
+    """
+    keys = [{"id": record_id_for("page", f"{set_id}_page_{number:04d}")}
+            for number in range(1, page_count + 1)]
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {table_name: {
+            "Keys": keys[start:start + BATCH_GET_SIZE],
+            "ConsistentRead": True,
+            "ProjectionExpression": projection,
+        }}
+        for attempt in range(BATCH_WRITE_RETRIES + 1):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response["Responses"].get(table_name, []))
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+            time.sleep(min(0.05 * (2 ** attempt), 5.0))
+        else:
+            raise RuntimeError(f"BatchGetItem left page records of {set_id} unread after retries")
+    return items
+
+
+def fetch_remote_progress(dynamodb, tables: dict, set_id: str) -> dict | None:
+    """
+    What DynamoDB already holds for a set, read by its deterministic ids.
+
+    Returns None if there is no set record, otherwise {"box_id",
+    "page_count", "pages", "skipped"}, where pages maps each recorded page
+    number to {"s3_key", "thumbnail_key"} and skipped lists the pages
+    --blank-pages skip left out of a finished set.
+    """
+    set_item = dynamodb.Table(tables["set"]).get_item(
+        Key={"id": record_id_for("set", set_id)}, ConsistentRead=True,
+        ProjectionExpression="boxId, pageCount, skippedPages",
+    ).get("Item")
+    if not set_item:
+        return None
+
+    page_count = int(set_item.get("pageCount") or 0)
+    pages = {
+        int(item["pageNumber"]): {"s3_key": item.get("s3Key"), "thumbnail_key": item.get("thumbnailKey")}
+        for item in get_set_pages(dynamodb, tables["page"], set_id, page_count,
+                                  "pageNumber, s3Key, thumbnailKey")
+    }
+    skipped = [int(number) for number in set_item.get("skippedPages", [])]
+    return {"box_id": set_item["boxId"], "page_count": page_count, "pages": pages, "skipped": skipped}
+
+
+def adopt_remote_progress(dynamodb, tables: dict, manifest: IngestManifest,
+                          pdf_path: Path, pdf_info: dict, fingerprint: dict | None = None) -> bool | None:
+    """
+    Bring the manifest up to date with what other ingesters wrote for a PDF.
+
+    The set record goes out with a PDF's first page batch, so a set that
+    exists may be only partly ingested, e.g. by a node that died holding
+    its lease. The set's page records are marked uploaded and recorded in
+    the manifest - and so counted, as every ingester adds a batch to the
+    box counters as it writes it - and processing resumes at the pages
+    that are missing. Returns True if every page is recorded, in which
+    case the PDF is marked complete, and None if there is no set record
+    under the set's deterministic id: nothing was written, or the set was
+    written by an older version of this script with random ids.
+    """
+    set_id = pdf_info["setId"]
+    remote = fetch_remote_progress(dynamodb, tables, set_id)
+    if remote is None:
+        return None
+    entry = manifest.get_pdf(set_id)
+    if entry is None:
+        manifest.start_pdf(set_id, pdf_path, fingerprint or fingerprint_pdf(pdf_path),
+                           remote["page_count"], remote["box_id"])
+    manifest.mark_set_recorded(set_id)
+    manifest.adopt_pages(set_id, remote["pages"])
+    for page_number in remote["skipped"]:
+        manifest.mark_skipped(set_id, page_number)
+    if len(remote["pages"]) + len(remote["skipped"]) < remote["page_count"]:
+        print(f"  {pdf_info['filename']}: {len(remote['pages'])} of {remote['page_count']} "
+              f"pages already recorded")
+        return False
+    manifest.complete_pdf(set_id)
+    return True
+
+
+def prepare_set(pdf_path: Path, pdf_info: dict, s3_client, dynamodb, tables: dict,
+                bucket: str, existing_s3_keys: set, existing_sets: set,
+                force: bool = False, manifest: IngestManifest | None = None) -> dict:
+    """
+    Create the box record for a PDF and build its set record.
+
+    Returns {"box_id", "page_count", "set_item"} on success, or a result dict with
+    "skipped" or "error" set if the PDF should not be processed further.
+    set_item is None when resuming a PDF whose set record is already written.
+    """
+    set_id = pdf_info["setId"]
+    box_number = pdf_info["boxNumber"]
+
+    entry = manifest.get_pdf(set_id) if manifest else None
+    fingerprint = fingerprint_pdf(pdf_path, entry) if manifest else None
+
+    if entry and not force:
+        if entry["sha256"] != fingerprint["sha256"]:
+            print(f"  Skipping {pdf_info['filename']} - file changed since it was "
+                  f"ingested (use --force to re-ingest)")
+            return {"skipped": True}
+        if entry["status"] == "complete":
+            print(f"  Skipping {pdf_info['filename']} - already processed")
+            return {"skipped": True}
 
     # Skip if already processed (unless forcing)
-    if set_id in existing_sets:
-        if not force:
+    if force and (set_id in existing_sets or entry):
+        print(f"  Force mode: deleting existing records for {pdf_info['filename']}")
+        deleted_keys = delete_existing_records(
+            dynamodb, s3_client, tables, bucket, pdf_info
+        )
+        # The old images are gone, so every page must be uploaded again
+        existing_s3_keys.difference_update(deleted_keys)
+        if manifest:
+            manifest.reset_pdf(set_id)
+        entry = None
+    elif set_id in existing_sets and not entry:
+        # Ingested from another machine, perhaps only in part: trust its
+        # page records, not the set record
+        adopted = adopt_remote_progress(
+            dynamodb, tables, manifest, pdf_path, pdf_info, fingerprint
+        ) if manifest else True
+        if adopted is None:
+            # Found through byBox but not by its deterministic id: written
+            # by an older version, whose page records can't be read back
+            # by id, so it is skipped as those versions did
+            print(f"  Skipping {pdf_info['filename']} - already processed by an older "
+                  f"version (use --force to re-ingest)")
+            return {"skipped": True}
+        if adopted:
             print(f"  Skipping {pdf_info['filename']} - already processed")
             return {"skipped": True}
-        else:
-            print(f"  Force mode: deleting existing records for {pdf_info['filename']}")
-            delete_existing_records(dynamodb, tables, set_id)
+        entry = manifest.get_pdf(set_id)
 
-    print(f"  Processing {pdf_info['filename']}...")
+    print(f"  {'Resuming' if entry else 'Processing'} {pdf_info['filename']}...")
 
-    # Convert PDF to images
+    # Read the page count up front; pages are rendered lazily later
     try:
-        images = convert_pdf_to_images(pdf_path)
+        page_count = get_pdf_page_count(pdf_path)
     except Exception as e:
-        print(f"  Error converting PDF: {e}")
+        print(f"  Error reading PDF: {e}")
         return {"error": str(e)}
 
-    page_count = len(images)
     print(f"    Found {page_count} pages")
 
     # Get or create box record
     box_id = get_or_create_box(dynamodb, tables["box"], box_number)
 
-    # Create set record
-    create_set(
-        dynamodb, tables["set"], set_id, box_id,
-        pdf_info["filename"], page_count
+    if manifest:
+        manifest.start_pdf(set_id, pdf_path, fingerprint, page_count, box_id)
+
+    # The set record is written in the same batches as the set's first pages
+    set_item = None
+    if not (entry and entry["set_recorded"]):
+        set_item = build_set_item(set_id, box_id, pdf_info["filename"], page_count)
+
+    return {"box_id": box_id, "page_count": page_count, "set_item": set_item}
+
+
+def upload_page_range(pdf_path: Path, pdf_info: dict, box_id: str,
+                      first_page: int, last_page: int, page_count: int,
+                      s3_client, dynamodb, tables: dict, bucket: str,
+                      existing_s3_keys: set, set_item: dict | None = None,
+                      manifest: IngestManifest | None = None, lease_lost=None) -> dict:
+    """
+    Render, upload and record pages first_page..last_page of a PDF.
+
+    Runs the page pipeline and folds its stage statistics into
+    PIPELINE_STATS. Returns the pipeline result without the statistics.
+    """
+    result = run_page_pipeline(
+        pdf_path, pdf_info, box_id, first_page, last_page, page_count,
+        s3_client, dynamodb, tables, bucket, existing_s3_keys, set_item, manifest,
+        lease_lost
     )
+    for name, snapshot in result.pop("stage_stats").items():
+        PIPELINE_STATS[name].merge(snapshot)
+    return result
 
-    # Upload each page
-    # S3 path: {tenant}/{box}/{set}/page_xxxx.png
-    for page_num, image in enumerate(images, start=1):
-        s3_key = f"{TENANT_ID}/{box_number}/{set_id}/page_{page_num:04d}.png"
-        page_id = f"{set_id}_page_{page_num:04d}"
 
-        if s3_key not in existing_s3_keys:
-            upload_page_image(s3_client, bucket, image, s3_key)
-            print(f"    Uploaded page {page_num}/{page_count}")
-        else:
-            print(f"    Page {page_num} already exists in S3")
+def process_pdf(pdf_path: Path, pdf_info: dict, s3_client, dynamodb,
+                tables: dict, bucket: str, existing_s3_keys: set,
+                existing_sets: set, force: bool = False,
+                manifest: IngestManifest | None = None, lease_lost=None) -> dict:
+    """Process a single PDF file."""
+    prepared = prepare_set(
+        pdf_path, pdf_info, s3_client, dynamodb, tables, bucket,
+        existing_s3_keys, existing_sets, force, manifest
+    )
+    if "box_id" not in prepared:
+        return prepared
 
-        # Create page record
-        create_page(
-            dynamodb, tables["page"], page_id, set_id,
-            box_id, page_num, f"page_{page_num:04d}.png", s3_key
+    box_id = prepared["box_id"]
+    page_count = prepared["page_count"]
+
+    try:
+        result = upload_page_range(
+            pdf_path, pdf_info, box_id, 1, page_count, page_count,
+            s3_client, dynamodb, tables, bucket, existing_s3_keys,
+            prepared["set_item"], manifest, lease_lost
         )
+        if manifest and not result.get("error"):
+            record_skipped_pages(dynamodb, tables, manifest, pdf_info["setId"])
+    except Exception as e:
+        result = {"pages": 0, "sets": 0, "error": str(e)}
+
+    if isinstance(existing_s3_keys, S3KeyIndex):
+        existing_s3_keys.release(set_prefix(pdf_info))
 
-    # Recalculate box totals from actual data
-    recalculate_box_totals(dynamodb, tables, box_id)
+    if result.get("error"):
+        print(f"  Error processing PDF: {result['error']}")
+        return {"error": result["error"]}
+
+    if manifest:
+        manifest.complete_pdf(pdf_info["setId"])
 
     return {"pages": page_count, "box_id": box_id}
 
 
+# Per-process AWS clients for --workers mode, created once by _init_worker
+_worker_context: dict = {}
+
+
+def worker_config() -> dict:
+    """Module-level settings that worker processes must inherit from main()."""
+    return {
+        "RENDER_WINDOW": RENDER_WINDOW,
+        "RENDERER": RENDERER,
+        "ENCODE_THREADS": ENCODE_THREADS,
+        "UPLOAD_THREADS": UPLOAD_THREADS,
+        "PAGE_FORMAT": PAGE_FORMAT,
+        "JPEG_QUALITY": JPEG_QUALITY,
+        "ENCODE_SAMPLE_EVERY": ENCODE_SAMPLE_EVERY,
+        "BLANK_PAGES": BLANK_PAGES,
+        "THUMBNAIL_SIZE": THUMBNAIL_SIZE,
+        "VERIFY_MD5": VERIFY_MD5,
+    }
+
+
+def _init_worker(region: str, tenant_id: str, config: dict, tables: dict,
+                 bucket: str, manifest_path: str | None, lease_owner: str | None) -> None:
+    """Process pool initializer: copy run configuration and open AWS clients."""
+    global TENANT_ID, S3_BUCKET
+    TENANT_ID = tenant_id
+    S3_BUCKET = bucket
+    globals().update(config)
+
+    import boto3
+    session = boto3.Session(region_name=region)
+    _worker_context["s3_client"] = session.client("s3", config=s3_client_config())
+    _worker_context["dynamodb"] = session.resource("dynamodb")
+    _worker_context["tables"] = tables
+    _worker_context["bucket"] = bucket
+    _worker_context["manifest"] = (
+        IngestManifest(Path(manifest_path), tenant_id) if manifest_path else None
+    )
+    _worker_context["lease_lost"] = (
+        LeaseCheck(_worker_context["dynamodb"], tables["lease"], tenant_id, lease_owner)
+        if lease_owner else None
+    )
+
+
+def _upload_page_range_task(pdf_path: Path, pdf_info: dict, box_id: str,
+                            first_page: int, last_page: int, page_count: int,
+                            existing_s3_keys: set,
+                            set_item: dict | None = None) -> dict:
+    """Process pool task running the page pipeline for a range; never raises."""
+    try:
+        result = run_page_pipeline(
+            pdf_path, pdf_info, box_id, first_page, last_page, page_count,
+            _worker_context["s3_client"], _worker_context["dynamodb"],
+            _worker_context["tables"], _worker_context["bucket"],
+            existing_s3_keys, set_item, _worker_context["manifest"],
+            _worker_context["lease_lost"],
+        )
+    except Exception as e:
+        result = {"pages": 0, "sets": 0, "error": str(e)}
+    result["encode_stats"] = ENCODE_STATS.drain()
+    result["metrics"] = METRICS.drain()
+    if result.get("error"):
+        result["error"] = f"pages {first_page}-{last_page}: {result['error']}"
+    return result
+
+
+def worker_pool(workers: int, tables: dict, bucket: str,
+                manifest: IngestManifest | None = None,
+                leases: LeaseManager | None = None) -> ProcessPoolExecutor:
+    """Start the --workers process pool with the current run configuration."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(AWS_REGION, TENANT_ID, worker_config(), tables, bucket,
+                  str(manifest.path) if manifest else None,
+                  leases.owner if leases else None),
+    )
+
+
+def process_pdfs_parallel(pdf_jobs, workers: int, s3_client, dynamodb,
+                          tables: dict, bucket: str, existing_s3_keys: set,
+                          existing_sets: set, stats: dict, force: bool = False,
+                          manifest: IngestManifest | None = None,
+                          executor: ProcessPoolExecutor | None = None,
+                          on_done=None, leases: LeaseManager | None = None,
+                          max_pending: int | None = None) -> None:
+    """
+    Process PDFs on a pool of worker processes, merging results into stats.
+
+    Box and set records are created here, one PDF at a time, and each PDF's
+    pages are then handed to the pool in ranges of at most PAGES_PER_TASK
+    pages so large PDFs spread across workers too. A failed range marks its
+    PDF as an error without stopping the other PDFs. A long-lived `executor`
+    (--watch, --distributed) is used as is; otherwise a pool is started for
+    this call, checking `leases` from the workers. `on_done(set_id, result)`
+    is called as each PDF finishes.
+
+    `pdf_jobs` is read as PDFs are started. With `max_pending`, at most that
+    many PDFs are in progress at once and the next job is only taken when
+    one finishes; the jobs may then also yield None for "nothing to start
+    yet", and are asked again every CLAIM_POLL_SECONDS.
+    """
+    pending_sets = {}
+    futures = {}
+    jobs = iter(pdf_jobs)
+    exhausted = False
+
+    def finish(set_id: str, result: dict) -> None:
+        record_result(stats, result)
+        if on_done:
+            on_done(set_id, result)
+
+    def start(pdf_path: Path, pdf_info: dict) -> None:
+        prepared = prepare_set(
+            pdf_path, pdf_info, s3_client, dynamodb, tables, bucket,
+            existing_s3_keys, existing_sets, force, manifest
+        )
+        if "box_id" not in prepared:
+            finish(pdf_info["setId"], prepared)
+            return
+
+        set_id = pdf_info["setId"]
+        page_count = prepared["page_count"]
+        prefix = set_prefix(pdf_info)
+        if isinstance(existing_s3_keys, S3KeyIndex):
+            set_keys = existing_s3_keys.keys_under(prefix)
+            existing_s3_keys.release(prefix)
+        else:
+            set_keys = {k for k in existing_s3_keys if k.startswith(prefix)}
+
+        pending_sets[set_id] = {
+            "box_id": prepared["box_id"],
+            "page_count": page_count,
+            "remaining": 0,
+            "errors": [],
+        }
+        for first in range(1, page_count + 1, PAGES_PER_TASK):
+            last = min(first + PAGES_PER_TASK - 1, page_count)
+            # The set record travels with the first range's page batches
+            future = executor.submit(
+                _upload_page_range_task, pdf_path, pdf_info,
+                prepared["box_id"], first, last, page_count, set_keys,
+                prepared["set_item"] if first == 1 else None
+            )
+            futures[future] = set_id
+            pending_sets[set_id]["remaining"] += 1
+
+        if page_count == 0:
+            del pending_sets[set_id]
+            if prepared["set_item"] is not None:
+                with BatchWriter(dynamodb) as writer:
+                    writer.put(tables["set"], prepared["set_item"])
+                adjust_box_counters(dynamodb, tables["box"], prepared["box_id"], sets=1)
+                if manifest:
+                    manifest.mark_set_recorded(set_id)
+            if manifest:
+                manifest.complete_pdf(set_id)
+            finish(set_id, {"pages": 0})
+
+    def collect(future) -> None:
+        set_id = futures.pop(future)
+        entry = pending_sets[set_id]
+        try:
+            result = future.result()
+        except Exception as e:
+            # The worker process itself died (e.g. BrokenProcessPool)
+            result = {"error": str(e)}
+        for name, snapshot in result.get("stage_stats", {}).items():
+            PIPELINE_STATS[name].merge(snapshot)
+        if "encode_stats" in result:
+            ENCODE_STATS.merge(result["encode_stats"])
+        if "metrics" in result:
+            METRICS.merge(result["metrics"])
+        if result.get("error"):
+            print(f"  Error processing {set_id}: {result['error']}")
+            entry["errors"].append(result["error"])
+
+        # Box counters were updated by the workers, batch by batch
+        entry["remaining"] -= 1
+        if entry["remaining"] == 0:
+            del pending_sets[set_id]
+            if manifest and not entry["errors"]:
+                try:
+                    record_skipped_pages(dynamodb, tables, manifest, set_id)
+                except Exception as e:
+                    print(f"  Error processing {set_id}: {e}")
+                    entry["errors"].append(str(e))
+            if entry["errors"]:
+                finish(set_id, {"error": "; ".join(entry["errors"])})
+            else:
+                if manifest:
+                    manifest.complete_pdf(set_id)
+                print(f"  Finished {set_id} ({entry['page_count']} pages)")
+                finish(set_id, {"pages": entry["page_count"]})
+
+    pool = nullcontext(executor) if executor else worker_pool(workers, tables, bucket, manifest, leases)
+    with pool as executor:
+        while True:
+            while not exhausted and (max_pending is None or len(pending_sets) < max_pending):
+                job = next(jobs, StopIteration)
+                if job is StopIteration:
+                    exhausted = True
+                elif job is None:
+                    break
+                else:
+                    start(*job)
+            if not futures:
+                if exhausted:
+                    break
+                time.sleep(CLAIM_POLL_SECONDS)
+                continue
+            done, _ = wait(futures, timeout=None if exhausted else CLAIM_POLL_SECONDS,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+
+
+def record_result(stats: dict, result: dict) -> None:
+    """Fold a process_pdf-style result dict into the run summary."""
+    if result.get("skipped"):
+        stats["skipped"] += 1
+    elif result.get("error"):
+        stats["errors"] += 1
+    else:
+        stats["processed"] += 1
+        stats["pages"] += result.get("pages", 0)
+
+
+class InotifyWatcher:
+    """
+    Linux inotify on one folder through libc, without extra dependencies.
+
+    wait() returns the paths created, written or moved into the folder
+    since the last call, or an empty set after `timeout` seconds.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = 16  # int wd; uint32 mask, cookie, len
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, str(folder).encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def wait(self, timeout: float) -> set:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        paths = set()
+        offset = 0
+        while offset + self.EVENT_HEADER <= len(data):
+            name_len = int.from_bytes(data[offset + 12:offset + 16], sys.byteorder)
+            name = data[offset + self.EVENT_HEADER:offset + self.EVENT_HEADER + name_len]
+            name = name.rstrip(b"\0").decode(errors="replace")
+            if name:
+                paths.add(self.folder / name)
+            offset += self.EVENT_HEADER + name_len
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for InotifyWatcher: lists the folder every `timeout` seconds."""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+
+    def wait(self, timeout: float) -> set:
+        time.sleep(timeout)
+        return set(self.folder.iterdir())
+
+    def close(self) -> None:
+        pass
+
+
+def pdf_looks_complete(path: Path) -> bool:
+    """True if the file ends with a PDF %%EOF marker, i.e. the scanner finished it."""
+    with open(path, "rb") as f:
+        f.seek(max(0, path.stat().st_size - 1024))
+        return b"%%EOF" in f.read()
+
+
+def watch_folder(folder: Path, handle_files) -> None:
+    """
+    Call handle_files(paths) for each batch of new or changed scanner PDFs.
+
+    A file is handed over once it matches box_*.pdf, its size and mtime
+    have been stable for WATCH_SETTLE_SECONDS, and it ends with %%EOF.
+    Files already in the folder at startup go through the same checks,
+    since one may still be being written; the manifest skips the finished
+    ones. Runs until interrupted.
+    """
+    try:
+        watcher = InotifyWatcher(folder)
+        mode = "inotify"
+    except (OSError, AttributeError) as e:
+        # AttributeError: libc without inotify (macOS, BSD)
+        print(f"inotify unavailable ({e}); polling every {WATCH_POLL_SECONDS}s")
+        watcher = PollingWatcher(folder)
+        mode = "polling"
+
+    # path -> ((size, mtime_ns), first seen with that signature)
+    pending: dict[Path, tuple] = {}
+    # path -> signature when it was last handed over
+    handled: dict[Path, tuple] = {}
+
+    def signature(path: Path):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    initial = [path for path in folder.iterdir() if parse_pdf_filename(path.name)]
+    if initial:
+        print(f"\nFound {len(initial)} PDF files in {folder}; ingesting them once they have settled")
+        started = time.monotonic()
+        for path in initial:
+            current = signature(path)
+            if current is not None:
+                pending[path] = (current, started)
+
+    print(f"\nWatching {folder} for new scans ({mode}, {WATCH_SETTLE_SECONDS}s settle time). "
+          "Press Ctrl+C to stop.")
+    try:
+        while True:
+            timeout = WATCH_POLL_SECONDS if pending or mode == "polling" else 60
+            for path in watcher.wait(timeout):
+                if parse_pdf_filename(path.name):
+                    pending.setdefault(path, None)
+
+            now = time.monotonic()
+            ready = []
+            for path, seen in list(pending.items()):
+                current = signature(path)
+                if current is None or handled.get(path) == current:
+                    del pending[path]
+                elif seen is None or seen[0] != current:
+                    pending[path] = (current, now)
+                elif now - seen[1] >= WATCH_SETTLE_SECONDS and current[0] > 0:
+                    if pdf_looks_complete(path):
+                        ready.append(path)
+                        del pending[path]
+                        handled[path] = current
+
+            if ready:
+                print(f"\n{len(ready)} new scan(s) ready: {', '.join(p.name for p in sorted(ready))}")
+                handle_files(sorted(ready))
+                print(f"\nWatching {folder} for new scans...")
+    finally:
+        watcher.close()
+
+
 def main():
+    global AWS_REGION, TENANT_ID, S3_BUCKET, RENDER_WINDOW, RENDERER, ENCODE_THREADS, UPLOAD_THREADS
+    global PAGE_FORMAT, JPEG_QUALITY, ENCODE_SAMPLE_EVERY, BLANK_PAGES, THUMBNAIL_SIZE
+    global VERIFY_MD5, METRICS_INTERVAL, WATCH_SETTLE_SECONDS, LEASE_SECONDS
+
     if len(sys.argv) < 2:
         print("Usage: python upload_pages.py /path/to/scanned/pdfs [OPTIONS]")
         print("       python upload_pages.py /path/to/file.pdf [OPTIONS]")
@@ -456,6 +2945,33 @@ def main():
         print("  --env ENV_ID      Specify the environment ID (the code between hyphens in table names)")
         print("  --tenant TENANT   Specify the tenant ID (required for multi-tenant setup)")
         print("  --force           Re-upload files even if they exist in DynamoDB")
+        print("  --refresh-env     Look up tables and bucket again instead of using the cached environment")
+        print(f"  --renderer NAME   Page renderer: {', '.join(RENDERERS)} (default: {RENDERER})")
+        print(f"  --render-window N Pages rendered per pdftoppm call (default: {RENDER_WINDOW})")
+        print("  --workers N       Render and upload on N worker processes (default: 1)")
+        print(f"  --encode-threads N  Image encode threads per PDF (default: {ENCODE_THREADS})")
+        print(f"  --upload-threads N  S3 upload threads per PDF (default: {UPLOAD_THREADS})")
+        print("  --verify-md5      Send a Content-MD5 with each upload so S3 rejects corrupted bodies")
+        print("  --rebuild-totals  Recount every box's totals from its sets and pages (no input path)")
+        print(f"  --manifest PATH   Ingest manifest location (default: <pdf folder>/{MANIFEST_FILENAME})")
+        print("  --stats-json PATH Write the run's throughput and stage statistics as JSON")
+        print("  --distributed     Claim each PDF with a DynamoDB lease so several machines can share the work")
+        print(f"  --lease-seconds N With --distributed, lease expiry without heartbeats (default: {LEASE_SECONDS})")
+        print("  --file-list PATH  Process the PDFs listed in PATH, one per line, instead of a folder")
+        print("  --watch           Keep running and ingest new box_*.pdf files as the scanner writes them")
+        print(f"  --settle N        With --watch, seconds a file must stop changing (default: {WATCH_SETTLE_SECONDS})")
+        print("  --metrics PATH    Write operation latency histograms and byte counts as JSON lines,")
+        print("                    or a Prometheus text file if PATH ends in .prom")
+        print(f"  --metrics-interval N  Seconds between metrics writes during a run (default: {METRICS_INTERVAL})")
+        print("  --reconcile       Check S3 and DynamoDB for work done outside this manifest")
+        print("  --bloom-filter    With --reconcile, hold known S3 keys in a compact Bloom filter")
+        print(f"  --format FORMAT   Page image format: {', '.join(PAGE_FORMATS)} (default: {PAGE_FORMAT})")
+        print("                    auto = 1-bit PNG for text, lossless WebP for grayscale, JPEG for color")
+        print(f"  --jpeg-quality N  JPEG quality for color pages (default: {JPEG_QUALITY})")
+        print(f"  --encode-sample N Also encode every Nth page as PNG to report savings, 0 = off "
+              f"(default: {ENCODE_SAMPLE_EVERY})")
+        print(f"  --thumbnail-size N  Long edge of page thumbnails in pixels, 0 = none (default: {THUMBNAIL_SIZE})")
+        print(f"  --blank-pages MODE  Blank pages: mark, shred (auto-review) or skip (default: {BLANK_PAGES})")
         print("\nEnvironment variables (alternative to options):")
         print("  AWS_REGION - AWS region (default: us-east-1)")
         print("  S3_BUCKET - S3 bucket name (auto-detected from amplify_outputs.json)")
@@ -468,6 +2984,20 @@ def main():
     input_path_str = None
     force_upload = False
     tenant_id_arg = None
+    render_window = None
+    workers = 1
+    encode_threads = None
+    upload_threads = None
+    rebuild_totals = False
+    manifest_path_str = None
+    stats_json_path = None
+    metrics_path_str = None
+    watch = False
+    distributed = False
+    file_list_str = None
+    reconcile = False
+    use_bloom = False
+    refresh_env = False
 
     i = 0
     while i < len(args):
@@ -488,41 +3018,217 @@ def main():
         elif args[i] == "--force":
             force_upload = True
             i += 1
+        elif args[i] == "--refresh-env":
+            refresh_env = True
+            i += 1
+        elif args[i] == "--rebuild-totals":
+            rebuild_totals = True
+            i += 1
+        elif args[i] == "--manifest":
+            if i + 1 < len(args):
+                manifest_path_str = args[i + 1]
+                i += 2
+            else:
+                print("Error: --manifest requires an argument")
+                sys.exit(1)
+        elif args[i] == "--distributed":
+            distributed = True
+            i += 1
+        elif args[i] == "--lease-seconds":
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                LEASE_SECONDS = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --lease-seconds requires a positive integer")
+                sys.exit(1)
+        elif args[i] == "--file-list":
+            if i + 1 < len(args):
+                file_list_str = args[i + 1]
+                i += 2
+            else:
+                print("Error: --file-list requires a path")
+                sys.exit(1)
+        elif args[i] == "--watch":
+            watch = True
+            i += 1
+        elif args[i] == "--settle":
+            if i + 1 < len(args) and args[i + 1].isdigit():
+                WATCH_SETTLE_SECONDS = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --settle requires a number of seconds")
+                sys.exit(1)
+        elif args[i] == "--metrics":
+            if i + 1 < len(args):
+                metrics_path_str = args[i + 1]
+                i += 2
+            else:
+                print("Error: --metrics requires a path")
+                sys.exit(1)
+        elif args[i] == "--metrics-interval":
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                METRICS_INTERVAL = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --metrics-interval requires a positive number of seconds")
+                sys.exit(1)
+        elif args[i] == "--stats-json":
+            if i + 1 < len(args):
+                stats_json_path = args[i + 1]
+                i += 2
+            else:
+                print("Error: --stats-json requires a path")
+                sys.exit(1)
+        elif args[i] == "--verify-md5":
+            VERIFY_MD5 = True
+            i += 1
+        elif args[i] == "--reconcile":
+            reconcile = True
+            i += 1
+        elif args[i] == "--bloom-filter":
+            use_bloom = True
+            i += 1
+        elif args[i] == "--format":
+            if i + 1 < len(args) and args[i + 1] in PAGE_FORMATS:
+                PAGE_FORMAT = args[i + 1]
+                i += 2
+            else:
+                print(f"Error: --format requires one of: {', '.join(PAGE_FORMATS)}")
+                sys.exit(1)
+        elif args[i] == "--jpeg-quality":
+            if i + 1 < len(args) and args[i + 1].isdigit() and 1 <= int(args[i + 1]) <= 95:
+                JPEG_QUALITY = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --jpeg-quality requires an integer from 1 to 95")
+                sys.exit(1)
+        elif args[i] == "--encode-sample":
+            if i + 1 < len(args) and args[i + 1].isdigit():
+                ENCODE_SAMPLE_EVERY = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --encode-sample requires a non-negative integer")
+                sys.exit(1)
+        elif args[i] == "--thumbnail-size":
+            if i + 1 < len(args) and args[i + 1].isdigit():
+                THUMBNAIL_SIZE = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --thumbnail-size requires a non-negative integer")
+                sys.exit(1)
+        elif args[i] == "--blank-pages":
+            if i + 1 < len(args) and args[i + 1] in BLANK_PAGE_MODES:
+                BLANK_PAGES = args[i + 1]
+                i += 2
+            else:
+                print(f"Error: --blank-pages requires one of: {', '.join(BLANK_PAGE_MODES)}")
+                sys.exit(1)
+        elif args[i] == "--renderer":
+            if i + 1 < len(args) and args[i + 1] in RENDERERS:
+                RENDERER = args[i + 1]
+                i += 2
+            else:
+                print(f"Error: --renderer requires one of: {', '.join(RENDERERS)}")
+                sys.exit(1)
+            if RENDERER == "pymupdf" and not pymupdf_installed():
+                print("Error: --renderer pymupdf requires PyMuPDF (pip install pymupdf)")
+                sys.exit(1)
+        elif args[i] == "--render-window":
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                render_window = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --render-window requires a positive integer")
+                sys.exit(1)
+        elif args[i] == "--workers":
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                workers = int(args[i + 1])
+                i += 2
+            else:
+                print("Error: --workers requires a positive integer")
+                sys.exit(1)
+        elif args[i] in ("--encode-threads", "--upload-threads"):
+            if i + 1 < len(args) and args[i + 1].isdigit() and int(args[i + 1]) > 0:
+                if args[i] == "--encode-threads":
+                    encode_threads = int(args[i + 1])
+                else:
+                    upload_threads = int(args[i + 1])
+                i += 2
+            else:
+                print(f"Error: {args[i]} requires a positive integer")
+                sys.exit(1)
         elif input_path_str is None:
             input_path_str = args[i]
             i += 1
         else:
             i += 1
 
-    if not input_path_str:
+    if not input_path_str and not rebuild_totals and not file_list_str:
         print("Error: No input path specified")
         sys.exit(1)
 
-    input_path = Path(input_path_str)
-    if not input_path.exists():
+    file_list = None
+    if file_list_str:
+        list_path = Path(file_list_str)
+        if not list_path.is_file() or watch:
+            print("Error: --file-list requires an existing file and can't be combined with --watch")
+            sys.exit(1)
+        file_list = [
+            (list_path.parent / line.strip()).resolve()
+            for line in list_path.read_text().splitlines()
+            if line.strip() and not line.startswith("#")
+        ]
+        input_path_str = input_path_str or str(list_path.parent)
+
+    input_path = Path(input_path_str) if input_path_str else None
+    if input_path and not input_path.exists():
         print(f"Error: Path not found: {input_path}")
         sys.exit(1)
 
     # Determine if input is a single file or directory
-    single_file_mode = input_path.is_file() and input_path.suffix.lower() == ".pdf"
+    single_file_mode = (
+        input_path is not None
+        and input_path.is_file()
+        and input_path.suffix.lower() == ".pdf"
+    )
+    if watch and (input_path is None or not input_path.is_dir()):
+        print("Error: --watch requires a folder to watch")
+        sys.exit(1)
 
     # Load configuration
     load_amplify_config()
 
-    global AWS_REGION, TENANT_ID, S3_BUCKET
+    if render_window:
+        RENDER_WINDOW = render_window
+    if encode_threads:
+        ENCODE_THREADS = encode_threads
+    if upload_threads:
+        UPLOAD_THREADS = upload_threads
     AWS_REGION = os.environ.get("AWS_REGION", AWS_REGION)
     # Command line --tenant takes precedence over env var
     TENANT_ID = tenant_id_arg or os.environ.get("TENANT_ID", TENANT_ID)
     print(f"Using tenant ID: {TENANT_ID}")
 
     # Initialize AWS clients
+    import boto3
     session = boto3.Session(region_name=AWS_REGION)
-    s3_client = session.client("s3")
-    dynamodb_client = session.client("dynamodb")
+    s3_client = session.client("s3", config=s3_client_config())
     dynamodb = session.resource("dynamodb")
-
-    # Find DynamoDB tables
-    tables_result = find_dynamodb_tables(dynamodb_client, env_id)
+    dynamodb_client = dynamodb.meta.client
+
+    # Find DynamoDB tables, from the discovery cache if it is still valid
+    cache_key = discovery_cache_key(env_id)
+    cached = None if refresh_env else load_cached_environment(cache_key)
+    if cached and distributed and "lease" not in cached["tables"]:
+        cached = None  # the lease table may have been deployed since
+    if cached and not cached_environment_exists(dynamodb_client, s3_client, cached):
+        print("Cached environment no longer exists, looking it up again")
+        cached = None
+    if cached:
+        tables_result = cached["tables"]
+        print(f"Using cached environment from {DISCOVERY_CACHE_PATH} (--refresh-env to look it up again)")
+    else:
+        tables_result = find_dynamodb_tables(dynamodb_client, env_id)
 
     # Check if multiple environments found
     if isinstance(tables_result, list):
@@ -535,18 +3241,17 @@ def main():
         for env in tables_result:
             env_code = env["env_id"]
             box_table = env["tables"].get("box", "not found")
-            # Get row count for box table
+            # DynamoDB's item count, refreshed about every six hours, instead of scanning the table
             try:
-                table = dynamodb.Table(box_table)
-                count = table.scan(Select="COUNT")["Count"]
+                count = dynamodb_client.describe_table(TableName=box_table)["Table"]["ItemCount"]
             except Exception:
                 count = "?"
             print(f"\n  --env {env_code}")
             print(f"       Box table: {box_table}")
-            print(f"       Boxes in DB: {count}")
+            print(f"       Boxes in DB: ~{count}")
         print("\n" + "-" * 60)
         print("\nExample:")
-        print(f"  python upload_pages.py {input_path} --env {tables_result[0]['env_id']}")
+        print(f"  python upload_pages.py {' '.join(args)} --env {tables_result[0]['env_id']}")
         print()
         sys.exit(1)
 
@@ -558,9 +3263,21 @@ def main():
         sys.exit(1)
 
     print(f"Using tables: {tables}")
+    if not cached:
+        save_cached_environment(cache_key, tables)
+
+    if distributed and "lease" not in tables:
+        print("Error: --distributed needs the Box2CloudIngestLease table. Deploy the Amplify backend first.")
+        sys.exit(1)
+
+    if rebuild_totals:
+        rebuild_tenant_totals(dynamodb, tables)
+        return
 
     # Handle S3 bucket - use from config or find it
     S3_BUCKET = os.environ.get("S3_BUCKET", S3_BUCKET)
+    if not S3_BUCKET and cached:
+        S3_BUCKET = cached.get("bucket")
     if not S3_BUCKET:
         bucket_result = find_s3_buckets(s3_client, env_id)
         if isinstance(bucket_result, list):
@@ -573,6 +3290,7 @@ def main():
             print("\nSet S3_BUCKET environment variable or use --env to filter.")
             sys.exit(1)
         S3_BUCKET = bucket_result
+        save_cached_environment(cache_key, tables, S3_BUCKET)
 
     if not S3_BUCKET:
         print("Error: S3_BUCKET not set. Deploy Amplify first or set S3_BUCKET env var.")
@@ -580,43 +3298,69 @@ def main():
 
     print(f"Using S3 bucket: {S3_BUCKET}")
 
-    # Get existing data
-    existing_s3_keys = get_existing_s3_keys(s3_client, S3_BUCKET, TENANT_ID)
-    existing_sets = get_existing_sets(dynamodb, tables["set"])
-    if force_upload:
-        print("Force mode: will delete and re-upload existing files")
-
-    # Find PDFs to process
-    if single_file_mode:
-        pdf_files = [input_path]
-        print(f"\nProcessing single file: {input_path.name}")
-    else:
-        pdf_files = list(input_path.glob("*.pdf")) + list(input_path.glob("*.PDF"))
-        print(f"\nFound {len(pdf_files)} PDF files in {input_path}")
+    # The manifest lives next to the scans unless --manifest says otherwise
+    scan_folder = input_path.parent if single_file_mode else input_path
+    manifest_name = MANIFEST_FILENAME
+    if distributed:
+        # Nodes sharing a network folder must not share one SQLite file
+        import socket
+        manifest_name = manifest_name.replace(".sqlite", f".{socket.gethostname()}.sqlite")
+    manifest = IngestManifest(
+        Path(manifest_path_str) if manifest_path_str else scan_folder / manifest_name,
+        TENANT_ID,
+    )
+    print(f"Using manifest: {manifest.path}")
 
     # Process each PDF
     stats = {"processed": 0, "skipped": 0, "errors": 0, "pages": 0}
-
-    for pdf_path in sorted(pdf_files):
-        pdf_info = parse_pdf_filename(pdf_path.name)
-
-        if not pdf_info:
-            print(f"  Skipping {pdf_path.name} - doesn't match expected format")
-            continue
-
-        result = process_pdf(
-            pdf_path, pdf_info, s3_client, dynamodb,
-            tables, S3_BUCKET, existing_s3_keys, existing_sets,
-            force=force_upload
+    run_started = time.perf_counter()
+    reporter = MetricsReporter(Path(metrics_path_str), stats) if metrics_path_str else None
+    leases = LeaseManager(dynamodb, tables["lease"], TENANT_ID) if distributed else None
+    if leases:
+        print(f"Distributed mode: claiming PDFs as {leases.owner}")
+
+    if watch:
+        executor = worker_pool(workers, tables, S3_BUCKET, manifest, leases) if workers > 1 else None
+        try:
+            watch_folder(
+                input_path,
+                lambda pdf_files: process_files(
+                    pdf_files, s3_client, dynamodb, tables, manifest, stats, workers,
+                    force=force_upload, reconcile=reconcile, use_bloom=use_bloom,
+                    executor=executor, leases=leases,
+                ),
+            )
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+        finally:
+            if executor:
+                executor.shutdown()
+    else:
+        # Find PDFs to process
+        if file_list is not None:
+            pdf_files = file_list
+            print(f"\nProcessing {len(pdf_files)} PDF files from {file_list_str}")
+        elif single_file_mode:
+            pdf_files = [input_path]
+            print(f"\nProcessing single file: {input_path.name}")
+        else:
+            pdf_files = list(input_path.glob("*.pdf")) + list(input_path.glob("*.PDF"))
+            print(f"\nFound {len(pdf_files)} PDF files in {input_path}")
+        if force_upload:
+            print("Force mode: will delete and re-upload existing files")
+        if workers > 1:
+            print(f"Using {workers} worker processes")
+
+        process_files(
+            pdf_files, s3_client, dynamodb, tables, manifest, stats, workers,
+            force=force_upload, reconcile=reconcile, use_bloom=use_bloom, leases=leases,
         )
 
-        if result.get("skipped"):
-            stats["skipped"] += 1
-        elif result.get("error"):
-            stats["errors"] += 1
-        else:
-            stats["processed"] += 1
-            stats["pages"] += result.get("pages", 0)
+    if leases:
+        leases.close()
+    manifest.close()
+    if reporter:
+        reporter.close()
 
     # Print summary
     print(f"\n{'='*50}")
@@ -624,6 +3368,124 @@ def main():
     print(f"  Processed: {stats['processed']} sets ({stats['pages']} pages)")
     print(f"  Skipped:   {stats['skipped']} (already uploaded)")
     print(f"  Errors:    {stats['errors']}")
+    wall_seconds = time.perf_counter() - run_started
+    print_transfer_stats(wall_seconds)
+    print_pipeline_stats()
+    print_encode_stats()
+
+    if stats_json_path:
+        with open(stats_json_path, "w") as f:
+            json.dump(run_summary(stats, wall_seconds), f, indent=2)
+
+
+def process_files(pdf_files: list, s3_client, dynamodb, tables: dict,
+                  manifest: IngestManifest, stats: dict, workers: int = 1,
+                  force: bool = False, reconcile: bool = False, use_bloom: bool = False,
+                  executor: ProcessPoolExecutor | None = None,
+                  leases: LeaseManager | None = None) -> None:
+    """
+    Check which PDFs still need work and ingest them, folding results into stats.
+
+    Called once for a normal run and once per batch of settled files in
+    --watch mode, where the AWS clients, box ID cache and worker pool stay
+    warm between calls. With `leases` (--distributed), each PDF is claimed
+    as a worker frees up for it, at most `workers` at a time on one pool,
+    so several ingesters can share one folder or file list. PDFs claimed by
+    another ingester are tried again until they are done, or their lease
+    expires and this ingester takes them over.
+    """
+    pdf_jobs = []
+    for pdf_path in sorted(pdf_files):
+        pdf_info = parse_pdf_filename(pdf_path.name)
+
+        if not pdf_info:
+            print(f"  Skipping {pdf_path.name} - doesn't match expected format")
+            continue
+
+        pdf_jobs.append((pdf_path, pdf_info))
+
+    # Only check what already exists remotely when explicitly asked to, and
+    # then only under the prefixes of the PDFs being processed
+    existing_s3_keys = set()
+    if reconcile:
+        bloom_capacity = len(pdf_jobs) * BLOOM_PAGES_PER_PDF if use_bloom else None
+        existing_s3_keys = S3KeyIndex(s3_client, S3_BUCKET, bloom_capacity)
+        existing_s3_keys.prefetch(set_prefix(pdf_info) for _, pdf_info in pdf_jobs)
+        existing_sets = find_existing_sets(
+            dynamodb, tables, [pdf_info for _, pdf_info in pdf_jobs]
+        )
+    else:
+        # PDFs the manifest has never seen still get a cheap point lookup, so
+        # a folder ingested from another machine isn't uploaded twice
+        unseen = [pdf_info for _, pdf_info in pdf_jobs
+                  if manifest.get_pdf(pdf_info["setId"]) is None]
+        existing_sets = lookup_sets(dynamodb, tables, unseen) if unseen else set()
+
+    def on_done(set_id: str, result: dict) -> None:
+        if leases:
+            # Done only once every page has been through the pipeline, or
+            # skipped for good (e.g. ingested by an older version); anything
+            # else goes back for any ingester to retry
+            entry = manifest.get_pdf(set_id)
+            if result.get("skipped") or (entry and entry["status"] == "complete"):
+                leases.complete(set_id)
+            else:
+                leases.release(set_id)
+
+    def claims():
+        """The PDFs this ingester claims, one at a time; None while it waits on others."""
+        remaining = list(pdf_jobs)
+        # Claimed by other ingesters; tried again once `remaining` is done
+        waiting = []
+        while remaining or waiting:
+            if not remaining:
+                print(f"  Waiting for {len(waiting)} PDFs claimed by other ingesters...")
+                retry_at = time.monotonic() + leases.lease_seconds / 3
+                while time.monotonic() < retry_at:
+                    yield None
+                remaining, waiting = waiting, []
+                continue
+            pdf_path, pdf_info = remaining.pop(0)
+            if leases.acquire(pdf_info["setId"]):
+                # Whoever held the lease before (one that expired or was
+                # given back) may have written part of the PDF
+                entry = manifest.get_pdf(pdf_info["setId"])
+                if not force and not (entry and entry["status"] == "complete"):
+                    adopt_remote_progress(dynamodb, tables, manifest, pdf_path, pdf_info)
+                yield pdf_path, pdf_info
+            elif leases.is_done(pdf_info["setId"]):
+                print(f"  Skipping {pdf_path.name} - finished by another ingester")
+                stats["skipped"] += 1
+            else:
+                waiting.append((pdf_path, pdf_info))
+
+    # PDFs are claimed as they are started, so with `leases` a PDF is only
+    # claimed once a worker is free for it
+    jobs = pdf_jobs if leases is None else claims()
+    if workers > 1:
+        process_pdfs_parallel(
+            jobs, workers, s3_client, dynamodb, tables, S3_BUCKET,
+            existing_s3_keys, existing_sets, stats, force=force,
+            manifest=manifest, executor=executor, on_done=on_done, leases=leases,
+            max_pending=workers if leases else None
+        )
+    else:
+        for job in jobs:
+            if job is None:
+                time.sleep(CLAIM_POLL_SECONDS)
+                continue
+            pdf_path, pdf_info = job
+            result = process_pdf(
+                pdf_path, pdf_info, s3_client, dynamodb,
+                tables, S3_BUCKET, existing_s3_keys, existing_sets,
+                force=force, manifest=manifest,
+                lease_lost=leases.is_lost if leases else None
+            )
+            record_result(stats, result)
+            on_done(pdf_info["setId"], result)
+
+    if isinstance(existing_s3_keys, S3KeyIndex):
+        existing_s3_keys.close()
 
 
 if __name__ == "__main__":